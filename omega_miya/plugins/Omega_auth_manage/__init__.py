@@ -6,7 +6,7 @@ from nonebot.typing import T_State
 from nonebot.adapters.cqhttp.bot import Bot
 from nonebot.adapters.cqhttp.event import MessageEvent
 from omega_miya.utils.Omega_Base import DBUser, DBGroup, DBAuth
-from omega_miya.utils.Omega_plugin_utils import init_export
+from omega_miya.utils.Omega_plugin_utils import init_export, PermissionCache
 
 
 # Custom plugin usage text
@@ -167,6 +167,12 @@ async def handle_auth_node(bot: Bot, event: MessageEvent, state: T_State):
         logger.error(f'handle_auth_node 执行时 sub_command 变量检验错误')
         return
 
+    # 清除对应用户或群组的权限缓存
+    if auth_type == 'user':
+        PermissionCache.invalidate(user_id=int(auth_id))
+    else:
+        PermissionCache.invalidate(group_id=int(auth_id))
+
     if res.success():
         logger.info(f'已成功为 {auth_type}/{auth_id} {sub_command} 了权限节点 {r_auth_node}: {res.info}')
         await omegaauth.finish(f'{auth_type}/{auth_id} {r_auth_node} 权限节点 {sub_command} 操作成功')
@@ -15,7 +15,7 @@ from nonebot.adapters.cqhttp.bot import Bot
 from nonebot.adapters.cqhttp.event import MessageEvent, GroupMessageEvent, PrivateMessageEvent
 from nonebot.adapters.cqhttp.permission import GROUP_ADMIN, GROUP_OWNER, PRIVATE_FRIEND
 from omega_miya.utils.Omega_Base import DBGroup, DBUser, DBAuth, DBFriend, Result
-from omega_miya.utils.Omega_plugin_utils import init_export
+from omega_miya.utils.Omega_plugin_utils import init_export, PermissionCache
 from .sys_background_scheduled import scheduler
 
 # Custom plugin usage text
@@ -93,6 +93,8 @@ async def handle_sub_command(bot: Bot, event: GroupMessageEvent, state: T_State)
     if sub_command not in command.keys():
         await omega.finish('没有这个命令哦QAQ')
     result = await command[sub_command](bot=bot, event=event, state=state)
+    # 群组权限可能已被修改, 清除权限缓存
+    PermissionCache.invalidate(group_id=event.group_id)
     if result.success():
         logger.info(f"Group: {event.group_id}, {sub_command}, Success, {result.info}")
         if sub_command in need_reply:
@@ -125,6 +127,8 @@ async def handle_sub_command(bot: Bot, event: PrivateMessageEvent, state: T_Stat
     if sub_command not in command.keys():
         await omega.finish('没有这个命令哦QAQ')
     result = await command[sub_command](bot=bot, event=event, state=state)
+    # 好友权限可能已被修改, 清除权限缓存
+    PermissionCache.invalidate(user_id=event.user_id)
     if result.success():
         logger.info(f"Private friend: {event.user_id}, {sub_command}, Success, {result.info}")
         if sub_command in need_reply:
@@ -259,49 +263,21 @@ async def group_upgrade(bot: Bot, event: GroupMessageEvent, state: T_State) -> R
     if not _result.success():
         return Result.IntResult(True, _result.info, -1)
 
-    # 更新用户
+    # 更新群成员, 只写入新增, 退群及昵称变化的成员
     group_member_list = await bot.call_api(api='get_group_member_list', group_id=group_id)
-    failed_user = []
-
-    # 首先清除数据库中退群成员
-    exist_member_list = []
-    for user_info in group_member_list:
-        user_qq = user_info['user_id']
-        exist_member_list.append(int(user_qq))
-
-    db_member_list = []
-    member_res = await group.member_list()
-    for user_id, nickname in member_res.result:
-        db_member_list.append(user_id)
-    del_member_list = list(set(db_member_list).difference(set(exist_member_list)))
-
-    for user_id in del_member_list:
-        await group.member_del(user=DBUser(user_id=user_id))
-
-    # 更新群成员
+    members = []
     for user_info in group_member_list:
-        # 用户信息
-        user_qq = user_info['user_id']
         user_nickname = user_info['nickname']
         user_group_nickmane = user_info['card']
         if not user_group_nickmane:
             user_group_nickmane = user_nickname
+        members.append((int(user_info['user_id']), user_nickname, user_group_nickmane))
 
-        _user = DBUser(user_id=user_qq)
-        _result = await _user.add(nickname=user_nickname)
-        if not _result.success():
-            failed_user.append(_user.qq)
-            logger.warning(f'User: {user_qq}, {_result.info}')
-            continue
-
-        _result = await group.member_add(user=_user, user_group_nickname=user_group_nickmane)
-        if not _result.success():
-            failed_user.append(_user.qq)
-            logger.warning(f'User: {user_qq}, {_result.info}')
-
-    await group.init_member_status()
+    _result = await group.member_sync(members=members)
+    if not _result.success():
+        return Result.IntResult(True, _result.info, -1)
 
-    return Result.IntResult(False, f'Success with ignore user: {failed_user}', 0)
+    return Result.IntResult(False, f'Success, {_result.result}', 0)
 
 
 async def set_group_notice(bot: Bot, event: GroupMessageEvent, state: T_State) -> Result.IntResult:
@@ -406,6 +382,7 @@ async def init_group_auth_node(group_id: int):
         res = await auth.set(allow_tag=auth_node.allow_tag, deny_tag=auth_node.deny_tag, auth_info=auth_node.auth_info)
         if res.error:
             logger.opt(colors=True).error(f'配置默认权限失败, <ly>{auth_node.node}/{group_id}</ly>, error: {res.info}')
+    PermissionCache.invalidate(group_id=group_id)
 
 
 async def init_user_auth_node(user_id: int):
@@ -428,3 +405,4 @@ async def init_user_auth_node(user_id: int):
         res = await auth.set(allow_tag=auth_node.allow_tag, deny_tag=auth_node.deny_tag, auth_info=auth_node.auth_info)
         if res.error:
             logger.opt(colors=True).error(f'配置默认权限失败, <ly>{auth_node.node}/{user_id}</ly>, error: {res.info}')
+    PermissionCache.invalidate(user_id=user_id)
@@ -1,10 +1,14 @@
 """
 各类bot后台任务
 """
+import asyncio
+import hashlib
 import nonebot
+from typing import Dict
 from nonebot import logger, require
-from omega_miya.utils.Omega_Base import DBGroup, DBUser, DBFriend, DBStatus, DBCoolDownEvent, DBTable
-from omega_miya.utils.Omega_plugin_utils import HttpFetcher
+from nonebot.adapters.cqhttp.bot import Bot
+from omega_miya.utils.Omega_Base import DBGroup, DBFriend, DBStatus, DBTable
+from omega_miya.utils.Omega_plugin_utils import HttpFetcher, PermissionCache, CoolDownStore
 
 
 global_config = nonebot.get_driver().config
@@ -12,12 +16,51 @@ ENABLE_PROXY = global_config.enable_proxy
 PROXY_CHECK_URL = global_config.proxy_check_url
 PROXY_CHECK_TIMEOUT = global_config.proxy_check_timeout
 
+# 同时更新群组信息的最大群组数
+REFRESH_GROUP_CONCURRENCY = 4
+# 上次成功更新时各群组信息及成员列表的摘要
+__GROUP_SNAPSHOT_HASH: Dict[int, str] = {}
+
 # 获取scheduler
 scheduler = require("nonebot_plugin_apscheduler").scheduler
 
 logger.opt(colors=True).debug('<lg>初始化 Omega 后台任务...</lg>')
 
 
+async def refresh_single_group_info(bot: Bot, group_id: int):
+    # 调用api获取群信息
+    group_info = await bot.call_api(api='get_group_info', group_id=group_id)
+    group_name = group_info['group_name']
+    group_member_list = await bot.call_api(api='get_group_member_list', group_id=group_id)
+
+    members = []
+    for user_info in group_member_list:
+        user_nickname = user_info['nickname']
+        user_group_nickmane = user_info['card']
+        if not user_group_nickmane:
+            user_group_nickmane = user_nickname
+        members.append((int(user_info['user_id']), user_nickname, user_group_nickmane))
+
+    # 群信息及成员无变化则跳过
+    snapshot_hash = hashlib.sha1(
+        repr((group_name, sorted(members))).encode('utf-8')).hexdigest()
+    if __GROUP_SNAPSHOT_HASH.get(group_id) == snapshot_hash:
+        logger.debug(f'Refresh group info, Group: {group_id} not changed, skipped')
+        return
+
+    group = DBGroup(group_id=group_id)
+    # 更新群信息
+    await group.add(name=group_name)
+    # 更新群成员, 只写入新增, 退群及昵称变化的成员
+    sync_result = await group.member_sync(members=members)
+    if sync_result.error:
+        logger.warning(f'Refresh group info, Group: {group_id}, member sync failed, {sync_result.info}')
+        return
+
+    __GROUP_SNAPSHOT_HASH[group_id] = snapshot_hash
+    logger.info(f'Refresh group info completed, Group: {group_id}, {sync_result.result}')
+
+
 # 创建自动更新群组信息的定时任务
 @scheduler.scheduled_job(
     'cron',
@@ -55,55 +98,20 @@ async def refresh_group_info():
             disable_result = await DBGroup(group_id=group).permission_set(notice=-1, command=-1, level=-1)
             if disable_result.error:
                 logger.warning(f'Disable expire group {group} failed, {disable_result.info}')
+            PermissionCache.invalidate(group_id=group)
+
+        # 执行群组信息更新, 限制同时更新的群组数
+        semaphore = asyncio.Semaphore(REFRESH_GROUP_CONCURRENCY)
+
+        async def _refresh_group(_group_id: int):
+            async with semaphore:
+                try:
+                    await refresh_single_group_info(bot=bot, group_id=_group_id)
+                except Exception as _e:
+                    logger.error(f'Refresh group info failed, Bot: {bot_id}, Group: {_group_id}, error: {repr(_e)}')
 
-        # 执行群组信息更新
-        for group in group_list:
-            group_id = group.get('group_id')
-            # 调用api获取群信息
-            group_info = await bot.call_api(api='get_group_info', group_id=group_id)
-            group_name = group_info['group_name']
-            group = DBGroup(group_id=group_id)
-
-            # 更新群信息
-            await group.add(name=group_name)
-
-            # 更新用户
-            group_member_list = await bot.call_api(api='get_group_member_list', group_id=group_id)
-
-            # 首先清除数据库中退群成员
-            exist_member_list = []
-            for user_info in group_member_list:
-                user_qq = user_info['user_id']
-                exist_member_list.append(int(user_qq))
-
-            db_member_list = []
-            member_res = await group.member_list()
-            for user_id, nickname in member_res.result:
-                db_member_list.append(user_id)
-            del_member_list = list(set(db_member_list).difference(set(exist_member_list)))
-
-            for user_id in del_member_list:
-                await group.member_del(user=DBUser(user_id=user_id))
-
-            # 更新群成员
-            for user_info in group_member_list:
-                # 用户信息
-                user_qq = user_info['user_id']
-                user_nickname = user_info['nickname']
-                user_group_nickmane = user_info['card']
-                if not user_group_nickmane:
-                    user_group_nickmane = user_nickname
-                _user = DBUser(user_id=user_qq)
-                _result = await _user.add(nickname=user_nickname)
-                if not _result.success():
-                    logger.warning(f'Refresh group info, User: {user_qq}, {_result.info}')
-                    continue
-                _result = await group.member_add(user=_user, user_group_nickname=user_group_nickmane)
-                if not _result.success():
-                    logger.warning(f'Refresh group info, User: {user_qq}, {_result.info}')
-
-            await group.init_member_status()
-            logger.info(f'Refresh group info completed, Bot: {bot_id}, Group: {group_id}')
+        await asyncio.gather(*[_refresh_group(_group_id=int(x.get('group_id'))) for x in group_list])
+        logger.info(f'Refresh group info completed, Bot: {bot_id}')
     logger.debug('refresh_group_info: Task finish')
 
 
@@ -189,8 +197,31 @@ async def refresh_friends_info():
     misfire_grace_time=10
 )
 async def cool_down_refresh():
-    await DBCoolDownEvent.clear_time_out_event()
-    logger.debug('cool_down_refresh: cleaning time out event')
+    count = CoolDownStore.sweep()
+    logger.debug(f'cool_down_refresh: cleaning time out event, {count} cleared')
+
+
+# 创建用于将冷却事件写入数据库的定时任务
+@scheduler.scheduled_job(
+    'cron',
+    # year=None,
+    # month=None,
+    # day='*/1',
+    # week=None,
+    # day_of_week=None,
+    # hour='*/8',
+    minute='*/1',
+    # second=None,
+    # start_date=None,
+    # end_date=None,
+    # timezone=None,
+    id='cool_down_snapshot',
+    coalesce=True,
+    misfire_grace_time=30
+)
+async def cool_down_snapshot():
+    await CoolDownStore.snapshot()
+    logger.debug('cool_down_snapshot: cool down events saved')
 
 
 # 创建用于检查代理可用性的状态的定时任务
@@ -245,9 +276,11 @@ if ENABLE_PROXY:
         fetcher_result = await fetcher.get_text(url=test_url, force_proxy=True)
 
         if fetcher_result.success() and fetcher_result.status == 200:
+            HttpFetcher.set_proxy_status(available=True)
             db_res = await DBStatus(name='PROXY_AVAILABLE').set_status(status=1, info='代理可用')
             logger.opt(colors=True).info(f'代理检查: <g>成功! status: {fetcher_result.status}</g>, DB info: {db_res.info}')
         else:
+            HttpFetcher.set_proxy_status(available=False)
             db_res = await DBStatus(name='PROXY_AVAILABLE').set_status(status=0, info='代理不可用')
             logger.opt(colors=True).error(f'代理检查: <r>失败! status: {fetcher_result.status}, '
                                           f'info: {fetcher_result.info}</r>, DB info: {db_res.info}')
@@ -4,11 +4,16 @@ from pydantic import BaseSettings
 class Config(BaseSettings):
 
     # plugin custom config
+    # 动态检查间隔(秒)
     """
-    B站动态检查模式, 是否启用检查池模式
-    单位时间内检查数量相同, 但总体检查时间间隔会根据订阅量延长, 对于订阅量较大的情况可以有效避免被B站风控
+    每个用户单独计算下次检查时间, 检查到新动态后间隔重置为 dynamic_check_min_interval
+    没有新动态时间隔按 dynamic_check_backoff_factor 逐次延长, 最长为 dynamic_check_max_interval
+    经常发动态的用户检查间隔不会超过其平均发布间隔的 1/10
+    所有订阅共用的每分钟请求数预算见 poll_scheduler_requests_per_minute
     """
-    enable_dynamic_check_pool_mode: bool = True
+    dynamic_check_min_interval: int = 60
+    dynamic_check_max_interval: int = 900
+    dynamic_check_backoff_factor: float = 1.5
 
     class Config:
         extra = "ignore"
@@ -1,19 +1,26 @@
 import asyncio
-import random
 from nonebot import logger, require, get_bots, get_driver
 from nonebot.adapters.cqhttp import MessageSegment
 from omega_miya.utils.Omega_Base import DBFriend, DBSubscription, DBDynamic, DBTable
+from omega_miya.utils.Omega_plugin_utils import NoticeDispatcher, PollScheduler
 from omega_miya.utils.bilibili_utils import BiliUser, BiliDynamic, BiliRequestUtils
 from .config import Config
+from .tracker import DynamicTracker
 
 
 __global_config = get_driver().config
 plugin_config = Config(**__global_config.dict())
-ENABLE_DYNAMIC_CHECK_POOL_MODE = plugin_config.enable_dynamic_check_pool_mode
+DYNAMIC_CHECK_MIN_INTERVAL = plugin_config.dynamic_check_min_interval
+DYNAMIC_CHECK_MAX_INTERVAL = plugin_config.dynamic_check_max_interval
+DYNAMIC_CHECK_BACKOFF_FACTOR = plugin_config.dynamic_check_backoff_factor
 
 
-# 检查池模式使用的检查队列
-checking_pool = []
+# 动态订阅检查调度
+dynamic_poll_scheduler = PollScheduler(
+    name='bilibili_dynamic',
+    min_interval=DYNAMIC_CHECK_MIN_INTERVAL,
+    max_interval=DYNAMIC_CHECK_MAX_INTERVAL,
+    backoff_factor=DYNAMIC_CHECK_BACKOFF_FACTOR)
 
 # 启用检查动态状态的定时任务
 scheduler = require("nonebot_plugin_apscheduler").scheduler
@@ -60,6 +67,27 @@ async def bilibili_dynamic_monitor():
 
     logger.debug(f"bilibili_dynamic_monitor: checking started")
 
+    # 获取订阅表中的所有动态订阅
+    t = DBTable(table_name='Subscription')
+    sub_res = await t.list_col_with_condition('sub_id', 'sub_type', 2)
+    check_sub = [int(x) for x in sub_res.result]
+
+    dynamic_poll_scheduler.sync(keys=check_sub)
+    if not check_sub:
+        logger.debug(f'bilibili_dynamic_monitor: no dynamic subscription, ignore.')
+        return
+
+    # 未能载入已有动态时跳过本次检查
+    if not await DynamicTracker.ensure_loaded():
+        logger.warning(f'bilibili_dynamic_monitor: latest dynamic ids not loaded, ignore.')
+        return
+
+    dynamic_poll_scheduler.check_staleness()
+    # 只检查已到检查时间的用户
+    now_checking = dynamic_poll_scheduler.pop_due()
+    if not now_checking:
+        return
+
     # 获取当前bot列表
     bots = []
     for bot_id, bot in get_bots().items():
@@ -74,23 +102,15 @@ async def bilibili_dynamic_monitor():
     friend_res = await DBFriend.list_exist_friends_by_private_permission(private_permission=1)
     all_noitce_friends = [int(x) for x in friend_res.result]
 
-    # 获取订阅表中的所有动态订阅
-    t = DBTable(table_name='Subscription')
-    sub_res = await t.list_col_with_condition('sub_id', 'sub_type', 2)
-    check_sub = [int(x) for x in sub_res.result]
-
-    if not check_sub:
-        logger.debug(f'bilibili_dynamic_monitor: no dynamic subscription, ignore.')
-        return
-
     # 处理图片序列
-    async def pic2base64(pic_list: list) -> str:
-        # 处理图片序列
+    async def pic_to_segs(pic_list: list) -> str:
+        # 处理图片序列, 图片经本地缓存后发送
         pic_segs = []
-        for pic_url in pic_list:
-            pic_result = await BiliRequestUtils.pic_2_base64(url=pic_url)
-            pic_b64 = pic_result.result
-            pic_segs.append(str(MessageSegment.image(pic_b64)))
+        pic_results = await asyncio.gather(*[BiliRequestUtils.pic_to_file(url=pic_url) for pic_url in pic_list])
+        for pic_result in pic_results:
+            if pic_result.error:
+                continue
+            pic_segs.append(str(MessageSegment.image(pic_result.result)))
         pic_seg = '\n'.join(pic_segs)
         return pic_seg
 
@@ -100,6 +120,8 @@ async def bilibili_dynamic_monitor():
         user_dynamic_result = await BiliUser(user_id=user_id).get_dynamic_history()
         if user_dynamic_result.error:
             logger.error(f'bilibili_dynamic_monitor: 获取用户 {user_id} 动态失败, error: {user_dynamic_result.info}')
+            dynamic_poll_scheduler.report(key=user_id, changed=False, success=False)
+            return
 
         # 解析动态内容
         dynamics_data = []
@@ -110,15 +132,12 @@ async def bilibili_dynamic_monitor():
                 continue
             dynamics_data.append(data_parse_result)
 
-        # 用户所有的动态id
-        dynamic_table = DBTable(table_name='Bilidynamic')
-        exist_dynamic_result = await dynamic_table.list_col_with_condition('dynamic_id', 'uid', user_id)
-        if exist_dynamic_result.error:
-            logger.error(f'bilibili_dynamic_monitor: 获取用户 {user_id} 已有动态失败, error: {exist_dynamic_result.info}')
+        # 与已见过的最新动态id比较筛选出新动态
+        new_dynamic_data = [data for data in dynamics_data
+                            if DynamicTracker.is_new(uid=user_id, dynamic_id=data.result.dynamic_id)]
+        dynamic_poll_scheduler.report(key=user_id, changed=bool(new_dynamic_data))
+        if not new_dynamic_data:
             return
-        user_dynamic_list = [int(x) for x in exist_dynamic_result.result]
-
-        new_dynamic_data = [data for data in dynamics_data if data.result.dynamic_id not in user_dynamic_list]
 
         sub = DBSubscription(sub_type=2, sub_id=user_id)
 
@@ -149,33 +168,29 @@ async def bilibili_dynamic_monitor():
 
             # 转发的动态
             if dynamic_info.type == 1:
-                # 转发的动态还需要获取原动态信息
-                orig_dy_info_result = await BiliDynamic(dynamic_id=dynamic_info.orig_dy_id).get_info()
-                if orig_dy_info_result.success():
-                    orig_dy_data_result = BiliDynamic.data_parser(dynamic_data=orig_dy_info_result.result)
-                    if orig_dy_data_result.success():
-                        # 原动态type=2 或 8, 带图片
-                        if orig_dy_data_result.result.type in [2, 8]:
-                            # 处理图片序列
-                            pic_seg = await pic2base64(pic_list=orig_dy_data_result.result.data.pictures)
-                            orig_user = orig_dy_data_result.result.user_name
-                            orig_contant = orig_dy_data_result.result.data.content
-                            msg = f"{user_name}{desc}!\n\n“{content}”\n{url}\n{'=' * 16}\n" \
-                                  f"@{orig_user}: {orig_contant}\n{pic_seg}"
-                        # 原动态为其他类型, 无图
-                        else:
-                            orig_user = orig_dy_data_result.result.user_name
-                            orig_contant = orig_dy_data_result.result.data.content
-                            msg = f"{user_name}{desc}!\n\n“{content}”\n{url}\n{'=' * 16}\n" \
-                                  f"@{orig_user}: {orig_contant}"
+                # 转发的动态还需要获取原动态信息, 原动态信息有缓存, 多个用户转发同一动态时只请求一次
+                orig_dy_data_result = await BiliDynamic(dynamic_id=dynamic_info.orig_dy_id).get_parsed_info()
+                if orig_dy_data_result.success():
+                    # 原动态type=2 或 8, 带图片
+                    if orig_dy_data_result.result.type in [2, 8]:
+                        # 处理图片序列
+                        pic_seg = await pic_to_segs(pic_list=orig_dy_data_result.result.data.pictures)
+                        orig_user = orig_dy_data_result.result.user_name
+                        orig_contant = orig_dy_data_result.result.data.content
+                        msg = f"{user_name}{desc}!\n\n“{content}”\n{url}\n{'=' * 16}\n" \
+                              f"@{orig_user}: {orig_contant}\n{pic_seg}"
+                    # 原动态为其他类型, 无图
                     else:
-                        msg = f"{user_name}{desc}!\n\n“{content}”\n{url}\n{'=' * 16}\n@Unknown: 获取原动态失败"
+                        orig_user = orig_dy_data_result.result.user_name
+                        orig_contant = orig_dy_data_result.result.data.content
+                        msg = f"{user_name}{desc}!\n\n“{content}”\n{url}\n{'=' * 16}\n" \
+                              f"@{orig_user}: {orig_contant}"
                 else:
                     msg = f"{user_name}{desc}!\n\n“{content}”\n{url}\n{'=' * 16}\n@Unknown: 获取原动态失败"
             # 原创的动态（有图片）
             elif dynamic_info.type == 2:
                 # 处理图片序列
-                pic_seg = await pic2base64(pic_list=dynamic_info.data.pictures)
+                pic_seg = await pic_to_segs(pic_list=dynamic_info.data.pictures)
                 msg = f"{user_name}{desc}!\n\n“{content}”\n{url}\n{pic_seg}"
             # 原创的动态（无图片）
             elif dynamic_info.type == 4:
@@ -183,7 +198,7 @@ async def bilibili_dynamic_monitor():
             # 视频
             elif dynamic_info.type == 8:
                 # 处理图片序列
-                pic_seg = await pic2base64(pic_list=dynamic_info.data.pictures)
+                pic_seg = await pic_to_segs(pic_list=dynamic_info.data.pictures)
                 if content:
                     msg = f"{user_name}{desc}!\n\n《{title}》\n\n“{content}”\n{url}\n{pic_seg}"
                 else:
@@ -194,17 +209,17 @@ async def bilibili_dynamic_monitor():
             # 番剧
             elif dynamic_info.type in [32, 512]:
                 # 处理图片序列
-                pic_seg = await pic2base64(pic_list=dynamic_info.data.pictures)
+                pic_seg = await pic_to_segs(pic_list=dynamic_info.data.pictures)
                 msg = f"{user_name}{desc}!\n\n《{title}》\n\n{content}\n{url}\n{pic_seg}"
             # 文章
             elif dynamic_info.type == 64:
                 # 处理图片序列
-                pic_seg = await pic2base64(pic_list=dynamic_info.data.pictures)
+                pic_seg = await pic_to_segs(pic_list=dynamic_info.data.pictures)
                 msg = f"{user_name}{desc}!\n\n《{title}》\n\n{content}\n{url}\n{pic_seg}"
             # 音频
             elif dynamic_info.type == 256:
                 # 处理图片序列
-                pic_seg = await pic2base64(pic_list=dynamic_info.data.pictures)
+                pic_seg = await pic_to_segs(pic_list=dynamic_info.data.pictures)
                 msg = f"{user_name}{desc}!\n\n《{title}》\n\n{content}\n{url}\n{pic_seg}"
             # B站活动相关
             elif dynamic_info.type == 2048:
@@ -214,26 +229,21 @@ async def bilibili_dynamic_monitor():
                     msg = f"{user_name}{desc}!\n\n【{title}】\n“{content}”\n\n{url}"
             else:
                 logger.warning(f"未知的动态类型: {type}, id: {dynamic_id}")
+                DynamicTracker.mark_seen(uid=user_id, dynamic_id=dynamic_id)
                 continue
 
             # 向群组发送消息
             for group_id in notice_groups:
                 for _bot in bots:
-                    try:
-                        await _bot.call_api(api='send_group_msg', group_id=group_id, message=msg)
-                        logger.info(f"向群组: {group_id} 发送新动态通知: {dynamic_id}")
-                    except Exception as _e:
-                        logger.warning(f"向群组: {group_id} 发送新动态通知: {dynamic_id} 失败, error: {repr(_e)}")
-                        continue
+                    NoticeDispatcher.send_group_msg(
+                        bot=_bot, group_id=group_id, message=msg, description=f'新动态通知: {dynamic_id}')
             # 向好友发送消息
             for friend_user_id in notice_friends:
                 for _bot in bots:
-                    try:
-                        await _bot.call_api(api='send_private_msg', user_id=friend_user_id, message=msg)
-                        logger.info(f"向好友: {friend_user_id} 发送新动态通知: {dynamic_id}")
-                    except Exception as _e:
-                        logger.warning(f"向好友: {friend_user_id} 发送新动态通知: {dynamic_id} 失败, error: {repr(_e)}")
-                        continue
+                    NoticeDispatcher.send_private_msg(
+                        bot=_bot, user_id=friend_user_id, message=msg, description=f'新动态通知: {dynamic_id}')
+
+            DynamicTracker.mark_seen(uid=user_id, dynamic_id=dynamic_id)
 
             # 更新动态内容到数据库
             # 向数据库中写入动态信息
@@ -244,97 +254,37 @@ async def bilibili_dynamic_monitor():
             else:
                 logger.error(f"向数据库写入动态信息: {dynamic_id} 失败, error: {_res.info}")
 
-    # 启用了检查池模式
-    if ENABLE_DYNAMIC_CHECK_POOL_MODE:
-        global checking_pool
-
-        # checking_pool为空则上一轮检查完了, 重新往里面放新一轮的uid
-        if not checking_pool:
-            checking_pool.extend(check_sub)
-
-        # 看下checking_pool里面还剩多少
-        waiting_num = len(checking_pool)
-
-        # 默认单次检查并发数为2, 默认检查间隔为20s
-        logger.debug(f'bili dynamic pool mode debug info, B_checking_pool: {checking_pool}')
-        if waiting_num >= 2:
-            # 抽取检查对象
-            now_checking = random.sample(checking_pool, k=2)
-            # 更新checking_pool
-            checking_pool = [x for x in checking_pool if x not in now_checking]
-        else:
-            now_checking = checking_pool.copy()
-            checking_pool.clear()
-        logger.debug(f'bili dynamic pool mode debug info, A_checking_pool: {checking_pool}')
-        logger.debug(f'bili dynamic pool mode debug info, now_checking: {now_checking}')
-
-        # 检查now_checking里面的直播间(异步)
-        tasks = []
-        for uid in now_checking:
-            tasks.append(check_dynamic(uid))
-        try:
-            await asyncio.gather(*tasks)
-            logger.debug(f"bilibili_dynamic_monitor: pool mode enable, checking completed, "
-                         f"checked: {', '.join([str(x) for x in now_checking])}.")
-        except Exception as e:
-            logger.error(f'bilibili_dynamic_monitor: pool mode enable, error occurred in checking: {repr(e)}')
-
-    # 没有启用检查池模式
-    else:
-        # 检查所有在订阅表里面的直播间(异步)
-        tasks = []
-        for uid in check_sub:
-            tasks.append(check_dynamic(uid))
-        try:
-            await asyncio.gather(*tasks)
-            logger.debug(f"bilibili_dynamic_monitor: pool mode disable, checking completed, "
-                         f"checked: {', '.join([str(x) for x in check_sub])}.")
-        except Exception as e:
-            logger.error(f'bilibili_dynamic_monitor: pool mode disable, error occurred in checking  {repr(e)}')
-
-
-# 分时间段创建计划任务, 夜间闲时降低检查频率
-# 根据检查池模式初始化检查时间间隔
-if ENABLE_DYNAMIC_CHECK_POOL_MODE:
-    # 检查池启用
-    scheduler.add_job(
-        bilibili_dynamic_monitor,
-        'cron',
-        # year=None,
-        # month=None,
-        # day='*/1',
-        # week=None,
-        # day_of_week=None,
-        # hour='9-23',
-        # minute='*/3',
-        second='*/20',
-        # start_date=None,
-        # end_date=None,
-        # timezone=None,
-        id='bilibili_dynamic_monitor_pool_enable',
-        coalesce=True,
-        misfire_grace_time=30
-    )
-else:
-    # 检查池禁用
-    scheduler.add_job(
-        bilibili_dynamic_monitor,
-        'cron',
-        # year=None,
-        # month=None,
-        # day='*/1',
-        # week=None,
-        # day_of_week=None,
-        # hour=None,
-        minute='*/3',
-        # second='*/30',
-        # start_date=None,
-        # end_date=None,
-        # timezone=None,
-        id='bilibili_dynamic_monitor_pool_disable',
-        coalesce=True,
-        misfire_grace_time=30
-    )
+    # 检查已到检查时间的用户(异步)
+    tasks = []
+    for uid in now_checking:
+        tasks.append(check_dynamic(uid))
+    try:
+        await asyncio.gather(*tasks)
+        logger.debug(f"bilibili_dynamic_monitor: checking completed, "
+                     f"checked: {', '.join([str(x) for x in now_checking])}.")
+    except Exception as e:
+        logger.error(f'bilibili_dynamic_monitor: error occurred in checking {repr(e)}')
+
+
+# 定时任务只负责触发调度, 各用户的实际检查间隔由 dynamic_poll_scheduler 决定
+scheduler.add_job(
+    bilibili_dynamic_monitor,
+    'cron',
+    # year=None,
+    # month=None,
+    # day='*/1',
+    # week=None,
+    # day_of_week=None,
+    # hour=None,
+    # minute=None,
+    second='*/10',
+    # start_date=None,
+    # end_date=None,
+    # timezone=None,
+    id='bilibili_dynamic_monitor',
+    coalesce=True,
+    misfire_grace_time=10
+)
 
 __all__ = [
     'scheduler'
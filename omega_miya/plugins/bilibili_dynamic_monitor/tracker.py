@@ -0,0 +1,52 @@
+"""
+动态检查状态
+按用户记录已见过的最新动态 id
+动态 id 随发布时间递增, 新动态判断只需与最新动态 id 比较, 最新动态 id 由动态表推出, 启动时载入
+"""
+from typing import Dict
+from nonebot import logger, get_driver
+from omega_miya.utils.Omega_Base import DBDynamic
+
+
+class DynamicTracker(object):
+    __loaded: bool = False
+    # key: uid, value: 已见过的最新动态 id
+    __high_water_marks: Dict[int, int] = {}
+
+    @classmethod
+    async def load(cls) -> bool:
+        result = await DBDynamic.list_latest_dynamic_ids()
+        if result.error:
+            logger.opt(colors=True).error(
+                f'<Y><lw>DynamicTracker</lw></Y> load latest dynamic ids failed, {result.info}')
+            return False
+        for uid, dynamic_id in result.result.items():
+            cls.__high_water_marks[uid] = max(dynamic_id, cls.__high_water_marks.get(uid, 0))
+        cls.__loaded = True
+        logger.opt(colors=True).debug(
+            f'<Y><lw>DynamicTracker</lw></Y> loaded latest dynamic ids of {len(result.result)} users')
+        return True
+
+    @classmethod
+    async def ensure_loaded(cls) -> bool:
+        # 未成功载入时不能判断新动态, 否则会把历史动态全部当作新动态推送
+        if cls.__loaded:
+            return True
+        return await cls.load()
+
+    @classmethod
+    def is_new(cls, uid: int, dynamic_id: int) -> bool:
+        return dynamic_id > cls.__high_water_marks.get(uid, 0)
+
+    @classmethod
+    def mark_seen(cls, uid: int, dynamic_id: int) -> None:
+        if dynamic_id > cls.__high_water_marks.get(uid, 0):
+            cls.__high_water_marks[uid] = dynamic_id
+
+
+get_driver().on_startup(DynamicTracker.load)
+
+
+__all__ = [
+    'DynamicTracker'
+]
@@ -10,7 +10,18 @@ class Config(BaseSettings):
     非调试请勿修改本配置!!!
     """
     enable_new_live_api: bool = True
-    enable_live_check_pool_mode: bool = False
+
+    # 直播间检查间隔(秒)
+    """
+    每个直播间单独计算下次检查时间, 直播中的直播间按 live_check_min_interval 检查
+    未开播的直播间检查间隔逐次延长, 最长为 live_check_max_interval
+    所有订阅共用的每分钟请求数预算见 poll_scheduler_requests_per_minute, 使用新api时每次检查只消耗一次预算
+    """
+    live_check_min_interval: int = 30
+    live_check_max_interval: int = 90
+
+    # 初始化直播间信息时的最大并发数
+    live_warm_up_concurrency: int = 4
 
     class Config:
         extra = "ignore"
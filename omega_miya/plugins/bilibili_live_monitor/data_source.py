@@ -1,22 +1,40 @@
+import os
 import asyncio
 import time
+import msgpack
+import aiofiles
 from dataclasses import dataclass
-from typing import List, Union
-from nonebot import logger
+from typing import List, Iterable, Optional, Union
+from nonebot import logger, get_driver
 from nonebot.adapters import Bot
 from nonebot.adapters.cqhttp import MessageSegment
 from omega_miya.utils.Omega_Base import DBSubscription, DBHistory, DBTable, Result
+from omega_miya.utils.Omega_plugin_utils import NoticeDispatcher
 from omega_miya.utils.bilibili_utils import BiliLiveRoom, BiliUser, BiliRequestUtils, BiliInfo
+from .config import Config
+from .registry import LiveRoomRegistry
+
+
+__global_config = get_driver().config
+plugin_config = Config(**__global_config.dict())
+LIVE_WARM_UP_CONCURRENCY = plugin_config.live_warm_up_concurrency
+TMP_PATH = __global_config.tmp_path_
+LIVE_STATE_SNAPSHOT_PATH = os.path.abspath(os.path.join(TMP_PATH, 'bilibili_live'))
+LIVE_STATE_SNAPSHOT_FILE = os.path.join(LIVE_STATE_SNAPSHOT_PATH, 'live_state.msgpack')
+LIVE_STATE_SNAPSHOT_VERSION = 1
 
 
 # 初始化直播间标题, 状态
 live_title = {}
 live_status = {}
 live_up_name = {}
-live_uid_by_rid = {}
 
 
 class BiliLiveChecker(object):
+    __reconciling: bool = False
+    __reconcile_task: Optional[asyncio.Task] = None
+    __last_snapshot: bytes = b''
+
     def __init__(self, room_id: int):
         self.room_id = room_id
 
@@ -25,7 +43,6 @@ class BiliLiveChecker(object):
         global live_title
         global live_status
         global live_up_name
-        global live_uid_by_rid
 
         try:
             # 获取直播间信息
@@ -50,8 +67,8 @@ class BiliLiveChecker(object):
             # 直播间标题放入live_title全局变量中
             live_title[self.room_id] = str(live_info.title)
 
-            # 直播间用户uid放入live_uid_by_rid全局变量中
-            live_uid_by_rid[self.room_id] = int(live_info.uid)
+            # 直播间用户uid放入直播间索引中
+            LiveRoomRegistry.register(rid=self.room_id, uid=int(live_info.uid))
 
             # 直播间up名称放入live_up_name全局变量中
             live_up_name[self.room_id] = str(up_name)
@@ -65,23 +82,132 @@ class BiliLiveChecker(object):
     @classmethod
     # 启动时执行的全全部直播间初始化
     async def init_global_live_info(cls):
-        cookies_result = await BiliRequestUtils().verify_cookies()
-        if cookies_result.success():
-            logger.opt(colors=True).info(f'<g>Bilibili 已登录!</g> 当前用户: {cookies_result.result}')
-        else:
-            logger.opt(colors=True).warning(f'<r>Bilibili 登录状态异常: {cookies_result.info}!</r> 建议在配置中正确设置cookies!')
-
+        """
+        先从本地快照载入直播间状态, 再在后台与B站同步, 启动时不等待网络请求
+        """
         logger.opt(colors=True).info('init_live_info: <y>初始化B站直播间监控列表...</y>')
         t = DBTable(table_name='Subscription')
-        tasks = []
         sub_res = await t.list_col_with_condition('sub_id', 'sub_type', 1)
-        for sub_id in sub_res.result:
-            tasks.append(BiliLiveChecker(room_id=sub_id).init_live_info())
+        room_id_list = [int(x) for x in sub_res.result]
+
+        loaded_count = await cls.load_snapshot(room_id_list=room_id_list)
+        logger.opt(colors=True).info(
+            f'init_live_info: <g>已从快照载入 {loaded_count}/{len(room_id_list)} 个直播间状态</g>, 开始后台同步')
+
+        cls.__reconciling = True
+        cls.__reconcile_task = asyncio.create_task(cls.__reconcile(room_id_list=room_id_list))
+
+    @classmethod
+    async def __reconcile(cls, room_id_list: List[int]):
+        """
+        后台同步直播间状态, 已载入快照的直播间使用批量接口一次获取, 其余直播间逐个初始化
+        同步期间的状态变化不发送通知, 与重启前直接初始化的行为一致
+        """
+        try:
+            cookies_result = await BiliRequestUtils().verify_cookies()
+            if cookies_result.success():
+                logger.opt(colors=True).info(f'<g>Bilibili 已登录!</g> 当前用户: {cookies_result.result}')
+            else:
+                logger.opt(colors=True).warning(
+                    f'<r>Bilibili 登录状态异常: {cookies_result.info}!</r> 建议在配置中正确设置cookies!')
+
+            reconciled = set()
+            uid_list = list(set(uid for uid in [LiveRoomRegistry.uid(rid=x) for x in room_id_list] if uid))
+            if uid_list:
+                live_info_result = await BiliLiveRoom.get_info_by_uids(uid_list=uid_list)
+                if live_info_result.success():
+                    for live_info in live_info_result.result.values():
+                        LiveRoomRegistry.register_short_id(room_id=int(live_info.room_id), short_id=live_info.short_id)
+                        for room_id in LiveRoomRegistry.rids(uid=live_info.uid):
+                            live_status[room_id] = int(live_info.status)
+                            live_title[room_id] = str(live_info.title)
+                            reconciled.add(room_id)
+                else:
+                    logger.error(f'bilibili_live_monitor: reconcile live info failed, error: {live_info_result.info}')
+
+            await cls.warm_up(room_id_list=[x for x in room_id_list if x not in reconciled])
+            await cls.save_snapshot()
+            logger.opt(colors=True).info('init_live_info: <g>B站直播间监控列表初始化完成.</g>')
+        except Exception as e:
+            logger.error(f'bilibili_live_monitor: reconcile live info failed, error: {repr(e)}')
+        finally:
+            cls.__reconciling = False
+
+    @classmethod
+    def reconciling(cls) -> bool:
+        return cls.__reconciling
+
+    @classmethod
+    async def load_snapshot(cls, room_id_list: Iterable[int]) -> int:
+        """
+        从本地快照载入直播间状态, 只载入仍在订阅中的直播间
+        :return: 载入的直播间数
+        """
+        if not os.path.exists(LIVE_STATE_SNAPSHOT_FILE):
+            return 0
+        try:
+            async with aiofiles.open(LIVE_STATE_SNAPSHOT_FILE, 'rb') as f:
+                data = msgpack.unpackb(await f.read())
+            if data.get('version') != LIVE_STATE_SNAPSHOT_VERSION:
+                return 0
+            rooms = data.get('rooms', [])
+        except Exception as e:
+            logger.warning(f'bilibili_live_monitor: load live state snapshot failed, error: {repr(e)}')
+            return 0
+
+        room_id_set = set(room_id_list)
+        loaded_count = 0
+        for room_id, uid, status, title, up_name in rooms:
+            if room_id not in room_id_set:
+                continue
+            live_status[room_id] = status
+            live_title[room_id] = title
+            live_up_name[room_id] = up_name
+            LiveRoomRegistry.register(rid=room_id, uid=uid)
+            loaded_count += 1
+        return loaded_count
+
+    @classmethod
+    async def save_snapshot(cls):
+        """
+        将直播间状态写入本地快照, 无变化时跳过
+        """
+        rooms = []
+        for room_id, up_name in live_up_name.items():
+            uid = LiveRoomRegistry.uid(rid=room_id)
+            if uid is None or room_id not in live_status or room_id not in live_title:
+                continue
+            rooms.append([room_id, uid, live_status[room_id], live_title[room_id], up_name])
+        packed = msgpack.packb({'version': LIVE_STATE_SNAPSHOT_VERSION, 'rooms': sorted(rooms)})
+        if packed == cls.__last_snapshot:
+            return
+
+        try:
+            if not os.path.exists(LIVE_STATE_SNAPSHOT_PATH):
+                os.makedirs(LIVE_STATE_SNAPSHOT_PATH)
+            tmp_file = f'{LIVE_STATE_SNAPSHOT_FILE}.tmp'
+            async with aiofiles.open(tmp_file, 'wb') as f:
+                await f.write(packed)
+            os.replace(tmp_file, LIVE_STATE_SNAPSHOT_FILE)
+            cls.__last_snapshot = packed
+        except Exception as e:
+            logger.warning(f'bilibili_live_monitor: save live state snapshot failed, error: {repr(e)}')
+
+    @classmethod
+    async def warm_up(cls, room_id_list: Iterable[int]):
+        """
+        并发初始化直播间信息, 并发数由 live_warm_up_concurrency 限制
+        """
+        semaphore = asyncio.Semaphore(LIVE_WARM_UP_CONCURRENCY)
+
+        async def _init(room_id: int):
+            async with semaphore:
+                await BiliLiveChecker(room_id=room_id).init_live_info()
+
         try:
-            await asyncio.gather(*tasks)
+            await asyncio.gather(*[_init(room_id) for room_id in room_id_list])
         except Exception as e:
             logger.error(f'bilibili_live_monitor: init live info failed, error: {repr(e)}')
-        logger.opt(colors=True).info('init_live_info: <g>B站直播间监控列表初始化完成.</g>')
 
     @classmethod
     def live_title(cls) -> dict:
@@ -95,10 +221,6 @@ class BiliLiveChecker(object):
     def live_up_name(cls) -> dict:
         return live_up_name
 
-    @classmethod
-    def live_uid_by_rid(cls) -> dict:
-        return live_uid_by_rid
-
     @dataclass
     class LiveRoomCheckerResult(Result.AnyResult):
         changed: bool
@@ -155,7 +277,7 @@ class BiliLiveChecker(object):
         # 直播过程中标题更新
         elif live_info.status == 1 and live_info.title != live_title[self.room_id]:
             if live_info.cover_img:
-                cover_pic_result = await BiliRequestUtils.pic_2_base64(url=live_info.cover_img)
+                cover_pic_result = await BiliRequestUtils.pic_to_file(url=live_info.cover_img)
                 if cover_pic_result.success():
                     # 发送的消息
                     msg = f"{up_name}的直播间换标题啦！\n\n【{live_info.title}】\n" \
@@ -221,7 +343,7 @@ class BiliLiveChecker(object):
 
                 # 发送的消息
                 if live_info.cover_img:
-                    cover_pic_result = await BiliRequestUtils.pic_2_base64(url=live_info.cover_img)
+                    cover_pic_result = await BiliRequestUtils.pic_to_file(url=live_info.cover_img)
                     if cover_pic_result.success():
                         msg = f"{live_info.live_time}\n{up_name}开播啦！\n\n【{live_info.title}】" \
                               f"\n{MessageSegment.image(cover_pic_result.result)}"
@@ -272,17 +394,19 @@ class BiliLiveChecker(object):
                                               original=old_status, new=live_info.status, result='')
 
     async def broadcaster(
-            self, live_info: BiliInfo.LiveRoomInfo, bots: List[Bot], all_groups: List[int], all_friends: List[int]):
+            self, live_info: BiliInfo.LiveRoomInfo, bots: List[Bot], all_groups: List[int], all_friends: List[int]
+    ) -> bool:
         """
         检查直播间状态并向群组发送消息
         :param live_info: 由 get_live_info 或 get_live_info_by_uid_list 获取的直播间信息
         :param bots: bots 列表
         :param all_groups: 所有可能需要通知的群组列表
         :param all_friends: 所有可能需要通知的好友列表
+        :return: 直播间标题或状态是否发生变化
         """
         global_check_result = await self.check_global_status()
         if global_check_result.error:
-            return
+            return False
 
         sub = DBSubscription(sub_type=1, sub_id=self.room_id)
 
@@ -304,23 +428,15 @@ class BiliLiveChecker(object):
             # 通知有通知权限且订阅了该直播间的群
             for group_id in notice_group:
                 for _bot in bots:
-                    try:
-                        await _bot.call_api(
-                            api='send_group_msg', group_id=group_id, message=title_checker_result.result)
-                        logger.info(f"向群组: {group_id} 发送直播间: {self.room_id} 标题变更通知")
-                    except Exception as e:
-                        logger.warning(f"向群组: {group_id} 发送直播间: {self.room_id} 标题变更通知失败, error: {repr(e)}")
-                        continue
+                    NoticeDispatcher.send_group_msg(
+                        bot=_bot, group_id=group_id, message=title_checker_result.result,
+                        description=f'直播间: {self.room_id} 标题变更通知')
             # 通知有通知权限且订阅了该直播间的好友
             for user_id in notice_friends:
                 for _bot in bots:
-                    try:
-                        await _bot.call_api(
-                            api='send_private_msg', user_id=user_id, message=title_checker_result.result)
-                        logger.info(f"向好友: {user_id} 发送直播间: {self.room_id} 标题变更通知")
-                    except Exception as e:
-                        logger.warning(f"向好友: {user_id} 发送直播间: {self.room_id} 标题变更通知失败, error: {repr(e)}")
-                        continue
+                    NoticeDispatcher.send_private_msg(
+                        bot=_bot, user_id=user_id, message=title_checker_result.result,
+                        description=f'直播间: {self.room_id} 标题变更通知')
 
         # 状态变更检测
         status_checker_result = await self.status_change_checker(live_info=live_info)
@@ -330,25 +446,17 @@ class BiliLiveChecker(object):
             status = live_status[self.room_id]
             for group_id in notice_group:
                 for _bot in bots:
-                    try:
-                        await _bot.call_api(
-                            api='send_group_msg', group_id=group_id, message=status_checker_result.result)
-                        logger.info(
-                            f"向群组: {group_id} 发送直播间: {self.room_id}/{up_name} 直播通知, status: {status}")
-                    except Exception as e:
-                        logger.warning(f"向群组: {group_id} 发送直播间: {self.room_id}/{up_name} 直播通知失败, error: {repr(e)}")
-                        continue
+                    NoticeDispatcher.send_group_msg(
+                        bot=_bot, group_id=group_id, message=status_checker_result.result,
+                        description=f'直播间: {self.room_id}/{up_name} 直播通知, status: {status}')
             # 通知有通知权限且订阅了该直播间的好友
             for user_id in notice_friends:
                 for _bot in bots:
-                    try:
-                        await _bot.call_api(
-                            api='send_private_msg', user_id=user_id, message=status_checker_result.result)
-                        logger.info(
-                            f"向好友: {user_id} 发送直播间: {self.room_id}/{up_name} 直播通知, status: {status}")
-                    except Exception as e:
-                        logger.warning(f"向好友: {user_id} 发送直播间: {self.room_id}/{up_name} 直播通知失败, error: {repr(e)}")
-                        continue
+                    NoticeDispatcher.send_private_msg(
+                        bot=_bot, user_id=user_id, message=status_checker_result.result,
+                        description=f'直播间: {self.room_id}/{up_name} 直播通知, status: {status}')
+
+        return title_checker_result.changed or status_checker_result.changed
 
 
 __all__ = [
@@ -1,22 +1,28 @@
 import asyncio
-import random
 from nonebot import logger, require, get_driver, get_bots
 from omega_miya.utils.Omega_Base import DBFriend, DBSubscription, DBTable
+from omega_miya.utils.Omega_plugin_utils import PollScheduler
 from omega_miya.utils.bilibili_utils import BiliLiveRoom
 from .data_source import BiliLiveChecker
+from .registry import LiveRoomRegistry
 from .config import Config
 
 
 __global_config = get_driver().config
 plugin_config = Config(**__global_config.dict())
 ENABLE_NEW_LIVE_API = plugin_config.enable_new_live_api
-ENABLE_LIVE_CHECK_POOL_MODE = plugin_config.enable_live_check_pool_mode
+LIVE_CHECK_MIN_INTERVAL = plugin_config.live_check_min_interval
+LIVE_CHECK_MAX_INTERVAL = plugin_config.live_check_max_interval
 
-# 检查池模式使用的检查队列
-checking_pool = []
+# 直播间订阅检查调度
+live_poll_scheduler = PollScheduler(
+    name='bilibili_live',
+    min_interval=LIVE_CHECK_MIN_INTERVAL,
+    max_interval=LIVE_CHECK_MAX_INTERVAL)
 
-# 初始化任务加入启动序列
+# 初始化任务加入启动序列, 关闭时保存直播间状态快照
 get_driver().on_startup(BiliLiveChecker.init_global_live_info)
+get_driver().on_shutdown(BiliLiveChecker.save_snapshot)
 
 # 启用检查直播间状态的定时任务
 scheduler = require("nonebot_plugin_apscheduler").scheduler
@@ -58,10 +64,56 @@ async def live_db_upgrade():
     logger.debug('live_db_upgrade: upgrade subscription info completed')
 
 
+# 定时保存直播间状态快照
+@scheduler.scheduled_job(
+    'cron',
+    # year=None,
+    # month=None,
+    # day='*/1',
+    # week=None,
+    # day_of_week=None,
+    # hour=None,
+    minute='*/10',
+    # second=None,
+    # start_date=None,
+    # end_date=None,
+    # timezone=None,
+    id='live_state_snapshot',
+    coalesce=True,
+    misfire_grace_time=60
+)
+async def live_state_snapshot():
+    if BiliLiveChecker.reconciling():
+        return
+    await BiliLiveChecker.save_snapshot()
+
+
 # 创建直播检查函数
 async def bilibili_live_monitor():
+    # 启动后的后台同步完成前不检查, 避免把重启期间的状态变化当作新变化通知
+    if BiliLiveChecker.reconciling():
+        logger.debug(f"bilibili_live_monitor: live info reconciling, ignore.")
+        return
+
     logger.debug(f"bilibili_live_monitor: checking started")
 
+    # 获取订阅表中的所有直播间订阅
+    t = DBTable(table_name='Subscription')
+    sub_res = await t.list_col_with_condition('sub_id', 'sub_type', 1)
+    check_sub = [int(x) for x in sub_res.result]
+
+    live_poll_scheduler.sync(keys=check_sub)
+    LiveRoomRegistry.sync(rids=check_sub)
+    if not check_sub:
+        logger.debug(f'bilibili_live_monitor: no live subscription, ignore.')
+        return
+
+    live_poll_scheduler.check_staleness()
+    # 只检查已到检查时间的直播间, 使用新api时一次请求检查全部到期的直播间
+    now_checking = live_poll_scheduler.pop_due(batch=ENABLE_NEW_LIVE_API)
+    if not now_checking:
+        return
+
     # 获取当前bot列表
     bots = []
     for bot_id, bot in get_bots().items():
@@ -76,183 +128,107 @@ async def bilibili_live_monitor():
     friend_res = await DBFriend.list_exist_friends_by_private_permission(private_permission=1)
     all_noitce_friends = [int(x) for x in friend_res.result]
 
-    # 获取订阅表中的所有直播间订阅
-    t = DBTable(table_name='Subscription')
-    sub_res = await t.list_col_with_condition('sub_id', 'sub_type', 1)
-    check_sub = [int(x) for x in sub_res.result]
-
-    if not check_sub:
-        logger.debug(f'bilibili_live_monitor: no live subscription, ignore.')
-        return
-
     # 检查单个直播间状态
     async def check_live(room_id: int):
         # 获取直播间信息
         live_info_result = await BiliLiveRoom(room_id=room_id).get_info()
         if live_info_result.error:
             logger.error(f'bilibili_live_monitor: 获取直播间信息失败, room_id: {room_id}, error: {live_info_result.info}')
+            live_poll_scheduler.report(key=room_id, changed=False, success=False)
             return
         live_info = live_info_result.result
         try:
-            await BiliLiveChecker(room_id=room_id).broadcaster(
+            changed = await BiliLiveChecker(room_id=room_id).broadcaster(
                 live_info=live_info, bots=bots, all_groups=all_noitce_groups, all_friends=all_noitce_friends)
+            live_poll_scheduler.report(key=room_id, changed=changed, active=live_info.status == 1)
         except Exception as _e:
             logger.error(f'bilibili_live_monitor: 处理直播间 {room_id} 状态信息是发生错误: {repr(_e)}')
+            live_poll_scheduler.report(key=room_id, changed=False, success=False)
 
     # 检查列表uid全部用户的直播间状态
     async def check_live_by_rids(room_id_list: list):
+        # 并发初始化索引中还没有的直播间
+        missing_rids = LiveRoomRegistry.missing(rids=room_id_list)
+        if missing_rids:
+            await BiliLiveChecker.warm_up(room_id_list=missing_rids)
+
         uid_list = []
         for room_id in room_id_list:
-            uid = BiliLiveChecker.live_uid_by_rid().get(room_id)
-            if not uid:
-                await BiliLiveChecker(room_id=room_id).init_live_info()
-                uid = BiliLiveChecker.live_uid_by_rid().get(room_id)
+            uid = LiveRoomRegistry.uid(rid=room_id)
             if not uid:
                 logger.warning(f'bilibili_live_monitor: get uid from room_id failed, room_id: {room_id}')
                 continue
             uid_list.append(uid)
 
         # 获取直播间信息
-        live_info_result = await BiliLiveRoom.get_info_by_uids(uid_list=uid_list)
+        live_info_result = await BiliLiveRoom.get_info_by_uids(uid_list=list(set(uid_list)))
         if live_info_result.error:
             logger.error(f'bilibili_live_monitor: 获取直播间信息失败: error info: {live_info_result.info}')
+            for room_id in room_id_list:
+                live_poll_scheduler.report(key=room_id, changed=False, success=False)
             return
 
-        # 处理直播间短号, 否则会出现订阅短号的群组无法收到通知
-        live_info_ = live_info_result.result
-        for room_id, live_info in live_info_.copy().items():
-            short_id = live_info.short_id
-            if short_id and short_id != 0:
-                live_info_.update({short_id: live_info})
-
-        # 依次处理各直播间信息
-        for room_id, live_info in live_info_.items():
-            try:
-                await BiliLiveChecker(room_id=room_id).broadcaster(
-                    live_info=live_info, bots=bots, all_groups=all_noitce_groups, all_friends=all_noitce_friends)
-            except Exception as _e:
-                logger.error(f'bilibili_live_monitor: 处理直播间 {room_id} 状态信息是发生错误: {repr(_e)}')
-                continue
+        # 按uid找到对应的订阅房间号, 订阅短号的群组也能收到通知
+        checked_rids = set()
+        for live_info in live_info_result.result.values():
+            LiveRoomRegistry.register_short_id(room_id=int(live_info.room_id), short_id=live_info.short_id)
+            for room_id in LiveRoomRegistry.rids(uid=live_info.uid):
+                checked_rids.add(room_id)
+                try:
+                    changed = await BiliLiveChecker(room_id=room_id).broadcaster(
+                        live_info=live_info, bots=bots, all_groups=all_noitce_groups, all_friends=all_noitce_friends)
+                    live_poll_scheduler.report(key=room_id, changed=changed, active=live_info.status == 1)
+                except Exception as _e:
+                    logger.error(f'bilibili_live_monitor: 处理直播间 {room_id} 状态信息是发生错误: {repr(_e)}')
+                    live_poll_scheduler.report(key=room_id, changed=False, success=False)
+                    continue
+
+        # 未获取到信息的直播间
+        for room_id in room_id_list:
+            if room_id not in checked_rids:
+                live_poll_scheduler.report(key=room_id, changed=False, success=False)
 
     # 使用了新的API
     if ENABLE_NEW_LIVE_API:
-        # 检查所有在订阅表里面的直播间(异步)
+        # 检查已到检查时间的直播间
         try:
-            await check_live_by_rids(room_id_list=check_sub)
+            await check_live_by_rids(room_id_list=now_checking)
             logger.debug(f"bilibili_live_monitor: enable new api, checking completed, "
-                         f"checked: {', '.join([str(x) for x in check_sub])}.")
+                         f"checked: {', '.join([str(x) for x in now_checking])}.")
         except Exception as e:
             logger.error(f'bilibili_live_monitor: enable new api, error occurred in checking  {repr(e)}')
-    # 启用了检查池模式
-    elif ENABLE_LIVE_CHECK_POOL_MODE:
-        global checking_pool
-
-        # checking_pool为空则上一轮检查完了, 重新往里面放新一轮的room_id
-        if not checking_pool:
-            checking_pool.extend(check_sub)
-
-        # 看下checking_pool里面还剩多少
-        waiting_num = len(checking_pool)
-
-        # 默认单次检查并发数为2, 默认检查间隔为20s
-        logger.debug(f'bili live pool mode debug info, B_checking_pool: {checking_pool}')
-        if waiting_num >= 2:
-            # 抽取检查对象
-            now_checking = random.sample(checking_pool, k=2)
-            # 更新checking_pool
-            checking_pool = [x for x in checking_pool if x not in now_checking]
-        else:
-            now_checking = checking_pool.copy()
-            checking_pool.clear()
-        logger.debug(f'bili live pool mode debug info, A_checking_pool: {checking_pool}')
-        logger.debug(f'bili live pool mode debug info, now_checking: {now_checking}')
-
-        # 检查now_checking里面的直播间(异步)
+    else:
+        # 检查已到检查时间的直播间(异步)
         tasks = []
         for rid in now_checking:
             tasks.append(check_live(rid))
         try:
             await asyncio.gather(*tasks)
-            logger.debug(f"bilibili_live_monitor: pool mode enable, checking completed, "
+            logger.debug(f"bilibili_live_monitor: checking completed, "
                          f"checked: {', '.join([str(x) for x in now_checking])}.")
         except Exception as e:
-            logger.error(f'bilibili_live_monitor: pool mode enable, error occurred in checking {repr(e)}')
-    # 没有启用检查池模式
-    else:
-        # 检查所有在订阅表里面的直播间(异步)
-        tasks = []
-        for rid in check_sub:
-            tasks.append(check_live(rid))
-        try:
-            await asyncio.gather(*tasks)
-            logger.debug(f"bilibili_live_monitor: pool mode disable, checking completed, "
-                         f"checked: {', '.join([str(x) for x in check_sub])}.")
-        except Exception as e:
-            logger.error(f'bilibili_live_monitor: pool mode disable, error occurred in checking  {repr(e)}')
+            logger.error(f'bilibili_live_monitor: error occurred in checking  {repr(e)}')
 
 
-# 分时间段创建计划任务, 夜间闲时降低检查频率
-# 根据检查池模式初始化检查时间间隔
-if ENABLE_NEW_LIVE_API:
-    # 使用新api
-    scheduler.add_job(
-        bilibili_live_monitor,
-        'cron',
-        # year=None,
-        # month=None,
-        # day='*/1',
-        # week=None,
-        # day_of_week=None,
-        # hour=None,
-        # minute=None,
-        second='*/30',
-        # start_date=None,
-        # end_date=None,
-        # timezone=None,
-        id='bilibili_live_monitor_enable_new_api',
-        coalesce=True,
-        misfire_grace_time=30
-    )
-elif ENABLE_LIVE_CHECK_POOL_MODE:
-    # 检查池启用
-    scheduler.add_job(
-        bilibili_live_monitor,
-        'cron',
-        # year=None,
-        # month=None,
-        # day='*/1',
-        # week=None,
-        # day_of_week=None,
-        # hour='9-23',
-        # minute='*/2',
-        second='10-50/20',
-        # start_date=None,
-        # end_date=None,
-        # timezone=None,
-        id='bilibili_live_monitor_pool_enable',
-        coalesce=True,
-        misfire_grace_time=20
-    )
-else:
-    # 检查池禁用
-    scheduler.add_job(
-        bilibili_live_monitor,
-        'cron',
-        # year=None,
-        # month=None,
-        # day='*/1',
-        # week=None,
-        # day_of_week=None,
-        # hour=None,
-        minute='*/1',
-        # second=None,
-        # start_date=None,
-        # end_date=None,
-        # timezone=None,
-        id='bilibili_live_monitor_pool_disable',
-        coalesce=True,
-        misfire_grace_time=30
-    )
+# 定时任务只负责触发调度, 各直播间的实际检查间隔由 live_poll_scheduler 决定
+scheduler.add_job(
+    bilibili_live_monitor,
+    'cron',
+    # year=None,
+    # month=None,
+    # day='*/1',
+    # week=None,
+    # day_of_week=None,
+    # hour=None,
+    # minute=None,
+    second='*/10',
+    # start_date=None,
+    # end_date=None,
+    # timezone=None,
+    id='bilibili_live_monitor',
+    coalesce=True,
+    misfire_grace_time=10
+)
 
 __all__ = [
     'scheduler'
@@ -0,0 +1,82 @@
+"""
+直播间索引
+订阅使用的房间号可能是短号, 批量接口按 uid 查询并以真实房间号返回结果
+这里维护 订阅房间号 / 短号 / 真实房间号 / uid 之间的双向索引
+"""
+from typing import Dict, Set, List, Iterable, Optional
+
+
+class LiveRoomRegistry(object):
+    # key: 订阅房间号(可能为短号), value: uid
+    __uid_by_rid: Dict[int, int] = {}
+    # key: uid, value: 该用户直播间的全部订阅房间号
+    __rids_by_uid: Dict[int, Set[int]] = {}
+    # key: 短号, value: 真实房间号
+    __room_id_by_short_id: Dict[int, int] = {}
+    # key: 真实房间号, value: 短号
+    __short_id_by_room_id: Dict[int, int] = {}
+
+    @classmethod
+    def register(cls, rid: int, uid: int) -> None:
+        """
+        :param rid: 订阅使用的房间号
+        :param uid: 直播间用户 uid
+        """
+        old_uid = cls.__uid_by_rid.get(rid)
+        if old_uid is not None and old_uid != uid:
+            cls.__rids_by_uid.get(old_uid, set()).discard(rid)
+        cls.__uid_by_rid[rid] = uid
+        cls.__rids_by_uid.setdefault(uid, set()).add(rid)
+
+    @classmethod
+    def register_short_id(cls, room_id: int, short_id: Optional[int]) -> None:
+        """
+        :param room_id: 真实房间号
+        :param short_id: 短号, 0 或 None 为没有短号
+        """
+        if short_id:
+            cls.__room_id_by_short_id[short_id] = room_id
+            cls.__short_id_by_room_id[room_id] = short_id
+
+    @classmethod
+    def unregister(cls, rid: int) -> None:
+        uid = cls.__uid_by_rid.pop(rid, None)
+        if uid is not None:
+            rids = cls.__rids_by_uid.get(uid, set())
+            rids.discard(rid)
+            if not rids:
+                cls.__rids_by_uid.pop(uid, None)
+
+    @classmethod
+    def sync(cls, rids: Iterable[int]) -> None:
+        """
+        移除已取消订阅的直播间
+        """
+        rids = set(rids)
+        for rid in [x for x in cls.__uid_by_rid if x not in rids]:
+            cls.unregister(rid=rid)
+
+    @classmethod
+    def uid(cls, rid: int) -> Optional[int]:
+        return cls.__uid_by_rid.get(rid)
+
+    @classmethod
+    def rids(cls, uid: int) -> Set[int]:
+        return set(cls.__rids_by_uid.get(uid, set()))
+
+    @classmethod
+    def room_id(cls, short_id: int) -> Optional[int]:
+        return cls.__room_id_by_short_id.get(short_id)
+
+    @classmethod
+    def short_id(cls, room_id: int) -> Optional[int]:
+        return cls.__short_id_by_room_id.get(room_id)
+
+    @classmethod
+    def missing(cls, rids: Iterable[int]) -> List[int]:
+        return [rid for rid in rids if rid not in cls.__uid_by_rid]
+
+
+__all__ = [
+    'LiveRoomRegistry'
+]
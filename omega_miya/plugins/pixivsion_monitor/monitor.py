@@ -2,6 +2,7 @@ import asyncio
 from nonebot import logger, require, get_bots
 from nonebot.adapters.cqhttp import MessageSegment
 from omega_miya.utils.Omega_Base import DBSubscription, DBTable
+from omega_miya.utils.Omega_plugin_utils import NoticeDispatcher
 from omega_miya.utils.pixiv_utils import PixivIllust, PixivisionArticle
 from .utils import pixivsion_article_parse
 from .block_tag import TAG_BLOCK_LIST
@@ -103,11 +104,8 @@ async def pixivision_monitor():
                   f"《{article_data['title']}》\n\n{article_data['description']}\n{article_data['url']}"
             for group_id in notice_group:
                 for _bot in bots:
-                    try:
-                        await _bot.call_api(api='send_group_msg', group_id=group_id, message=msg)
-                    except Exception as e:
-                        logger.warning(f"向群组: {group_id} 发送article简介信息失败, error: {repr(e)}")
-                        continue
+                    NoticeDispatcher.send_group_msg(
+                        bot=_bot, group_id=group_id, message=msg, description=f'article: {aid} 简介信息')
             # 处理article中图片内容
             tasks = []
             for pid in article_data['illusts_list']:
@@ -120,17 +118,12 @@ async def pixivision_monitor():
                     continue
                 else:
                     img_seg = MessageSegment.image(image_res.result)
-                # 发送图片
+                # 发送图片, 发送间隔由 NoticeDispatcher 控制
                 for group_id in notice_group:
                     for _bot in bots:
-                        try:
-                            await _bot.call_api(api='send_group_msg', group_id=group_id, message=img_seg)
-                            # 避免风控控制推送间隔
-                            await asyncio.sleep(1)
-                        except Exception as e:
-                            logger.warning(f"向群组: {group_id} 发送图片内容失败, error: {repr(e)}")
-                            continue
-            logger.info(f"article: {aid} 图片已发送完成, 失败: {image_error}")
+                        NoticeDispatcher.send_group_msg(
+                            bot=_bot, group_id=group_id, message=img_seg, description=f'article: {aid} 图片内容')
+            logger.info(f"article: {aid} 图片已加入发送队列, 失败: {image_error}")
         else:
             logger.error(f"article: {aid} 信息解析失败, info: {a_res.info}")
     logger.info(f'pixivision_monitor: checking completed, 已处理新的article: {repr(new_article)}')
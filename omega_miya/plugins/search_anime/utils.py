@@ -17,7 +17,7 @@ async def pic_2_base64(url: str) -> Result.TextResult:
     if bytes_result.error:
         return Result.TextResult(error=True, info='Image download failed', result='')
 
-    encode_result = PicEncoder.bytes_to_b64(image=bytes_result.result)
+    encode_result = await PicEncoder.async_bytes_to_b64(image=bytes_result.result)
 
     if encode_result.success():
         return Result.TextResult(error=False, info='Success', result=encode_result.result)
@@ -10,7 +10,8 @@ from nonebot.adapters.cqhttp import MessageSegment
 from omega_miya.utils.Omega_plugin_utils import init_export, init_permission_state, PluginCoolDown
 from omega_miya.utils.Omega_Base import DBPixivillust
 from omega_miya.utils.pixiv_utils import PixivIllust
-from .utils import add_illust
+from .utils import fetch_illust
+from .prefetch import SetuPrefetcher
 
 
 # Custom plugin usage text
@@ -95,39 +96,49 @@ async def handle_setu(bot: Bot, event: MessageEvent, state: T_State):
     nsfw_tag = state['nsfw_tag']
     tags = state['tags']
 
-    if tags:
-        pid_res = await DBPixivillust.list_illust(keywords=tags, num=3, nsfw_tag=nsfw_tag)
-        pid_list = pid_res.result
-    else:
-        # 没有tag则随机获取
-        pid_res = await DBPixivillust.rand_illust(num=3, nsfw_tag=nsfw_tag)
-        pid_list = pid_res.result
-
-    if not pid_list:
-        logger.info(f"{group_id} / {event.user_id} 没有找到他/她想要的涩图")
-        await setu.finish('找不到涩图QAQ')
-    await setu.send('稍等, 正在下载图片~')
-    # 处理article中图片内容
-    tasks = []
-    for pid in pid_list:
-        tasks.append(PixivIllust(pid=pid).pic_2_base64())
-    p_res = await asyncio.gather(*tasks)
-    fault_count = 0
-    for image_res in p_res:
-        try:
-            if not image_res.success():
-                fault_count += 1
-                logger.warning(f'图片下载失败, error: {image_res.info}')
+    prefetched = []
+    prefetched_pids = []
+    try:
+        if tags:
+            pid_res = await DBPixivillust.list_illust(keywords=tags, num=3, nsfw_tag=nsfw_tag)
+            pid_list = pid_res.result
+        else:
+            # 没有tag则随机获取, 优先使用预取的图片
+            prefetched = SetuPrefetcher.take(nsfw_tag=nsfw_tag, num=3)
+            prefetched_pids = [x.pid for x in prefetched]
+            pid_res = await DBPixivillust.rand_illust(num=3 - len(prefetched), nsfw_tag=nsfw_tag)
+            pid_list = [x for x in pid_res.result if x not in prefetched_pids]
+
+        if not pid_list and not prefetched:
+            logger.info(f"{group_id} / {event.user_id} 没有找到他/她想要的涩图")
+            await setu.finish('找不到涩图QAQ')
+        if pid_list:
+            await setu.send('稍等, 正在下载图片~')
+        # 处理article中图片内容
+        tasks = []
+        for pid in pid_list:
+            tasks.append(PixivIllust(pid=pid).pic_2_base64())
+        p_res = await asyncio.gather(*[x.file_result() for x in prefetched], *tasks)
+        fault_count = 0
+        for image_res in p_res:
+            try:
+                if not image_res.success():
+                    fault_count += 1
+                    logger.warning(f'图片下载失败, error: {image_res.info}')
+                    continue
+                else:
+                    img_seg = MessageSegment.image(image_res.result)
+                # 发送图片
+                await setu.send(img_seg)
+            except Exception as e:
+                logger.warning(f"图片发送失败, {group_id} / {event.user_id}. error: {repr(e)}")
                 continue
-            else:
-                img_seg = MessageSegment.image(image_res.result)
-            # 发送图片
-            await setu.send(img_seg)
-        except Exception as e:
-            logger.warning(f"图片发送失败, {group_id} / {event.user_id}. error: {repr(e)}")
-            continue
-
-    if fault_count == len(pid_list):
+    finally:
+        # 预取的图片发送后删除, 出错或被取消时同样删除, 取出后已不在缓冲区中
+        SetuPrefetcher.release(prefetched)
+    pid_list = prefetched_pids + pid_list
+
+    if fault_count == len(p_res):
         logger.info(f"{group_id} / {event.user_id} 没能看到他/她想要的涩图, 图片下载失败, {pid_list}")
         await setu.finish('似乎出现了网络问题, 所有的图片都下载失败了QAQ')
     else:
@@ -165,40 +176,50 @@ async def handle_moepic(bot: Bot, event: MessageEvent, state: T_State):
 
     tags = state['tags']
 
-    if tags:
-        pid_res = await DBPixivillust.list_illust(keywords=tags, num=3, nsfw_tag=0)
-        pid_list = pid_res.result
-    else:
-        # 没有tag则随机获取
-        pid_res = await DBPixivillust.rand_illust(num=3, nsfw_tag=0)
-        pid_list = pid_res.result
-
-    if not pid_list:
-        logger.info(f"{group_id} / {event.user_id} 没有找到他/她想要的萌图")
-        await moepic.finish('找不到萌图QAQ')
-
-    await moepic.send('稍等, 正在下载图片~')
-    # 处理article中图片内容
-    tasks = []
-    for pid in pid_list:
-        tasks.append(PixivIllust(pid=pid).pic_2_base64())
-    p_res = await asyncio.gather(*tasks)
-    fault_count = 0
-    for image_res in p_res:
-        try:
-            if not image_res.success():
-                fault_count += 1
-                logger.warning(f'图片下载失败, error: {image_res.info}')
+    prefetched = []
+    prefetched_pids = []
+    try:
+        if tags:
+            pid_res = await DBPixivillust.list_illust(keywords=tags, num=3, nsfw_tag=0)
+            pid_list = pid_res.result
+        else:
+            # 没有tag则随机获取, 优先使用预取的图片
+            prefetched = SetuPrefetcher.take(nsfw_tag=0, num=3)
+            prefetched_pids = [x.pid for x in prefetched]
+            pid_res = await DBPixivillust.rand_illust(num=3 - len(prefetched), nsfw_tag=0)
+            pid_list = [x for x in pid_res.result if x not in prefetched_pids]
+
+        if not pid_list and not prefetched:
+            logger.info(f"{group_id} / {event.user_id} 没有找到他/她想要的萌图")
+            await moepic.finish('找不到萌图QAQ')
+
+        if pid_list:
+            await moepic.send('稍等, 正在下载图片~')
+        # 处理article中图片内容
+        tasks = []
+        for pid in pid_list:
+            tasks.append(PixivIllust(pid=pid).pic_2_base64())
+        p_res = await asyncio.gather(*[x.file_result() for x in prefetched], *tasks)
+        fault_count = 0
+        for image_res in p_res:
+            try:
+                if not image_res.success():
+                    fault_count += 1
+                    logger.warning(f'图片下载失败, error: {image_res.info}')
+                    continue
+                else:
+                    img_seg = MessageSegment.image(image_res.result)
+                # 发送图片
+                await moepic.send(img_seg)
+            except Exception as e:
+                logger.warning(f"图片发送失败, {group_id} / {event.user_id}. error: {repr(e)}")
                 continue
-            else:
-                img_seg = MessageSegment.image(image_res.result)
-            # 发送图片
-            await moepic.send(img_seg)
-        except Exception as e:
-            logger.warning(f"图片发送失败, {group_id} / {event.user_id}. error: {repr(e)}")
-            continue
-
-    if fault_count == len(pid_list):
+    finally:
+        # 预取的图片发送后删除, 出错或被取消时同样删除, 取出后已不在缓冲区中
+        SetuPrefetcher.release(prefetched)
+    pid_list = prefetched_pids + pid_list
+
+    if fault_count == len(p_res):
         logger.info(f"{group_id} / {event.user_id} 没能看到他/她想要的萌图, 图片下载失败, {pid_list}")
         await moepic.finish('似乎出现了网络问题, 所有的图片都下载失败了QAQ')
     else:
@@ -296,16 +317,24 @@ async def handle_setu_import(bot: Bot, event: MessageEvent, state: T_State):
     # 每个切片打包一个任务
     seg_len = len(pid_seg_list)
     process_rate = 0
-    for seg_list in pid_seg_list:
+    # 获取到的作品信息先缓存, 攒够一批后在一个事务中批量写入数据库
+    bulk_n = 200
+    illust_buffer = []
+    for index, seg_list in enumerate(pid_seg_list):
         tasks = []
         for pid in seg_list:
-            tasks.append(add_illust(pid=pid, nsfw_tag=nsfw_tag))
+            tasks.append(fetch_illust(pid=pid, nsfw_tag=nsfw_tag))
         # 进行异步处理
         _res = await asyncio.gather(*tasks)
-        # 对结果进行计数
-        for item in _res:
-            if item.success():
-                success_count += 1
+        illust_buffer.extend([item.result for item in _res if item.success()])
+        # 批量写入并对结果进行计数
+        if len(illust_buffer) >= bulk_n or index == seg_len - 1:
+            bulk_res = await DBPixivillust.bulk_add_illusts(illusts=illust_buffer)
+            if bulk_res.success():
+                success_count += bulk_res.result
+            else:
+                logger.error(f'setu_import: 批量写入数据库失败, error: {bulk_res.info}')
+            illust_buffer.clear()
         # 显示进度
         process_rate += 1
         if process_rate % 10 == 0:
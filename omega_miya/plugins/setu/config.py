@@ -0,0 +1,19 @@
+from pydantic import BaseSettings
+from typing import List
+
+
+class Config(BaseSettings):
+
+    # 图片预取配置
+    """
+    按 nsfw_tag 预先随机抽取作品并下载图片到 tmp/setu_prefetch, 不带 tag 的请求直接发送已下载的图片
+    setu_prefetch_nsfw_tags: 需要预取的 nsfw_tag, 0: 萌图, 1: 涩图, 2: r18
+    setu_prefetch_buffer_size: 每个 nsfw_tag 预取的图片数, 为 0 时关闭预取
+    setu_prefetch_max_bytes: 预取图片总大小上限(bytes), 超出后淘汰最早下载的图片
+    """
+    setu_prefetch_nsfw_tags: List[int] = [0, 1, 2]
+    setu_prefetch_buffer_size: int = 6
+    setu_prefetch_max_bytes: int = 128 * 1024 * 1024
+
+    class Config:
+        extra = "ignore"
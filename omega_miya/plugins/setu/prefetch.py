@@ -0,0 +1,192 @@
+"""
+图片预取
+按 nsfw_tag 预先随机抽取作品并下载图片到本地, 不带 tag 的请求直接取出已下载的图片发送
+图片取出后在后台补充, 编码为 base64 或发送完成后删除, 总大小超出上限时淘汰最早下载的图片
+"""
+import os
+import time
+import shutil
+import asyncio
+import itertools
+from collections import deque
+from dataclasses import dataclass
+from typing import Dict, Deque, List, Optional
+from nonebot import logger, get_driver
+from omega_miya.utils.Omega_Base import DBPixivillust, Result
+from omega_miya.utils.Omega_plugin_utils import PicEncoder
+from omega_miya.utils.pixiv_utils import PixivIllust
+from .config import Config
+
+
+global_config = get_driver().config
+plugin_config = Config(**global_config.dict())
+TMP_PATH = global_config.tmp_path_
+SETU_PREFETCH_NSFW_TAGS = plugin_config.setu_prefetch_nsfw_tags
+SETU_PREFETCH_BUFFER_SIZE = plugin_config.setu_prefetch_buffer_size
+SETU_PREFETCH_MAX_BYTES = plugin_config.setu_prefetch_max_bytes
+SETU_PREFETCH_PATH = os.path.abspath(os.path.join(TMP_PATH, 'setu_prefetch'))
+
+
+@dataclass
+class PrefetchedIllust:
+    pid: int
+    nsfw_tag: int
+    file_path: str
+    size: int
+    downloaded_at: float
+
+    async def file_result(self) -> Result.TextResult:
+        """
+        :return: 可直接用于 MessageSegment.image 的文件, 按 pic_encoder_send_file 配置为 file:/// 路径或 base64
+        """
+        send_result = await PicEncoder.file_to_send(file_path=self.file_path)
+        if send_result.error:
+            return Result.TextResult(error=True, info=send_result.info, result='')
+        # 已编码为 base64 的图片不再需要本地文件
+        if not send_result.result.startswith('file:///'):
+            SetuPrefetcher.release([self])
+        return Result.TextResult(error=False, info='Prefetched', result=send_result.result)
+
+
+class SetuPrefetcher(object):
+    # key: nsfw_tag, value: 已下载的图片, 按下载先后排列
+    __buffers: Dict[int, Deque[PrefetchedIllust]] = {}
+    __total_bytes: int = 0
+    __refill_tasks: Dict[int, asyncio.Task] = {}
+    # 文件名序号, 避免同一作品重复预取时文件互相覆盖
+    __counter = itertools.count()
+    __stats: Dict[str, int] = {
+        'hits': 0,
+        'misses': 0,
+        'downloaded': 0,
+        'evicted': 0,
+        'failures': 0
+    }
+
+    @classmethod
+    def take(cls, nsfw_tag: int, num: int) -> List[PrefetchedIllust]:
+        """
+        取出已下载的图片并在后台补充, 发送后需调用 release 删除文件
+        :return: 取出的图片, 数量可能少于 num
+        """
+        buffer = cls.__buffers.get(nsfw_tag)
+        items = []
+        while buffer and len(items) < num:
+            item = buffer.popleft()
+            cls.__total_bytes -= item.size
+            items.append(item)
+        cls.__stats['hits'] += len(items)
+        cls.__stats['misses'] += num - len(items)
+        cls.refill(nsfw_tag=nsfw_tag)
+        return items
+
+    @classmethod
+    def release(cls, items: List[PrefetchedIllust]) -> None:
+        """
+        删除取出的图片, 可重复调用
+        """
+        for item in items:
+            cls.__remove_file(item=item)
+
+    @classmethod
+    def __remove_file(cls, item: PrefetchedIllust) -> None:
+        try:
+            os.remove(item.file_path)
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logger.opt(colors=True).debug(f'<Y><lw>SetuPrefetcher</lw></Y> remove {item.file_path} failed, {repr(e)}')
+
+    @classmethod
+    def refill(cls, nsfw_tag: int) -> None:
+        """
+        在后台补充缓冲区, 同一 nsfw_tag 同时只有一个补充任务
+        """
+        if nsfw_tag not in SETU_PREFETCH_NSFW_TAGS or SETU_PREFETCH_BUFFER_SIZE <= 0:
+            return
+        task = cls.__refill_tasks.get(nsfw_tag)
+        if task is None or task.done():
+            cls.__refill_tasks[nsfw_tag] = asyncio.create_task(cls.__refill(nsfw_tag=nsfw_tag))
+
+    @classmethod
+    async def __refill(cls, nsfw_tag: int) -> None:
+        buffer = cls.__buffers.setdefault(nsfw_tag, deque())
+        missing = SETU_PREFETCH_BUFFER_SIZE - len(buffer)
+        if missing <= 0 or cls.__total_bytes >= SETU_PREFETCH_MAX_BYTES:
+            return
+
+        pid_res = await DBPixivillust.rand_illust(num=missing, nsfw_tag=nsfw_tag)
+        if pid_res.error:
+            logger.opt(colors=True).warning(
+                f'<Y><lw>SetuPrefetcher</lw></Y> get random illust failed, nsfw_tag: {nsfw_tag}, {pid_res.info}')
+            return
+
+        buffered_pids = [item.pid for item in buffer]
+        tasks = [cls.__download(pid=pid, nsfw_tag=nsfw_tag) for pid in pid_res.result if pid not in buffered_pids]
+        for item in await asyncio.gather(*tasks):
+            if item is not None:
+                buffer.append(item)
+                cls.__total_bytes += item.size
+        cls.__evict()
+        logger.opt(colors=True).debug(
+            f'<Y><lw>SetuPrefetcher</lw></Y> nsfw_tag: {nsfw_tag} refilled, buffered {len(buffer)} illusts')
+
+    @classmethod
+    async def __download(cls, pid: int, nsfw_tag: int) -> Optional[PrefetchedIllust]:
+        illust = PixivIllust(pid=pid)
+        illust_data_result = await illust.get_illust_data()
+        if illust_data_result.error:
+            cls.__stats['failures'] += 1
+            return None
+
+        url = illust_data_result.result.get('regular_url') or f'{pid}.tmp'
+        file_name = f'{next(cls.__counter)}_{os.path.basename(url)}'
+        download_result = await illust.download_pic(
+            path=os.path.join(SETU_PREFETCH_PATH, str(nsfw_tag)), file_name=file_name)
+        if download_result.error:
+            cls.__stats['failures'] += 1
+            logger.opt(colors=True).debug(
+                f'<Y><lw>SetuPrefetcher</lw></Y> download illust {pid} failed, {download_result.info}')
+            return None
+
+        cls.__stats['downloaded'] += 1
+        return PrefetchedIllust(pid=pid, nsfw_tag=nsfw_tag, file_path=download_result.result,
+                                size=os.path.getsize(download_result.result), downloaded_at=time.time())
+
+    @classmethod
+    def __evict(cls) -> None:
+        while cls.__total_bytes > SETU_PREFETCH_MAX_BYTES:
+            buffers = [buffer for buffer in cls.__buffers.values() if buffer]
+            if not buffers:
+                break
+            oldest = min(buffers, key=lambda x: x[0].downloaded_at)
+            item = oldest.popleft()
+            cls.__total_bytes -= item.size
+            cls.__stats['evicted'] += 1
+            cls.__remove_file(item=item)
+
+    @classmethod
+    async def init(cls) -> None:
+        """
+        清除上次运行残留的图片后开始预取
+        """
+        if os.path.exists(SETU_PREFETCH_PATH):
+            await asyncio.get_running_loop().run_in_executor(
+                None, lambda: shutil.rmtree(SETU_PREFETCH_PATH, ignore_errors=True))
+        for nsfw_tag in SETU_PREFETCH_NSFW_TAGS:
+            cls.refill(nsfw_tag=nsfw_tag)
+
+    @classmethod
+    def stats(cls) -> Dict[str, int]:
+        stats = dict(cls.__stats)
+        stats.update({'buffered': sum(len(x) for x in cls.__buffers.values()), 'total_bytes': cls.__total_bytes})
+        return stats
+
+
+get_driver().on_startup(SetuPrefetcher.init)
+
+
+__all__ = [
+    'PrefetchedIllust',
+    'SetuPrefetcher'
+]
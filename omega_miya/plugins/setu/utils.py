@@ -2,23 +2,34 @@ from omega_miya.utils.Omega_Base import DBPixivillust, Result
 from omega_miya.utils.pixiv_utils import PixivIllust
 
 
-async def add_illust(pid: int, nsfw_tag: int) -> Result.IntResult:
+async def fetch_illust(pid: int, nsfw_tag: int) -> Result.DictResult:
     illust_result = await PixivIllust(pid=pid).get_illust_data()
 
     if illust_result.success():
         illust_data = illust_result.result
-        title = illust_data.get('title')
-        uid = illust_data.get('uid')
-        uname = illust_data.get('uname')
-        url = illust_data.get('url')
-        tags = illust_data.get('tags')
-        is_r18 = illust_data.get('is_r18')
+        illust = {
+            'pid': pid,
+            'uid': illust_data.get('uid'),
+            'title': illust_data.get('title'),
+            'uname': illust_data.get('uname'),
+            'nsfw_tag': 2 if illust_data.get('is_r18') else nsfw_tag,
+            'tags': illust_data.get('tags'),
+            'url': illust_data.get('url')
+        }
+        return Result.DictResult(error=False, info='Success', result=illust)
+    else:
+        return Result.DictResult(error=True, info=illust_result.info, result={})
+
 
-        if is_r18:
-            nsfw_tag = 2
+async def add_illust(pid: int, nsfw_tag: int) -> Result.IntResult:
+    illust_result = await fetch_illust(pid=pid, nsfw_tag=nsfw_tag)
 
+    if illust_result.success():
+        illust_data = illust_result.result
         illust = DBPixivillust(pid=pid)
-        _res = await illust.add(uid=uid, title=title, uname=uname, nsfw_tag=nsfw_tag, tags=tags, url=url)
+        _res = await illust.add(uid=illust_data.get('uid'), title=illust_data.get('title'),
+                                uname=illust_data.get('uname'), nsfw_tag=illust_data.get('nsfw_tag'),
+                                tags=illust_data.get('tags'), url=illust_data.get('url'))
         return _res
     else:
         return Result.IntResult(error=True, info=illust_result.info, result=-1)
@@ -0,0 +1,17 @@
+from pydantic import BaseSettings
+
+
+class Config(BaseSettings):
+
+    # 数据库连接池配置
+    """
+    db_pool_size: 连接池保持的连接数
+    db_max_overflow: 连接池满时允许额外创建的连接数
+    db_pool_timeout: 从连接池获取连接的超时时间(秒)
+    """
+    db_pool_size: int = 10
+    db_max_overflow: int = 20
+    db_pool_timeout: int = 30
+
+    class Config:
+        extra = "ignore"
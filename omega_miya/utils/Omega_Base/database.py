@@ -5,6 +5,7 @@ from sqlalchemy.future import select
 from sqlalchemy.orm import sessionmaker
 from .tables import Base
 from .class_result import Result
+from .config import Config
 
 global_config = nonebot.get_driver().config
 __DATABASE = 'mysql'
@@ -14,6 +15,10 @@ __DB_PASSWORD = global_config.db_password
 __DB_HOST = global_config.db_host
 __DB_PORT = global_config.db_port
 __DB_NAME = global_config.db_name
+plugin_config = Config(**global_config.dict())
+__DB_POOL_SIZE = plugin_config.db_pool_size
+__DB_MAX_OVERFLOW = plugin_config.db_max_overflow
+__DB_POOL_TIMEOUT = plugin_config.db_pool_timeout
 
 # 格式化数据库引擎链接
 __DB_ENGINE = f'{__DATABASE}+{__DB_DRIVER}://{__DB_USER}:{__DB_PASSWORD}@{__DB_HOST}:{__DB_PORT}/{__DB_NAME}'
@@ -24,6 +29,7 @@ try:
     engine = create_async_engine(
         __DB_ENGINE, encoding='utf8',
         connect_args={"use_unicode": True, "charset": "utf8mb4"},
+        pool_size=__DB_POOL_SIZE, max_overflow=__DB_MAX_OVERFLOW, pool_timeout=__DB_POOL_TIMEOUT,
         pool_recycle=3600, pool_pre_ping=True, echo=False
     )
 except Exception as exp:
@@ -54,17 +60,19 @@ async def database_init():
 nonebot.get_driver().on_startup(database_init)
 
 
+# 全局共用的 session 工厂, 避免每次查询都重新创建 sessionmaker
+# expire_on_commit=False will prevent attributes from being expired
+# after commit.
+async_session_factory = sessionmaker(
+    engine, expire_on_commit=False, class_=AsyncSession
+)
+
+
 class NBdb(object):
-    def __init__(self):
-        # expire_on_commit=False will prevent attributes from being expired
-        # after commit.
-        self.__async_session = sessionmaker(
-            engine, expire_on_commit=False, class_=AsyncSession
-        )
-
-    def get_async_session(self):
-        # 创建DBSession对象
-        return self.__async_session
+    @classmethod
+    def get_async_session(cls):
+        # 返回全局 session 工厂
+        return async_session_factory
 
 
 class DBTable(object):
@@ -3,6 +3,7 @@ from omega_miya.utils.Omega_Base.class_result import Result
 from omega_miya.utils.Omega_Base.tables import Bilidynamic
 from datetime import datetime
 from sqlalchemy.future import select
+from sqlalchemy.sql.expression import func
 from sqlalchemy.orm.exc import NoResultFound, MultipleResultsFound
 
 
@@ -64,3 +65,22 @@ class DBDynamic(object):
                 await session.rollback()
                 result = Result.IntResult(error=True, info=repr(e), result=-1)
         return result
+
+    @classmethod
+    async def list_latest_dynamic_ids(cls) -> Result.DictResult:
+        """
+        :return: Dict[uid, 该用户最新的 dynamic_id]
+        """
+        async_session = NBdb().get_async_session()
+        async with async_session() as session:
+            async with session.begin():
+                try:
+                    session_result = await session.execute(
+                        select(Bilidynamic.uid, func.max(Bilidynamic.dynamic_id)).
+                        group_by(Bilidynamic.uid)
+                    )
+                    res = {int(uid): int(dynamic_id) for uid, dynamic_id in session_result.all()}
+                    result = Result.DictResult(error=False, info='Success', result=res)
+                except Exception as e:
+                    result = Result.DictResult(error=True, info=repr(e), result={})
+        return result
@@ -1,8 +1,10 @@
+from typing import List, Dict, Any
 from omega_miya.utils.Omega_Base.database import NBdb
 from omega_miya.utils.Omega_Base.class_result import Result
 from omega_miya.utils.Omega_Base.tables import CoolDownEvent
 from datetime import datetime
 from sqlalchemy.future import select
+from sqlalchemy import delete, insert
 from sqlalchemy.orm.exc import NoResultFound, MultipleResultsFound
 
 
@@ -244,3 +246,46 @@ class DBCoolDownEvent(object):
                 except Exception:
                     await session.rollback()
                     continue
+
+    @classmethod
+    async def list_active_events(cls) -> Result.ListResult:
+        """
+        :return: Result: List[Tuple[event_type, plugin, group_id, user_id, stop_at, description]]
+        """
+        async_session = NBdb().get_async_session()
+        async with async_session() as session:
+            async with session.begin():
+                try:
+                    session_result = await session.execute(
+                        select(CoolDownEvent.event_type, CoolDownEvent.plugin, CoolDownEvent.group_id,
+                               CoolDownEvent.user_id, CoolDownEvent.stop_at, CoolDownEvent.description).
+                        where(CoolDownEvent.stop_at > datetime.now())
+                    )
+                    res = [tuple(x) for x in session_result.all()]
+                    result = Result.ListResult(error=False, info='Success', result=res)
+                except Exception as e:
+                    result = Result.ListResult(error=True, info=repr(e), result=[])
+        return result
+
+    @classmethod
+    async def replace_all_events(cls, events: List[Dict[str, Any]]) -> Result.IntResult:
+        """
+        在一个事务中使用新的冷却事件列表替换表中全部事件
+        :param events: 冷却事件列表, 每项包含 event_type, plugin, group_id, user_id, stop_at, description
+        :return: 写入的事件数
+        """
+        async_session = NBdb().get_async_session()
+        async with async_session() as session:
+            try:
+                async with session.begin():
+                    await session.execute(delete(CoolDownEvent))
+                    if events:
+                        now = datetime.now()
+                        await session.execute(
+                            insert(CoolDownEvent).values([dict(event, created_at=now) for event in events]))
+                    result = Result.IntResult(error=False, info='Success', result=len(events))
+                await session.commit()
+            except Exception as e:
+                await session.rollback()
+                result = Result.IntResult(error=True, info=repr(e), result=-1)
+        return result
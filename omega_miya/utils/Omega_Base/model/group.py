@@ -5,8 +5,11 @@ from omega_miya.utils.Omega_Base.tables import \
 from .user import DBUser, DBSkill
 from .subscription import DBSubscription
 from .mail import DBEmailBox
+from typing import List, Tuple
 from datetime import datetime
 from sqlalchemy.future import select
+from sqlalchemy import insert, update, delete, bindparam
+from sqlalchemy.dialects.mysql import insert as mysql_insert
 from sqlalchemy.orm.exc import NoResultFound, MultipleResultsFound
 
 
@@ -197,6 +200,121 @@ class DBGroup(object):
                 result = Result.IntResult(error=True, info=repr(e), result=-1)
         return result
 
+    async def member_sync(self, members: List[Tuple[int, str, str]]) -> Result.DictResult:
+        """
+        在一个事务中将群成员与给定的成员列表同步, 只写入有变化的部分
+        :param members: 成员列表, List[Tuple[qq, nickname, user_group_nickname]]
+        :return: Result: Dict[str, int], 各类变更的数量
+        """
+        group_id_result = await self.id()
+        if group_id_result.error:
+            return Result.DictResult(error=True, info='Group not exist', result={})
+        group_table_id = group_id_result.result
+        members = {int(qq): (nickname, user_group_nickname) for qq, nickname, user_group_nickname in members}
+        stat = {'user_added': 0, 'user_updated': 0, 'member_added': 0, 'member_updated': 0, 'member_removed': 0}
+
+        async_session = NBdb().get_async_session()
+        async with async_session() as session:
+            try:
+                async with session.begin():
+                    now = datetime.now()
+                    # 同步用户表
+                    session_result = await session.execute(
+                        select(User.qq, User.id, User.nickname).where(User.qq.in_(list(members.keys())))
+                    )
+                    exist_users = {qq: (user_id, nickname) for qq, user_id, nickname in session_result.all()}
+
+                    new_users = [{'qq': qq, 'nickname': nickname, 'is_friend': 0, 'created_at': now}
+                                 for qq, (nickname, _) in members.items() if qq not in exist_users]
+                    if new_users:
+                        # 多个群同时同步时同一用户可能已被其他事务写入, 忽略已存在的 qq 后重新查询 id
+                        stmt = mysql_insert(User).values(new_users)
+                        stmt = stmt.on_duplicate_key_update(qq=stmt.inserted.qq)
+                        await session.execute(stmt)
+                        # 使用锁定读, 一致性读看不到事务开始后其他事务写入的用户
+                        session_result = await session.execute(
+                            select(User.qq, User.id, User.nickname).
+                            where(User.qq.in_([x['qq'] for x in new_users])).
+                            with_for_update()
+                        )
+                        exist_users.update({qq: (user_id, nickname) for qq, user_id, nickname in session_result.all()})
+
+                    changed_users = [{'b_id': exist_users[qq][0], 'b_nickname': nickname}
+                                     for qq, (nickname, _) in members.items()
+                                     if qq in exist_users and exist_users[qq][1] != nickname]
+                    if changed_users:
+                        await session.execute(
+                            update(User).where(User.id == bindparam('b_id')).
+                            values(nickname=bindparam('b_nickname'), updated_at=now),
+                            changed_users
+                        )
+
+                    # 同步用户-群关系
+                    member_ids = {exist_users[qq][0]: user_group_nickname
+                                  for qq, (_, user_group_nickname) in members.items()}
+                    session_result = await session.execute(
+                        select(UserGroup.user_id, UserGroup.user_group_nickname).
+                        where(UserGroup.group_id == group_table_id)
+                    )
+                    exist_members = {user_id: nickname for user_id, nickname in session_result.all()}
+
+                    removed_members = [x for x in exist_members.keys() if x not in member_ids]
+                    if removed_members:
+                        await session.execute(
+                            delete(UserGroup).
+                            where(UserGroup.group_id == group_table_id).
+                            where(UserGroup.user_id.in_(removed_members))
+                        )
+
+                    new_members = [{'user_id': user_id, 'group_id': group_table_id,
+                                    'user_group_nickname': nickname, 'created_at': now}
+                                   for user_id, nickname in member_ids.items() if user_id not in exist_members]
+                    if new_members:
+                        await session.execute(insert(UserGroup).values(new_members))
+
+                    changed_members = [{'b_user_id': user_id, 'b_nickname': nickname}
+                                       for user_id, nickname in member_ids.items()
+                                       if user_id in exist_members and exist_members[user_id] != nickname]
+                    if changed_members:
+                        await session.execute(
+                            update(UserGroup).
+                            where(UserGroup.group_id == group_table_id).
+                            where(UserGroup.user_id == bindparam('b_user_id')).
+                            values(user_group_nickname=bindparam('b_nickname'), updated_at=now),
+                            changed_members
+                        )
+
+                    # 为没有状态的成员初始化状态, 同 init_member_status
+                    # 先锁定成员对应的用户行, 同时同步的其他群在此等待, 再用锁定读读取其他事务已写入的状态,
+                    # vocations.user_id 没有唯一约束, 一致性读会导致为同一用户重复初始化状态
+                    await session.execute(
+                        select(User.id).where(User.id.in_(list(member_ids.keys()))).
+                        order_by(User.id).with_for_update()
+                    )
+                    session_result = await session.execute(
+                        select(Vocation.user_id).where(Vocation.user_id.in_(list(member_ids.keys()))).
+                        with_for_update()
+                    )
+                    exist_status = set(session_result.scalars().all())
+                    new_status = [{'user_id': user_id, 'status': 0, 'created_at': now}
+                                  for user_id in member_ids.keys() if user_id not in exist_status]
+                    if new_status:
+                        await session.execute(insert(Vocation).values(new_status))
+
+                    stat.update({
+                        'user_added': len(new_users),
+                        'user_updated': len(changed_users),
+                        'member_added': len(new_members),
+                        'member_updated': len(changed_members),
+                        'member_removed': len(removed_members)
+                    })
+                    result = Result.DictResult(error=False, info='Success', result=stat)
+                await session.commit()
+            except Exception as e:
+                await session.rollback()
+                result = Result.DictResult(error=True, info=repr(e), result=stat)
+        return result
+
     async def member_del(self, user: DBUser) -> Result.IntResult:
         group_id_result = await self.id()
         if group_id_result.error:
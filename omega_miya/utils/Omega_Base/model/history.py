@@ -1,7 +1,9 @@
+from typing import List, Dict, Any
 from omega_miya.utils.Omega_Base.database import NBdb
 from omega_miya.utils.Omega_Base.class_result import Result
 from omega_miya.utils.Omega_Base.tables import History
 from datetime import datetime
+from sqlalchemy import insert, text
 
 
 class DBHistory(object):
@@ -29,3 +31,39 @@ class DBHistory(object):
                 await session.rollback()
                 result = Result.IntResult(error=True, info=repr(e), result=-1)
         return result
+
+    @classmethod
+    async def bulk_add(cls, events: List[Dict[str, Any]]) -> Result.IntResult:
+        """
+        使用一条多行 INSERT 批量写入事件记录
+        :param events: 事件列表, 每项的键与 History 表字段一致
+        :return: 写入的记录数
+        """
+        if not events:
+            return Result.IntResult(error=False, info='Nothing to add', result=0)
+        async_session = NBdb().get_async_session()
+        async with async_session() as session:
+            try:
+                async with session.begin():
+                    await session.execute(insert(History).values(events))
+                    result = Result.IntResult(error=False, info='Success added', result=len(events))
+                await session.commit()
+            except Exception as e:
+                await session.rollback()
+                result = Result.IntResult(error=True, info=repr(e), result=-1)
+        return result
+
+    @classmethod
+    async def ping(cls) -> Result.IntResult:
+        """
+        检查数据库是否可用, 用于区分批量写入失败是数据库不可用还是记录本身有问题
+        """
+        async_session = NBdb().get_async_session()
+        async with async_session() as session:
+            try:
+                async with session.begin():
+                    await session.execute(text('SELECT 1'))
+                result = Result.IntResult(error=False, info='Success', result=0)
+            except Exception as e:
+                result = Result.IntResult(error=True, info=repr(e), result=-1)
+        return result
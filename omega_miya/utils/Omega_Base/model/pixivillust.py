@@ -1,13 +1,16 @@
-from typing import List
+from typing import List, Dict, Any
 from omega_miya.utils.Omega_Base.database import NBdb
 from omega_miya.utils.Omega_Base.class_result import Result
 from omega_miya.utils.Omega_Base.tables import Pixiv, PixivT2I
-from .pixivtag import DBPixivtag
+from .pixivtag import DBPixivtag, BULK_CHUNK_SIZE
+from .pixivillust_index import PixivIllustIndex
 from datetime import datetime
 from sqlalchemy.future import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.dialects.mysql import insert
 from sqlalchemy.orm.exc import NoResultFound, MultipleResultsFound
 from sqlalchemy.sql.expression import func
-from sqlalchemy import or_
+from sqlalchemy import or_, delete
 
 
 class DBPixivillust(object):
@@ -37,69 +40,163 @@ class DBPixivillust(object):
         return result.success()
 
     async def add(self, uid: int, title: str, uname: str, nsfw_tag: int, tags: List[str], url: str) -> Result.IntResult:
-        # 将tag写入pixiv_tag表
-        for tag in tags:
-            _tag = DBPixivtag(tagname=tag)
-            await _tag.add()
+        illust = {'pid': self.pid, 'uid': uid, 'title': title, 'uname': uname,
+                  'nsfw_tag': nsfw_tag, 'tags': tags, 'url': url}
+        result = await self.bulk_add_illusts(illusts=[illust])
+        if result.success():
+            result = Result.IntResult(error=False, info='Success', result=0)
+        return result
+
+    @classmethod
+    async def upsert_illusts(cls, session: AsyncSession, illusts: List[Dict[str, Any]]) -> Dict[int, int]:
+        """
+        在调用方的事务中批量写入作品, 已存在的作品更新标题, 作者, tag, nsfw_tag 只升不降
+        :return: pid 与作品表 id 的对应关系
+        """
+        illust_ids = {}
+        now = datetime.now()
+        for i in range(0, len(illusts), BULK_CHUNK_SIZE):
+            chunk = illusts[i:i + BULK_CHUNK_SIZE]
+            stmt = insert(Pixiv).values([
+                {'pid': illust['pid'], 'uid': illust['uid'], 'title': illust['title'], 'uname': illust['uname'],
+                 'nsfw_tag': illust['nsfw_tag'], 'tags': ','.join(illust['tags']), 'url': illust['url'],
+                 'created_at': now}
+                for illust in chunk
+            ])
+            stmt = stmt.on_duplicate_key_update(
+                title=stmt.inserted.title,
+                uname=stmt.inserted.uname,
+                nsfw_tag=func.greatest(Pixiv.nsfw_tag, stmt.inserted.nsfw_tag),
+                tags=stmt.inserted.tags,
+                updated_at=now
+            )
+            await session.execute(stmt)
+
+            session_result = await session.execute(
+                select(Pixiv.id, Pixiv.pid).where(Pixiv.pid.in_([illust['pid'] for illust in chunk]))
+            )
+            illust_ids.update({pid: illust_id for illust_id, pid in session_result.all()})
+        return illust_ids
+
+    @classmethod
+    async def link_tags(
+            cls, session: AsyncSession, illust_tag_ids: Dict[int, List[int]], replace: bool = False) -> int:
+        """
+        在调用方的事务中批量写入作品与 tag 的关联, 已存在的关联会被跳过
+        :param illust_tag_ids: 作品表 id 与 tag id 列表的对应关系
+        :param replace: 同时删除作品不再包含的 tag 的关联
+        :return: 新增的关联数
+        """
+        illust_ids = list(illust_tag_ids.keys())
+        exist_links = set()
+        for i in range(0, len(illust_ids), BULK_CHUNK_SIZE):
+            session_result = await session.execute(
+                select(PixivT2I.illust_id, PixivT2I.tag_id).
+                where(PixivT2I.illust_id.in_(illust_ids[i:i + BULK_CHUNK_SIZE]))
+            )
+            exist_links.update((illust_id, tag_id) for illust_id, tag_id in session_result.all())
+
+        now = datetime.now()
+        new_links = [
+            {'illust_id': illust_id, 'tag_id': tag_id, 'created_at': now}
+            for illust_id, tag_ids in illust_tag_ids.items()
+            for tag_id in set(tag_ids)
+            if (illust_id, tag_id) not in exist_links
+        ]
+        for i in range(0, len(new_links), BULK_CHUNK_SIZE):
+            await session.execute(insert(PixivT2I).values(new_links[i:i + BULK_CHUNK_SIZE]))
+
+        if replace:
+            stale_links: Dict[int, List[int]] = {}
+            for illust_id, tag_id in exist_links:
+                if tag_id not in illust_tag_ids[illust_id]:
+                    stale_links.setdefault(illust_id, []).append(tag_id)
+            for illust_id, tag_ids in stale_links.items():
+                await session.execute(
+                    delete(PixivT2I).where(PixivT2I.illust_id == illust_id).where(PixivT2I.tag_id.in_(tag_ids))
+                )
+        return len(new_links)
+
+    @classmethod
+    async def bulk_add_illusts(cls, illusts: List[Dict[str, Any]]) -> Result.IntResult:
+        """
+        在一个事务中批量写入作品, tag 及作品与 tag 的关联
+        :param illusts: 作品信息列表, 每项包含 pid, uid, title, uname, nsfw_tag, tags, url
+        :return: 写入的作品数
+        """
+        # 按 pid 去重, 重复时以后出现的为准
+        illusts = list({illust['pid']: illust for illust in illusts}.values())
+        if not illusts:
+            return Result.IntResult(error=False, info='Nothing to add', result=0)
 
-        tag_text = ','.join(tags)
-        # 将作品信息写入pixiv_illust表
         async_session = NBdb().get_async_session()
         async with async_session() as session:
             try:
-                need_upgrade_pixivt2i = False
                 async with session.begin():
-                    try:
+                    tag_ids = await DBPixivtag.upsert_tags(
+                        session=session, tags=[tag for illust in illusts for tag in illust['tags']])
+                    illust_ids = await cls.upsert_illusts(session=session, illusts=illusts)
+                    illust_tag_ids = {
+                        illust_ids[illust['pid']]: [tag_ids[tag] for tag in illust['tags'] if tag in tag_ids]
+                        for illust in illusts if illust['pid'] in illust_ids
+                    }
+                    await cls.link_tags(session=session, illust_tag_ids=illust_tag_ids, replace=True)
+                    result = Result.IntResult(error=False, info='Success', result=len(illust_ids))
+                await session.commit()
+            except Exception as e:
+                await session.rollback()
+                result = Result.IntResult(error=True, info=repr(e), result=-1)
+
+        if result.success():
+            for illust in illusts:
+                PixivIllustIndex.add_illust(pid=illust['pid'], nsfw_tag=illust['nsfw_tag'], uname=illust['uname'],
+                                            title=illust['title'], tags=illust['tags'])
+        return result
+
+    @classmethod
+    async def bulk_link_tags(cls, illust_tags: Dict[int, List[str]]) -> Result.IntResult:
+        """
+        在一个事务中批量写入已有作品与 tag 的关联, tag 不存在时会先写入 tag 表
+        :param illust_tags: pid 与 tag 列表的对应关系
+        :return: 新增的关联数
+        """
+        async_session = NBdb().get_async_session()
+        async with async_session() as session:
+            try:
+                async with session.begin():
+                    tag_ids = await DBPixivtag.upsert_tags(
+                        session=session, tags=[tag for tags in illust_tags.values() for tag in tags])
+                    pids = list(illust_tags.keys())
+                    illust_ids = {}
+                    for i in range(0, len(pids), BULK_CHUNK_SIZE):
                         session_result = await session.execute(
-                            select(Pixiv).where(Pixiv.pid == self.pid)
+                            select(Pixiv.id, Pixiv.pid).where(Pixiv.pid.in_(pids[i:i + BULK_CHUNK_SIZE]))
                         )
-                        exist_illust = session_result.scalar_one()
-                        exist_illust.title = title
-                        exist_illust.uname = uname
-                        if nsfw_tag > exist_illust.nsfw_tag:
-                            exist_illust.nsfw_tag = nsfw_tag
-                        exist_illust.tags = tag_text
-                        exist_illust.updated_at = datetime.now()
-                        result = Result.IntResult(error=False, info='Exist illust updated', result=0)
-                    except NoResultFound:
-                        new_illust = Pixiv(pid=self.pid, uid=uid, title=title, uname=uname, url=url, nsfw_tag=nsfw_tag,
-                                           tags=tag_text, created_at=datetime.now())
-                        session.add(new_illust)
-                        need_upgrade_pixivt2i = True
-                        result = Result.IntResult(error=False, info='Success added', result=0)
+                        illust_ids.update({pid: illust_id for illust_id, pid in session_result.all()})
+                    illust_tag_ids = {
+                        illust_ids[pid]: [tag_ids[tag] for tag in tags if tag in tag_ids]
+                        for pid, tags in illust_tags.items() if pid in illust_ids
+                    }
+                    link_count = await cls.link_tags(session=session, illust_tag_ids=illust_tag_ids)
+                    result = Result.IntResult(error=False, info='Success', result=link_count)
                 await session.commit()
-
-                # 写入tag_pixiv关联表
-                # 获取本作品在illust表中的id
-                id_result = await self.id()
-                if id_result.success() and need_upgrade_pixivt2i:
-                    _illust_id = id_result.result
-                    # 根据作品tag依次写入tag_illust表
-                    async with session.begin():
-                        for tag in tags:
-                            _tag = DBPixivtag(tagname=tag)
-                            _tag_id_res = await _tag.id()
-                            if not _tag_id_res.success():
-                                continue
-                            _tag_id = _tag_id_res.result
-                            try:
-                                new_tag_illust = PixivT2I(illust_id=_illust_id, tag_id=_tag_id,
-                                                          created_at=datetime.now())
-                                session.add(new_tag_illust)
-                            except Exception as e:
-                                continue
-                    await session.commit()
-                    result = Result.IntResult(error=False, info='Success added with tags', result=0)
-            except MultipleResultsFound:
-                await session.rollback()
-                result = Result.IntResult(error=True, info='MultipleResultsFound', result=-1)
             except Exception as e:
                 await session.rollback()
                 result = Result.IntResult(error=True, info=repr(e), result=-1)
+
+        if result.success():
+            for pid, tags in illust_tags.items():
+                if pid in illust_ids:
+                    PixivIllustIndex.add_tags(pid=pid, tags=tags)
         return result
 
     @classmethod
     async def rand_illust(cls, num: int, nsfw_tag: int) -> Result.ListResult:
+        # 优先使用内存索引, 索引载入失败时回退到数据库查询
+        if await PixivIllustIndex.load():
+            res = PixivIllustIndex.sample(num=num, nsfw_tag=nsfw_tag)
+            return Result.ListResult(error=False, info='Success', result=res)
+
         async_session = NBdb().get_async_session()
         async with async_session() as session:
             async with session.begin():
@@ -139,6 +236,15 @@ class DBPixivillust(object):
     @classmethod
     async def list_illust(
             cls, keywords: List[str], num: int, nsfw_tag: int, acc_mode: bool = False) -> Result.ListResult:
+        # 优先使用内存索引, 索引载入失败时回退到数据库查询
+        if await PixivIllustIndex.load():
+            res = []
+            if acc_mode:
+                res = PixivIllustIndex.search(keywords=keywords, num=num, nsfw_tag=nsfw_tag, acc_mode=True)
+            if not res:
+                res = PixivIllustIndex.search(keywords=keywords, num=num, nsfw_tag=nsfw_tag, acc_mode=False)
+            return Result.ListResult(error=False, info='Success', result=res)
+
         async_session = NBdb().get_async_session()
         async with async_session() as session:
             async with session.begin():
@@ -0,0 +1,297 @@
+"""
+Pixiv 作品搜索索引
+首次搜索时从作品表及 tag 关联表载入内存, 之后随作品写入同步更新
+tag / 作者 / 标题到 pid 集合的倒排索引, 按 nsfw_tag 分组的 pid 列表用于 O(k) 随机抽取
+模糊搜索使用单字及二元组到 tag / 作者 / 标题的索引, 只校验候选项, 不扫描全部索引
+直接修改数据库的内容在下次重新载入前不会反映到索引中
+"""
+import random
+import asyncio
+from typing import Dict, List, Set, Tuple, Iterable, Optional, Any
+from nonebot import logger
+from omega_miya.utils.Omega_Base.database import NBdb
+from omega_miya.utils.Omega_Base.tables import Pixiv, PixivTag, PixivT2I
+from sqlalchemy.future import select
+
+
+def _grams(value: str) -> Set[str]:
+    """
+    单字及相邻两字, 长度为 1 的关键词直接查单字, 更长的关键词取各二元组候选的交集后再校验
+    """
+    return set(value) | {value[i:i + 2] for i in range(len(value) - 1)}
+
+
+class PixivIllustIndex(object):
+    __loaded: bool = False
+    __load_lock: Optional[asyncio.Lock] = None
+    # 载入期间写入的作品可能不在读取到的数据中, 先记录下来, 载入完成后再应用
+    __loading: bool = False
+    __pending_updates: List[Tuple[str, Dict[str, Any]]] = []
+
+    # key: nsfw_tag, value: pid 列表, 配合 __pid_pos 实现 O(1) 删除
+    __pids_by_nsfw: Dict[int, List[int]] = {}
+    __pid_pos: Dict[int, int] = {}
+    __nsfw_by_pid: Dict[int, int] = {}
+
+    # 倒排索引, key 均为小写
+    __tag_index: Dict[str, Set[int]] = {}
+    __uname_index: Dict[str, Set[int]] = {}
+    __title_index: Dict[str, Set[int]] = {}
+    # 模糊搜索索引, key: 单字或二元组, value: 包含该字符串的 tag / 作者 / 标题
+    __tag_grams: Dict[str, Set[str]] = {}
+    __uname_grams: Dict[str, Set[str]] = {}
+    __title_grams: Dict[str, Set[str]] = {}
+    # pid 当前对应的 tag, 作者和标题, 更新时用于移除旧索引
+    __tags_by_pid: Dict[int, Set[str]] = {}
+    __uname_by_pid: Dict[int, str] = {}
+    __title_by_pid: Dict[int, str] = {}
+
+    @classmethod
+    def loaded(cls) -> bool:
+        return cls.__loaded
+
+    @classmethod
+    def __clear(cls) -> None:
+        cls.__pids_by_nsfw = {}
+        cls.__pid_pos = {}
+        cls.__nsfw_by_pid = {}
+        cls.__tag_index = {}
+        cls.__uname_index = {}
+        cls.__title_index = {}
+        cls.__tag_grams = {}
+        cls.__uname_grams = {}
+        cls.__title_grams = {}
+        cls.__tags_by_pid = {}
+        cls.__uname_by_pid = {}
+        cls.__title_by_pid = {}
+
+    @classmethod
+    async def load(cls) -> bool:
+        """
+        从数据库载入索引, 已载入时直接返回
+        """
+        if cls.__loaded:
+            return True
+        if cls.__load_lock is None:
+            cls.__load_lock = asyncio.Lock()
+
+        async with cls.__load_lock:
+            if cls.__loaded:
+                return True
+            cls.__loading = True
+            cls.__pending_updates = []
+            try:
+                return await cls.__load()
+            finally:
+                cls.__loading = False
+                cls.__pending_updates = []
+
+    @classmethod
+    async def __load(cls) -> bool:
+        async_session = NBdb().get_async_session()
+        async with async_session() as session:
+            async with session.begin():
+                try:
+                    illust_result = await session.execute(
+                        select(Pixiv.id, Pixiv.pid, Pixiv.nsfw_tag, Pixiv.uname, Pixiv.title)
+                    )
+                    illusts = illust_result.all()
+                    tag_result = await session.execute(
+                        select(PixivT2I.illust_id, PixivTag.tagname).
+                        join(PixivTag, PixivT2I.tag_id == PixivTag.id)
+                    )
+                    illust_tags = tag_result.all()
+                except Exception as e:
+                    logger.opt(colors=True).error(
+                        f'<Y><lw>PixivIllustIndex</lw></Y> load index failed, {repr(e)}')
+                    return False
+
+        cls.__clear()
+        pid_by_id = {}
+        for illust_id, pid, nsfw_tag, uname, title in illusts:
+            pid_by_id[illust_id] = pid
+            cls.__set_illust(pid=pid, nsfw_tag=nsfw_tag, uname=uname, title=title)
+        for illust_id, tagname in illust_tags:
+            pid = pid_by_id.get(illust_id)
+            if pid is not None:
+                cls.__set_tags(pid=pid, tags=[tagname], replace=False)
+        for update_type, kwargs in cls.__pending_updates:
+            if update_type == 'illust':
+                cls.__set_illust(
+                    pid=kwargs['pid'], nsfw_tag=kwargs['nsfw_tag'], uname=kwargs['uname'], title=kwargs['title'])
+                cls.__set_tags(pid=kwargs['pid'], tags=kwargs['tags'], replace=True)
+            else:
+                cls.__set_tags(pid=kwargs['pid'], tags=kwargs['tags'], replace=False)
+        cls.__loaded = True
+        logger.opt(colors=True).info(
+            f'<Y><lw>PixivIllustIndex</lw></Y> loaded {len(illusts)} illusts, {len(cls.__tag_index)} tags')
+        return True
+
+    @classmethod
+    def invalidate(cls) -> None:
+        """
+        清空索引, 下次搜索时重新载入
+        """
+        cls.__loaded = False
+        cls.__clear()
+
+    @classmethod
+    def __index_add(cls, index: Dict[str, Set[int]], grams: Dict[str, Set[str]], key: str, pid: int) -> None:
+        pids = index.get(key)
+        if pids is None:
+            pids = index[key] = set()
+            for gram in _grams(key):
+                grams.setdefault(gram, set()).add(key)
+        pids.add(pid)
+
+    @classmethod
+    def __index_discard(cls, index: Dict[str, Set[int]], grams: Dict[str, Set[str]], key: str, pid: int) -> None:
+        pids = index.get(key)
+        if pids is None:
+            return
+        pids.discard(pid)
+        if pids:
+            return
+        del index[key]
+        for gram in _grams(key):
+            keys = grams.get(gram)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del grams[gram]
+
+    @classmethod
+    def __set_illust(cls, pid: int, nsfw_tag: int, uname: str, title: str) -> None:
+        # nsfw_tag 分组, 与数据库一致只升不降
+        old_nsfw_tag = cls.__nsfw_by_pid.get(pid)
+        if old_nsfw_tag is None or nsfw_tag > old_nsfw_tag:
+            if old_nsfw_tag is not None:
+                pids = cls.__pids_by_nsfw[old_nsfw_tag]
+                pos = cls.__pid_pos[pid]
+                last_pid = pids.pop()
+                if last_pid != pid:
+                    pids[pos] = last_pid
+                    cls.__pid_pos[last_pid] = pos
+            pids = cls.__pids_by_nsfw.setdefault(nsfw_tag, [])
+            cls.__pid_pos[pid] = len(pids)
+            pids.append(pid)
+            cls.__nsfw_by_pid[pid] = nsfw_tag
+
+        for index, grams, by_pid, value in [(cls.__uname_index, cls.__uname_grams, cls.__uname_by_pid, uname),
+                                            (cls.__title_index, cls.__title_grams, cls.__title_by_pid, title)]:
+            value = (value or '').lower()
+            old_value = by_pid.get(pid)
+            if old_value == value:
+                continue
+            if old_value is not None:
+                cls.__index_discard(index=index, grams=grams, key=old_value, pid=pid)
+            cls.__index_add(index=index, grams=grams, key=value, pid=pid)
+            by_pid[pid] = value
+
+    @classmethod
+    def __set_tags(cls, pid: int, tags: Iterable[str], replace: bool) -> None:
+        """
+        :param replace: 以 tags 替换作品现有的 tag, 否则只添加
+        """
+        tags = {tag.lower() for tag in tags}
+        pid_tags = cls.__tags_by_pid.setdefault(pid, set())
+        if replace:
+            for tag in pid_tags - tags:
+                cls.__index_discard(index=cls.__tag_index, grams=cls.__tag_grams, key=tag, pid=pid)
+            pid_tags.intersection_update(tags)
+        for tag in tags - pid_tags:
+            cls.__index_add(index=cls.__tag_index, grams=cls.__tag_grams, key=tag, pid=pid)
+        pid_tags.update(tags)
+
+    @classmethod
+    def add_illust(cls, pid: int, nsfw_tag: int, uname: str, title: str, tags: Iterable[str]) -> None:
+        """
+        作品写入数据库后同步更新索引, 正在载入时记录下来待载入完成后应用, 未载入时忽略
+        tags 为作品的全部 tag, 不再包含的 tag 会从索引中移除
+        """
+        if cls.__loading:
+            cls.__pending_updates.append(
+                ('illust', {'pid': pid, 'nsfw_tag': nsfw_tag, 'uname': uname, 'title': title, 'tags': list(tags)}))
+            return
+        if not cls.__loaded:
+            return
+        cls.__set_illust(pid=pid, nsfw_tag=nsfw_tag, uname=uname, title=title)
+        cls.__set_tags(pid=pid, tags=tags, replace=True)
+
+    @classmethod
+    def add_tags(cls, pid: int, tags: Iterable[str]) -> None:
+        """
+        为作品添加 tag, 不影响已有的 tag
+        """
+        if cls.__loading:
+            cls.__pending_updates.append(('tags', {'pid': pid, 'tags': list(tags)}))
+            return
+        if not cls.__loaded:
+            return
+        cls.__set_tags(pid=pid, tags=tags, replace=False)
+
+    @classmethod
+    def __match(cls, keyword: str, acc_mode: bool) -> Set[int]:
+        """
+        精确模式匹配完整的 tag / 作者 / 标题, 模糊模式匹配包含关键词的 tag / 作者 / 标题
+        """
+        keyword = keyword.lower()
+        result = set()
+        for index, grams in [(cls.__tag_index, cls.__tag_grams),
+                             (cls.__uname_index, cls.__uname_grams),
+                             (cls.__title_index, cls.__title_grams)]:
+            if acc_mode:
+                result.update(index.get(keyword, set()))
+            else:
+                for key in cls.__fuzzy_keys(grams=grams, keyword=keyword):
+                    result.update(index[key])
+        return result
+
+    @classmethod
+    def __fuzzy_keys(cls, grams: Dict[str, Set[str]], keyword: str) -> Set[str]:
+        """
+        通过单字及二元组索引查找包含关键词的 tag / 作者 / 标题, 耗时与候选数量成正比
+        """
+        if len(keyword) <= 1:
+            return set(grams.get(keyword, set()))
+        candidates = []
+        for gram in {keyword[i:i + 2] for i in range(len(keyword) - 1)}:
+            keys = grams.get(gram)
+            if not keys:
+                return set()
+            candidates.append(keys)
+        candidates.sort(key=len)
+        keys = candidates[0]
+        for other_keys in candidates[1:]:
+            keys = keys & other_keys
+            if not keys:
+                return set()
+        return {key for key in keys if keyword in key}
+
+    @classmethod
+    def search(cls, keywords: List[str], num: int, nsfw_tag: int, acc_mode: bool = False) -> List[int]:
+        """
+        搜索同时匹配全部关键词的作品并随机抽取
+        """
+        matched = [cls.__match(keyword=keyword, acc_mode=acc_mode) for keyword in keywords]
+        if not matched:
+            return cls.sample(num=num, nsfw_tag=nsfw_tag)
+        # 从最小的集合开始求交集
+        matched.sort(key=len)
+        result = matched[0]
+        for pids in matched[1:]:
+            if not result:
+                break
+            result = result & pids
+        result = [pid for pid in result if cls.__nsfw_by_pid.get(pid) == nsfw_tag]
+        return random.sample(result, k=min(num, len(result)))
+
+    @classmethod
+    def sample(cls, num: int, nsfw_tag: int) -> List[int]:
+        pids = cls.__pids_by_nsfw.get(nsfw_tag, [])
+        return random.sample(pids, k=min(num, len(pids)))
+
+
+__all__ = [
+    'PixivIllustIndex'
+]
@@ -1,11 +1,18 @@
+from typing import List, Dict
 from omega_miya.utils.Omega_Base.database import NBdb
 from omega_miya.utils.Omega_Base.class_result import Result
 from omega_miya.utils.Omega_Base.tables import PixivTag, Pixiv, PixivT2I
 from datetime import datetime
 from sqlalchemy.future import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.dialects.mysql import insert
 from sqlalchemy.orm.exc import NoResultFound, MultipleResultsFound
 
 
+# 批量写入时单条语句包含的最大行数
+BULK_CHUNK_SIZE = 500
+
+
 class DBPixivtag(object):
     def __init__(self, tagname: str):
         self.tagname = tagname
@@ -56,6 +63,47 @@ class DBPixivtag(object):
                 result = Result.IntResult(error=True, info=repr(e), result=-1)
         return result
 
+    @classmethod
+    async def upsert_tags(cls, session: AsyncSession, tags: List[str]) -> Dict[str, int]:
+        """
+        在调用方的事务中批量写入 tag, 已存在的 tag 不做修改
+        :return: tagname 与 tag id 的对应关系
+        """
+        tags = list(set(tags))
+        tag_ids = {}
+        now = datetime.now()
+        for i in range(0, len(tags), BULK_CHUNK_SIZE):
+            chunk = tags[i:i + BULK_CHUNK_SIZE]
+            stmt = insert(PixivTag).values([{'tagname': tag, 'created_at': now} for tag in chunk])
+            stmt = stmt.on_duplicate_key_update(tagname=stmt.inserted.tagname)
+            await session.execute(stmt)
+
+            session_result = await session.execute(
+                select(PixivTag.id, PixivTag.tagname).where(PixivTag.tagname.in_(chunk))
+            )
+            # 数据库默认排序规则不区分大小写, 按小写匹配回传入的 tag
+            exist_tags = {tagname.lower(): tag_id for tag_id, tagname in session_result.all()}
+            tag_ids.update({tag: exist_tags[tag.lower()] for tag in chunk if tag.lower() in exist_tags})
+        return tag_ids
+
+    @classmethod
+    async def bulk_add_tags(cls, tags: List[str]) -> Result.DictResult:
+        """
+        在一个事务中批量写入 tag
+        :return: tagname 与 tag id 的对应关系
+        """
+        async_session = NBdb().get_async_session()
+        async with async_session() as session:
+            try:
+                async with session.begin():
+                    tag_ids = await cls.upsert_tags(session=session, tags=tags)
+                    result = Result.DictResult(error=False, info='Success', result=tag_ids)
+                await session.commit()
+            except Exception as e:
+                await session.rollback()
+                result = Result.DictResult(error=True, info=repr(e), result={})
+        return result
+
     async def list_illust(self, nsfw_tag: int) -> Result.ListResult:
         async_session = NBdb().get_async_session()
         async with async_session() as session:
@@ -14,8 +14,7 @@ from nonebot.adapters.cqhttp.bot import Bot
 from nonebot.adapters.cqhttp.event import MessageEvent
 from omega_miya.utils.Omega_plugin_utils import \
     check_and_set_global_cool_down, check_and_set_plugin_cool_down, \
-    check_and_set_group_cool_down, check_and_set_user_cool_down, PluginCoolDown
-from omega_miya.utils.Omega_Base import DBCoolDownEvent, DBAuth
+    check_and_set_group_cool_down, check_and_set_user_cool_down, check_auth_node, PluginCoolDown, CoolDownStore
 
 
 @run_preprocessor
@@ -47,21 +46,20 @@ async def handle_plugin_cooldown(matcher: Matcher, bot: Bot, event: MessageEvent
 
     # 检查用户或群组是否有skip_cd权限, 跳过冷却检查
     skip_cd_auth_node = f'{plugin_name}.{PluginCoolDown.skip_auth_node}'
-    user_auth = DBAuth(auth_id=user_id, auth_type='user', auth_node=skip_cd_auth_node)
-    user_tag_res = await user_auth.tags_info()
-    if user_tag_res.result[0] == 1 and user_tag_res.result[1] == 0:
+    user_auth_checker = await check_auth_node(auth_id=user_id, auth_type='user', auth_node=skip_cd_auth_node)
+    if user_auth_checker == 1:
         return
 
-    group_auth = DBAuth(auth_id=group_id, auth_type='group', auth_node=skip_cd_auth_node)
-    group_tag_res = await group_auth.tags_info()
-    if group_tag_res.result[0] == 1 and group_tag_res.result[1] == 0:
-        return
+    if group_id:
+        group_auth_checker = await check_auth_node(auth_id=group_id, auth_type='group', auth_node=skip_cd_auth_node)
+        if group_auth_checker == 1:
+            return
 
     # 检查冷却情况
-    global_check = await DBCoolDownEvent.check_global_cool_down_event()
-    plugin_check = await DBCoolDownEvent.check_plugin_cool_down_event(plugin=plugin_name)
-    group_check = await DBCoolDownEvent.check_group_cool_down_event(plugin=plugin_name, group_id=group_id)
-    user_check = await DBCoolDownEvent.check_user_cool_down_event(plugin=plugin_name, user_id=user_id)
+    global_check = CoolDownStore.check(event_type=PluginCoolDown.global_type)
+    plugin_check = CoolDownStore.check(event_type=PluginCoolDown.plugin_type, plugin=plugin_name)
+    group_check = CoolDownStore.check(event_type=PluginCoolDown.group_type, plugin=plugin_name, group_id=group_id)
+    user_check = CoolDownStore.check(event_type=PluginCoolDown.user_type, plugin=plugin_name, user_id=user_id)
 
     # 处理全局冷却
     # 先检查是否已有全局冷却
@@ -3,7 +3,7 @@ from nonebot.plugin import on
 from nonebot.typing import T_State
 from nonebot.adapters.cqhttp.bot import Bot
 from nonebot.adapters.cqhttp.event import Event
-from omega_miya.utils.Omega_Base import DBHistory
+from .buffer import HistoryBuffer
 
 
 # 注册事件响应器, 处理MessageEvent
@@ -28,11 +28,11 @@ async def handle_message(bot: Bot, event: Event, state: T_State):
         user_id = event.dict().get('user_id')
         raw_data = repr(event)
         msg_data = str(event.dict().get('message'))
-        new_event = DBHistory(time=time, self_id=self_id, post_type=post_type, detail_type=detail_type)
-        res = await new_event.add(sub_type=sub_type, event_id=message_id, group_id=group_id, user_id=user_id,
-                                  user_name=user_name, raw_data=raw_data, msg_data=msg_data)
-        if res.error:
-            logger.error(f'Message history recording Failed with database error: {res.info}')
+        res = await HistoryBuffer.put(time_=time, self_id=self_id, post_type=post_type, detail_type=detail_type,
+                                      sub_type=sub_type, event_id=message_id, group_id=group_id, user_id=user_id,
+                                      user_name=user_name, raw_data=raw_data, msg_data=msg_data)
+        if not res:
+            logger.debug('Message history recording dropped, history buffer is full')
     except Exception as e:
         logger.error(f'Message history recording Failed, error: {repr(e)}')
 
@@ -56,11 +56,11 @@ async def handle_message_sent_history(bot: Bot, event: Event, state: T_State):
         user_id = event.dict().get('user_id')
         raw_data = repr(event)
         msg_data = str(event.dict().get('message'))
-        new_event = DBHistory(time=time, self_id=self_id, post_type=post_type, detail_type=detail_type)
-        res = await new_event.add(sub_type=sub_type, group_id=group_id, user_id=user_id, user_name=user_name,
-                                  raw_data=raw_data, msg_data=msg_data)
-        if res.error:
-            logger.error(f'Self-sent Message history recording Failed with database error: {res.info}')
+        res = await HistoryBuffer.put(time_=time, self_id=self_id, post_type=post_type, detail_type=detail_type,
+                                      sub_type=sub_type, group_id=group_id, user_id=user_id, user_name=user_name,
+                                      raw_data=raw_data, msg_data=msg_data)
+        if not res:
+            logger.debug('Self-sent Message history recording dropped, history buffer is full')
     except Exception as e:
         logger.error(f'Self-sent Message history recording Failed, error: {repr(e)}')
 
@@ -81,11 +81,11 @@ async def handle_notice(bot: Bot, event: Event, state: T_State):
         user_id = event.dict().get('user_id')
         raw_data = repr(event)
         msg_data = str(event.dict().get('message'))
-        new_event = DBHistory(time=time, self_id=self_id, post_type=post_type, detail_type=detail_type)
-        res = await new_event.add(sub_type=sub_type, group_id=group_id, user_id=user_id, user_name=None,
-                                  raw_data=raw_data, msg_data=msg_data)
-        if res.error:
-            logger.error(f'Notice history recording Failed with database error: {res.info}')
+        res = await HistoryBuffer.put(time_=time, self_id=self_id, post_type=post_type, detail_type=detail_type,
+                                      sub_type=sub_type, group_id=group_id, user_id=user_id, user_name=None,
+                                      raw_data=raw_data, msg_data=msg_data)
+        if not res:
+            logger.debug('Notice history recording dropped, history buffer is full')
     except Exception as e:
         logger.error(f'Notice history recording Failed, error: {repr(e)}')
 
@@ -106,10 +106,10 @@ async def handle_request(bot: Bot, event: Event, state: T_State):
         user_id = event.dict().get('user_id')
         raw_data = repr(event)
         msg_data = str(event.dict().get('message'))
-        new_event = DBHistory(time=time, self_id=self_id, post_type=post_type, detail_type=detail_type)
-        res = await new_event.add(sub_type=sub_type, group_id=group_id, user_id=user_id, user_name=None,
-                                  raw_data=raw_data, msg_data=msg_data)
-        if res.error:
-            logger.error(f'Request history recording Failed with database error: {res.info}')
+        res = await HistoryBuffer.put(time_=time, self_id=self_id, post_type=post_type, detail_type=detail_type,
+                                      sub_type=sub_type, group_id=group_id, user_id=user_id, user_name=None,
+                                      raw_data=raw_data, msg_data=msg_data)
+        if not res:
+            logger.debug('Request history recording dropped, history buffer is full')
     except Exception as e:
         logger.error(f'Request history recording Failed, error: {repr(e)}')
@@ -0,0 +1,264 @@
+"""
+历史记录写入缓冲区
+事件记录先进入内存队列, 由后台任务按数量或时间批量写入数据库, 关闭时写入全部剩余记录
+批量写入失败时若数据库可用则逐条写入, 仍无法写入的记录移入死信队列, 避免个别记录阻塞整个缓冲区
+"""
+import time
+import asyncio
+import nonebot
+from collections import deque
+from datetime import datetime
+from typing import Deque, Dict, List, Optional, Any
+from nonebot import logger
+from omega_miya.utils.Omega_Base import DBHistory
+from .config import Config
+
+
+global_config = nonebot.get_driver().config
+plugin_config = Config(**global_config.dict())
+HISTORY_BUFFER_MAX_SIZE = plugin_config.history_buffer_max_size
+HISTORY_BUFFER_BATCH_SIZE = plugin_config.history_buffer_batch_size
+HISTORY_BUFFER_FLUSH_INTERVAL = plugin_config.history_buffer_flush_interval
+HISTORY_BUFFER_DROP_POLICY = plugin_config.history_buffer_drop_policy
+HISTORY_BUFFER_BLOCK_TIMEOUT = plugin_config.history_buffer_block_timeout
+HISTORY_BUFFER_DEAD_LETTER_SIZE = plugin_config.history_buffer_dead_letter_size
+
+# 与 History 表字段长度一致, 超长内容写入前截断
+USER_NAME_MAX_LENGTH = 64
+RAW_DATA_MAX_LENGTH = 4096
+MSG_DATA_MAX_LENGTH = 4096
+
+
+def _truncate(value: Optional[str], length: int) -> Optional[str]:
+    if isinstance(value, str) and len(value) > length:
+        return value[:length]
+    return value
+
+
+class HistoryBuffer(object):
+    __buffer: Deque[Dict[str, Any]] = deque()
+    # 数据库可用但仍无法写入的记录, 仅保留最近的部分用于排查
+    __dead_letter: Deque[Dict[str, Any]] = deque(maxlen=max(HISTORY_BUFFER_DEAD_LETTER_SIZE, 0))
+    # asyncio 对象需在事件循环启动后创建
+    __flush_event: Optional[asyncio.Event] = None
+    __not_full_event: Optional[asyncio.Event] = None
+    __flush_lock: Optional[asyncio.Lock] = None
+    __flush_task: Optional[asyncio.Task] = None
+    __stopping: bool = False
+    __drop_warned: bool = False
+    __stats: Dict[str, Any] = {
+        'enqueued': 0,
+        'flushed': 0,
+        'dropped': 0,
+        'flush_failures': 0,
+        'dead_lettered': 0,
+        'high_watermark': 0,
+        'last_flush_size': 0,
+        'last_flush_latency': 0.0
+    }
+
+    @classmethod
+    def __drop(cls, count: int = 1) -> None:
+        cls.__stats['dropped'] += count
+        if not cls.__drop_warned:
+            cls.__drop_warned = True
+            logger.opt(colors=True).warning(
+                f'<Y><lw>HistoryBuffer</lw></Y> buffer is full, dropping history records, '
+                f'policy: <ly>{HISTORY_BUFFER_DROP_POLICY}</ly>')
+
+    @classmethod
+    def __trim(cls) -> None:
+        # 写入失败的记录放回队首后可能超出容量, 按丢弃策略截断
+        while len(cls.__buffer) > HISTORY_BUFFER_MAX_SIZE:
+            if HISTORY_BUFFER_DROP_POLICY == 'drop_oldest':
+                cls.__buffer.popleft()
+            else:
+                cls.__buffer.pop()
+            cls.__drop()
+
+    @classmethod
+    async def __wait_not_full(cls) -> None:
+        while len(cls.__buffer) >= HISTORY_BUFFER_MAX_SIZE:
+            cls.__not_full_event.clear()
+            cls.__flush_event.set()
+            await cls.__not_full_event.wait()
+
+    @classmethod
+    async def put(
+            cls, time_: int, self_id: int, post_type: str, detail_type: str, sub_type: str = None,
+            event_id: int = None, group_id: int = None, user_id: int = None, user_name: str = None,
+            raw_data: str = None, msg_data: str = None) -> bool:
+        """
+        写入一条事件记录到缓冲区
+        :return: 是否成功写入, 缓冲区已满且记录被丢弃时返回 False
+        """
+        if len(cls.__buffer) >= HISTORY_BUFFER_MAX_SIZE:
+            if HISTORY_BUFFER_DROP_POLICY == 'drop_oldest':
+                cls.__buffer.popleft()
+                cls.__drop()
+            elif HISTORY_BUFFER_DROP_POLICY == 'block' and cls.__not_full_event is not None:
+                try:
+                    await asyncio.wait_for(cls.__wait_not_full(), timeout=HISTORY_BUFFER_BLOCK_TIMEOUT)
+                except asyncio.TimeoutError:
+                    cls.__drop()
+                    return False
+            else:
+                cls.__drop()
+                return False
+
+        cls.__buffer.append({
+            'time': time_, 'self_id': self_id, 'post_type': post_type, 'detail_type': detail_type,
+            'sub_type': sub_type, 'event_id': event_id, 'group_id': group_id, 'user_id': user_id,
+            'user_name': _truncate(user_name, USER_NAME_MAX_LENGTH),
+            'raw_data': _truncate(raw_data, RAW_DATA_MAX_LENGTH),
+            'msg_data': _truncate(msg_data, MSG_DATA_MAX_LENGTH),
+            'created_at': datetime.now()
+        })
+        cls.__stats['enqueued'] += 1
+        cls.__stats['high_watermark'] = max(cls.__stats['high_watermark'], len(cls.__buffer))
+
+        if len(cls.__buffer) >= HISTORY_BUFFER_BATCH_SIZE and cls.__flush_event is not None:
+            cls.__flush_event.set()
+        return True
+
+    @classmethod
+    def __requeue(cls, records: list) -> None:
+        cls.__buffer.extendleft(reversed(records))
+        cls.__trim()
+
+    @classmethod
+    async def __flush_one_by_one(cls, batch: list) -> int:
+        """
+        批量写入失败且数据库可用时逐条写入, 写入失败的记录移入死信队列
+        逐条写入期间数据库不可用时剩余记录放回缓冲区
+        :return: 写入成功的记录数
+        """
+        flushed_count = 0
+        for index, record in enumerate(batch):
+            result = await DBHistory.bulk_add(events=[record])
+            if result.success():
+                flushed_count += result.result
+                continue
+
+            ping_result = await DBHistory.ping()
+            if ping_result.error:
+                cls.__requeue(batch[index:])
+                logger.opt(colors=True).error(
+                    f'<Y><lw>HistoryBuffer</lw></Y> database unavailable, {len(cls.__buffer)} records '
+                    f'remaining in buffer, error: {ping_result.info}')
+                break
+
+            cls.__dead_letter.append(record)
+            cls.__stats['dead_lettered'] += 1
+            logger.opt(colors=True).error(
+                f'<Y><lw>HistoryBuffer</lw></Y> record (self_id: {record.get("self_id")}, '
+                f'event_id: {record.get("event_id")}, post_type: {record.get("post_type")}) '
+                f'cannot be written, moved to dead letter, error: {result.info}')
+        return flushed_count
+
+    @classmethod
+    async def flush(cls) -> int:
+        """
+        将缓冲区中的记录全部写入数据库
+        数据库不可用时记录放回缓冲区等待下次写入, 数据库可用时逐条写入并跳过无法写入的记录
+        :return: 本次写入的记录数
+        """
+        flushed_count = 0
+        async with cls.__flush_lock:
+            while cls.__buffer:
+                batch = [cls.__buffer.popleft() for _ in range(min(HISTORY_BUFFER_BATCH_SIZE, len(cls.__buffer)))]
+                start = time.monotonic()
+                result = await DBHistory.bulk_add(events=batch)
+
+                if result.error:
+                    cls.__stats['flush_failures'] += 1
+                    ping_result = await DBHistory.ping()
+                    if ping_result.error:
+                        cls.__requeue(batch)
+                        logger.opt(colors=True).error(
+                            f'<Y><lw>HistoryBuffer</lw></Y> flush {len(batch)} records failed, '
+                            f'{len(cls.__buffer)} records remaining in buffer, error: {result.info}')
+                        break
+
+                    logger.opt(colors=True).warning(
+                        f'<Y><lw>HistoryBuffer</lw></Y> flush {len(batch)} records failed, '
+                        f'retrying one by one, error: {result.info}')
+                    buffered_count = len(cls.__buffer)
+                    batch_flushed_count = await cls.__flush_one_by_one(batch=batch)
+                    cls.__stats['last_flush_latency'] = time.monotonic() - start
+                    flushed_count += batch_flushed_count
+                    cls.__stats['flushed'] += batch_flushed_count
+                    cls.__stats['last_flush_size'] = batch_flushed_count
+                    if len(cls.__buffer) > buffered_count:
+                        # 有记录被放回, 数据库已不可用
+                        break
+                    cls.__not_full_event.set()
+                    continue
+
+                cls.__stats['last_flush_latency'] = time.monotonic() - start
+                flushed_count += result.result
+                cls.__stats['flushed'] += result.result
+                cls.__stats['last_flush_size'] = result.result
+                cls.__drop_warned = False
+                cls.__not_full_event.set()
+        return flushed_count
+
+    @classmethod
+    async def __flush_loop(cls) -> None:
+        while not cls.__stopping:
+            try:
+                await asyncio.wait_for(cls.__flush_event.wait(), timeout=HISTORY_BUFFER_FLUSH_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            cls.__flush_event.clear()
+            if cls.__stopping:
+                break
+            try:
+                await cls.flush()
+            except Exception as e:
+                logger.opt(colors=True).error(f'<Y><lw>HistoryBuffer</lw></Y> flush loop error: {repr(e)}')
+
+    @classmethod
+    async def start(cls) -> None:
+        cls.__stopping = False
+        cls.__flush_event = asyncio.Event()
+        cls.__not_full_event = asyncio.Event()
+        cls.__flush_lock = asyncio.Lock()
+        cls.__flush_task = asyncio.create_task(cls.__flush_loop())
+
+    @classmethod
+    async def stop(cls) -> None:
+        if cls.__flush_task is not None:
+            # 不取消后台任务, 避免正在写入的批次丢失, 通知其在本次写入完成后退出
+            cls.__stopping = True
+            cls.__flush_event.set()
+            await cls.__flush_task
+            cls.__flush_task = None
+
+        buffered_count = len(cls.__buffer)
+        flushed_count = await cls.flush()
+        if flushed_count < buffered_count:
+            logger.opt(colors=True).error(
+                f'<Y><lw>HistoryBuffer</lw></Y> {buffered_count - flushed_count} records lost on shutdown')
+        else:
+            logger.opt(colors=True).info(
+                f'<Y><lw>HistoryBuffer</lw></Y> drained {flushed_count} records on shutdown')
+
+    @classmethod
+    def dead_letter(cls) -> List[Dict[str, Any]]:
+        return list(cls.__dead_letter)
+
+    @classmethod
+    def stats(cls) -> Dict[str, Any]:
+        stats = dict(cls.__stats)
+        stats.update({'buffered': len(cls.__buffer), 'dead_letter': len(cls.__dead_letter)})
+        return stats
+
+
+nonebot.get_driver().on_startup(HistoryBuffer.start)
+nonebot.get_driver().on_shutdown(HistoryBuffer.stop)
+
+
+__all__ = [
+    'HistoryBuffer'
+]
@@ -0,0 +1,26 @@
+from pydantic import BaseSettings
+
+
+class Config(BaseSettings):
+
+    # 历史记录写入缓冲区配置
+    """
+    消息/通知/请求记录先写入内存缓冲区, 由后台任务批量写入数据库
+    history_buffer_max_size: 缓冲区最大记录数, 数据库写入过慢时超出部分按 drop_policy 处理
+    history_buffer_batch_size: 单次批量写入的记录数, 缓冲区达到该数量时立即写入
+    history_buffer_flush_interval: 定时写入间隔(秒)
+    history_buffer_drop_policy: 缓冲区已满时的处理方式
+        drop_new: 丢弃新记录
+        drop_oldest: 丢弃缓冲区中最早的记录
+        block: 等待缓冲区有空位, 超过 history_buffer_block_timeout(秒) 后丢弃新记录
+    history_buffer_dead_letter_size: 数据库可用但仍无法写入的记录保留在内存中的最大数量
+    """
+    history_buffer_max_size: int = 5000
+    history_buffer_batch_size: int = 200
+    history_buffer_flush_interval: float = 2
+    history_buffer_drop_policy: str = 'drop_new'
+    history_buffer_block_timeout: float = 5
+    history_buffer_dead_letter_size: int = 100
+
+    class Config:
+        extra = "ignore"
@@ -6,8 +6,12 @@ from .encrypt import AESEncryptStr
 from .cooldown import *
 from .permission import *
 from .http_fetcher import HttpFetcher
+from .http_retry import RetryPolicy
+from .media_cache import MediaCache
+from .notice_dispatcher import NoticeDispatcher
+from .poll_scheduler import PollScheduler
 from .picture_encoder import PicEncoder
-from .zip_utils import create_zip_file, create_7z_file
+from .zip_utils import StreamingArchive, create_zip_file, create_7z_file
 
 
 def init_export(
@@ -52,17 +56,24 @@ __all__ = [
     'has_friend_private_permission',
     'AESEncryptStr',
     'PluginCoolDown',
+    'CoolDownStore',
     'check_and_set_global_cool_down',
     'check_and_set_plugin_cool_down',
     'check_and_set_group_cool_down',
     'check_and_set_user_cool_down',
+    'PermissionCache',
     'check_notice_permission',
     'check_command_permission',
     'check_permission_level',
     'check_auth_node',
     'check_friend_private_permission',
     'HttpFetcher',
+    'RetryPolicy',
+    'MediaCache',
+    'NoticeDispatcher',
+    'PollScheduler',
     'PicEncoder',
+    'StreamingArchive',
     'create_zip_file',
     'create_7z_file'
 ]
@@ -0,0 +1,142 @@
+from typing import Dict, List
+from pydantic import BaseSettings
+
+
+class Config(BaseSettings):
+
+    # HttpFetcher 全局共享连接池配置
+    """
+    所有 HttpFetcher 实例共用同一个 aiohttp.ClientSession
+    http_pool_limit: 连接池最大连接数, 0 为不限制
+    http_pool_limit_per_host: 单个 host 最大连接数, 0 为不限制
+    http_pool_keepalive_timeout: 空闲连接保持时间(秒)
+    http_pool_dns_cache_ttl: DNS 缓存时间(秒)
+    """
+    http_pool_limit: int = 100
+    http_pool_limit_per_host: int = 10
+    http_pool_keepalive_timeout: float = 30
+    http_pool_dns_cache_ttl: int = 300
+
+    # HTTP 代理可用性状态缓存时间(秒)
+    """
+    代理状态由 check_proxy 后台任务直接写入缓存, 缓存超时后才回退到查询数据库
+    check_proxy 每分钟执行一次, 建议不小于 60
+    """
+    http_proxy_status_cache_ttl: int = 120
+
+    # HttpFetcher 响应缓存配置
+    """
+    http_cache_memory_size: 内存中最多保留的条目数, 超出后按 LRU 淘汰
+    http_cache_max_bytes: 磁盘缓存(tmp/http_cache)总大小上限(bytes), 超出后按最近使用时间淘汰
+    """
+    http_cache_memory_size: int = 256
+    http_cache_max_bytes: int = 64 * 1024 * 1024
+
+    # HttpFetcher 按 host 限流配置
+    """
+    rate: 每秒允许的请求数(令牌桶补充速率), 0 为不限制
+    burst: 允许的突发请求数(令牌桶容量), 默认与 rate 相同
+    concurrency: 同时进行中的最大请求数, 0 为不限制
+    host 未配置时会依次匹配上级域名, 均未匹配则使用 http_default_host_limit
+    """
+    http_host_limits: Dict[str, Dict[str, float]] = {
+        'api.bilibili.com': {'rate': 4, 'burst': 8, 'concurrency': 4},
+        'api.vc.bilibili.com': {'rate': 4, 'burst': 8, 'concurrency': 4},
+        'api.live.bilibili.com': {'rate': 4, 'burst': 8, 'concurrency': 4},
+        'hdslb.com': {'rate': 10, 'burst': 20, 'concurrency': 8},
+        'www.pixiv.net': {'rate': 3, 'burst': 6, 'concurrency': 4},
+        'pximg.net': {'rate': 8, 'burst': 16, 'concurrency': 8},
+        'saucenao.com': {'rate': 0.5, 'burst': 2, 'concurrency': 1}
+    }
+    http_default_host_limit: Dict[str, float] = {'rate': 0, 'concurrency': 0}
+
+    # HttpFetcher 重试策略配置
+    """
+    http_retry_base_delay: 首次重试退避时间基数(秒), 之后每次翻倍并加入随机抖动
+    http_retry_max_delay: 单次退避时间上限(秒)
+    http_retry_max_retry_after: 服务器返回的 Retry-After 超过该值(秒)时直接放弃重试
+    http_retry_budget_ratio: 全局重试预算, 每个新请求可增加的重试次数
+    http_retry_budget_min_per_second: 全局重试预算, 每秒固定补充的重试次数
+    http_retry_budget_max: 全局重试预算上限
+    """
+    http_retry_base_delay: float = 0.5
+    http_retry_max_delay: float = 10
+    http_retry_max_retry_after: float = 60
+    http_retry_budget_ratio: float = 0.2
+    http_retry_budget_min_per_second: float = 1
+    http_retry_budget_max: float = 20
+
+    # 订阅通知发送配置
+    """
+    notice_dispatcher_concurrency_per_bot: 每个 bot 同时进行中的发送请求数
+    notice_dispatcher_target_interval: 向同一群组/好友连续发送消息的最小间隔(秒), 避免触发风控
+    notice_dispatcher_max_retries: 请求未发出的连接错误的最大重试次数, 其他发送失败直接进入死信
+    notice_dispatcher_retry_delay: 首次重试前的等待时间(秒), 之后每次翻倍
+    notice_dispatcher_max_pending: 等待发送的消息数上限, 超出后新消息直接进入死信
+    notice_dispatcher_dead_letter_size: 保留的发送失败消息数
+    """
+    notice_dispatcher_concurrency_per_bot: int = 4
+    notice_dispatcher_target_interval: float = 1
+    notice_dispatcher_max_retries: int = 2
+    notice_dispatcher_retry_delay: float = 3
+    notice_dispatcher_max_pending: int = 2000
+    notice_dispatcher_dead_letter_size: int = 100
+
+    # 图片等媒体文件磁盘缓存配置
+    """
+    下载的媒体文件以链接的 hash 为文件名保存在 tmp/media_cache, 按 pic_encoder_send_file 配置以 file:/// 路径或 base64 发送
+    media_cache_max_bytes: 缓存文件总大小上限(bytes), 超出后按最近使用时间淘汰
+    media_cache_max_file_size: 单个文件大小上限(bytes), 超出则放弃下载
+    """
+    media_cache_max_bytes: int = 512 * 1024 * 1024
+    media_cache_max_file_size: int = 32 * 1024 * 1024
+
+    # 图片发送前转码配置
+    """
+    发送前在进程池中缩放并重新压缩图片, 同时去除 exif 等元数据, 动图不做处理
+    转码结果以原图内容 hash 为键保存在 tmp/pic_encoder_cache
+    pic_encoder_max_size: 图片长边上限(px), 超出则等比缩小
+    pic_encoder_format: 转码格式, JPEG 或 WEBP
+    pic_encoder_quality: 转码质量, 1-100
+    pic_encoder_workers: 转码进程数
+    pic_encoder_cache_max_bytes: 转码结果缓存总大小上限(bytes), 超出后按最近使用时间淘汰
+    pic_encoder_send_file: bot 与 go-cqhttp 共享文件系统时开启, 转码后的图片直接以 file:/// 路径发送, 不再编码为 base64
+    """
+    pic_encoder_max_size: int = 2048
+    pic_encoder_format: str = 'JPEG'
+    pic_encoder_quality: int = 85
+    pic_encoder_workers: int = 2
+    pic_encoder_cache_max_bytes: int = 256 * 1024 * 1024
+    pic_encoder_send_file: bool = False
+
+    # 压缩包打包进程数
+    """
+    create_zip_file / create_7z_file / StreamingArchive 使用独立的进程池, 不占用默认线程池
+    StreamingArchive 从加入第一个文件起占用一个进程直到完成, 超出时排队等待, 已下载的文件会在排队期间继续加入
+    create_zip_file / create_7z_file 一次写入全部文件, 使用另一个同样大小的进程池
+    """
+    archive_workers: int = 2
+
+    # 订阅轮询调度配置
+    """
+    各订阅按更新频率、是否在直播及当前时段单独计算下次检查时间, 所有订阅共用每分钟请求数预算
+    poll_scheduler_requests_per_minute: 所有订阅检查每分钟最多发出的请求数, 应低于 http_host_limits 中 B站 API 的限速(4/s, 即 240/min)
+    poll_scheduler_quiet_hours: 闲时时段(小时), 该时段内检查间隔乘以 poll_scheduler_quiet_factor
+    poll_scheduler_stale_warning: 订阅超过该时间(秒)未能检查时输出警告, 通常意味着请求预算不足
+    poll_scheduler_lag_warning: 请求预算耗尽时已到期订阅的最大延迟超过该时间(秒)则输出警告
+    """
+    poll_scheduler_requests_per_minute: float = 120
+    poll_scheduler_quiet_hours: List[int] = [2, 3, 4, 5, 6, 7]
+    poll_scheduler_quiet_factor: float = 3
+    poll_scheduler_stale_warning: float = 1800
+    poll_scheduler_lag_warning: float = 60
+
+    # 权限检查结果缓存时间(秒)
+    """
+    run_preprocessor 及 rule 中的权限检查结果缓存于内存中
+    通过 Omega / OmegaAuth 命令修改权限时会主动清除对应群组/用户的缓存, 直接修改数据库则需等待缓存过期
+    """
+    permission_cache_ttl: int = 300
+
+    class Config:
+        extra = "ignore"
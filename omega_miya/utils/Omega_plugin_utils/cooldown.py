@@ -1,4 +1,9 @@
+import heapq
 import datetime
+import itertools
+import nonebot
+from typing import Dict, List, Tuple, Optional
+from nonebot import logger
 from omega_miya.utils.Omega_Base import DBCoolDownEvent, Result
 from dataclasses import dataclass, field
 
@@ -14,64 +19,128 @@ class PluginCoolDown:
     skip_auth_node: str = field(default='skip_cd', init=False)
 
 
+class CoolDownStore(object):
+    """
+    内存冷却事件存储
+    冷却事件按 (event_type, plugin, group_id, user_id) 保存在内存中, 过期时间用最小堆维护
+    启动时从数据库载入, 之后定时将全部未过期事件写回数据库
+    """
+    # key: (event_type, plugin, group_id, user_id), value: (stop_at, description)
+    __events: Dict[Tuple[str, Optional[str], Optional[int], Optional[int]],
+                   Tuple[datetime.datetime, Optional[str]]] = {}
+    # 堆中元素: (stop_at, 序号, key), 事件被覆盖后旧元素在弹出时跳过
+    __expiry_heap: List[Tuple[datetime.datetime, int, Tuple[str, Optional[str], Optional[int], Optional[int]]]] = []
+    __counter = itertools.count()
+    __changed: bool = False
+
+    @classmethod
+    def check(cls, event_type: str, plugin: str = None, group_id: int = None, user_id: int = None
+              ) -> Result.IntResult:
+        stop_at, _ = cls.__events.get((event_type, plugin, group_id, user_id), (None, None))
+        if stop_at is not None and datetime.datetime.now() < stop_at:
+            return Result.IntResult(error=False, info=f'CoolDown until: {stop_at}', result=1)
+        else:
+            return Result.IntResult(error=False, info='NoResultFound', result=0)
+
+    @classmethod
+    def set(cls, stop_at: datetime.datetime, event_type: str,
+            plugin: str = None, group_id: int = None, user_id: int = None, description: str = None) -> None:
+        key = (event_type, plugin, group_id, user_id)
+        cls.__events[key] = (stop_at, description)
+        heapq.heappush(cls.__expiry_heap, (stop_at, next(cls.__counter), key))
+        cls.__changed = True
+
+    @classmethod
+    def sweep(cls) -> int:
+        """
+        清除已过期的冷却事件
+        :return: 清除的事件数
+        """
+        now = datetime.datetime.now()
+        count = 0
+        while cls.__expiry_heap and cls.__expiry_heap[0][0] <= now:
+            stop_at, _, key = heapq.heappop(cls.__expiry_heap)
+            if cls.__events.get(key, (None, None))[0] == stop_at:
+                del cls.__events[key]
+                cls.__changed = True
+                count += 1
+        return count
+
+    @classmethod
+    async def load(cls) -> None:
+        result = await DBCoolDownEvent.list_active_events()
+        if result.error:
+            logger.opt(colors=True).error(f'<Y><lw>CoolDownStore</lw></Y> load cool down events failed, {result.info}')
+            return
+        for event_type, plugin, group_id, user_id, stop_at, description in result.result:
+            key = (event_type, plugin, group_id, user_id)
+            cls.__events[key] = (stop_at, description)
+            heapq.heappush(cls.__expiry_heap, (stop_at, next(cls.__counter), key))
+        cls.__changed = False
+        logger.opt(colors=True).debug(f'<Y><lw>CoolDownStore</lw></Y> loaded {len(result.result)} cool down events')
+
+    @classmethod
+    async def snapshot(cls) -> None:
+        """
+        将内存中未过期的冷却事件写入数据库, 无变化时跳过
+        """
+        cls.sweep()
+        if not cls.__changed:
+            return
+        # 先标记, 写入期间产生的新事件留到下次写入
+        cls.__changed = False
+        events = [{'event_type': event_type, 'plugin': plugin, 'group_id': group_id, 'user_id': user_id,
+                   'stop_at': stop_at, 'description': description}
+                  for (event_type, plugin, group_id, user_id), (stop_at, description) in cls.__events.items()]
+        result = await DBCoolDownEvent.replace_all_events(events=events)
+        if result.error:
+            cls.__changed = True
+            logger.opt(colors=True).error(f'<Y><lw>CoolDownStore</lw></Y> snapshot failed, {result.info}')
+
+
+nonebot.get_driver().on_startup(CoolDownStore.load)
+nonebot.get_driver().on_shutdown(CoolDownStore.snapshot)
+
+
 async def check_and_set_global_cool_down(minutes: int) -> Result.IntResult:
-    check = await DBCoolDownEvent.check_global_cool_down_event()
-    if check.result == 1:
-        return check
-    elif check.result == 0:
-        if minutes <= 0:
-            return check
-        await DBCoolDownEvent.add_global_cool_down_event(
-            stop_at=datetime.datetime.now() + datetime.timedelta(minutes=minutes))
-        return check
-    else:
-        return check
+    check = CoolDownStore.check(event_type=PluginCoolDown.global_type)
+    if check.result == 0 and minutes > 0:
+        CoolDownStore.set(
+            stop_at=datetime.datetime.now() + datetime.timedelta(minutes=minutes),
+            event_type=PluginCoolDown.global_type)
+    return check
 
 
 async def check_and_set_plugin_cool_down(minutes: int, plugin: str) -> Result.IntResult:
-    check = await DBCoolDownEvent.check_plugin_cool_down_event(plugin=plugin)
-    if check.result == 1:
-        return check
-    elif check.result == 0:
-        if minutes <= 0:
-            return check
-        await DBCoolDownEvent.add_plugin_cool_down_event(
-            stop_at=datetime.datetime.now() + datetime.timedelta(minutes=minutes), plugin=plugin)
-        return check
-    else:
-        return check
+    check = CoolDownStore.check(event_type=PluginCoolDown.plugin_type, plugin=plugin)
+    if check.result == 0 and minutes > 0:
+        CoolDownStore.set(
+            stop_at=datetime.datetime.now() + datetime.timedelta(minutes=minutes),
+            event_type=PluginCoolDown.plugin_type, plugin=plugin)
+    return check
 
 
 async def check_and_set_group_cool_down(minutes: int, plugin: str, group_id: int) -> Result.IntResult:
-    check = await DBCoolDownEvent.check_group_cool_down_event(plugin=plugin, group_id=group_id)
-    if check.result == 1:
-        return check
-    elif check.result == 0:
-        if minutes <= 0:
-            return check
-        await DBCoolDownEvent.add_group_cool_down_event(
-            stop_at=datetime.datetime.now() + datetime.timedelta(minutes=minutes), plugin=plugin, group_id=group_id)
-        return check
-    else:
-        return check
+    check = CoolDownStore.check(event_type=PluginCoolDown.group_type, plugin=plugin, group_id=group_id)
+    if check.result == 0 and minutes > 0:
+        CoolDownStore.set(
+            stop_at=datetime.datetime.now() + datetime.timedelta(minutes=minutes),
+            event_type=PluginCoolDown.group_type, plugin=plugin, group_id=group_id)
+    return check
 
 
 async def check_and_set_user_cool_down(minutes: int, plugin: str, user_id: int) -> Result.IntResult:
-    check = await DBCoolDownEvent.check_user_cool_down_event(plugin=plugin, user_id=user_id)
-    if check.result == 1:
-        return check
-    elif check.result == 0:
-        if minutes <= 0:
-            return check
-        await DBCoolDownEvent.add_user_cool_down_event(
-            stop_at=datetime.datetime.now() + datetime.timedelta(minutes=minutes), plugin=plugin, user_id=user_id)
-        return check
-    else:
-        return check
+    check = CoolDownStore.check(event_type=PluginCoolDown.user_type, plugin=plugin, user_id=user_id)
+    if check.result == 0 and minutes > 0:
+        CoolDownStore.set(
+            stop_at=datetime.datetime.now() + datetime.timedelta(minutes=minutes),
+            event_type=PluginCoolDown.user_type, plugin=plugin, user_id=user_id)
+    return check
 
 
 __all__ = [
     'PluginCoolDown',
+    'CoolDownStore',
     'check_and_set_global_cool_down',
     'check_and_set_plugin_cool_down',
     'check_and_set_group_cool_down',
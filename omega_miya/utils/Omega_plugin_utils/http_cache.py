@@ -0,0 +1,256 @@
+"""
+HttpFetcher 响应缓存
+内存 LRU + 磁盘两级缓存, 支持 ETag / Last-Modified 条件请求
+磁盘缓存总大小超出上限时按 LRU 淘汰, 启动时扫描缓存目录重建索引
+"""
+import os
+import json
+import time
+import asyncio
+import hashlib
+import aiofiles
+import nonebot
+from collections import OrderedDict
+from dataclasses import dataclass, asdict
+from typing import Dict, List, Tuple, Optional, Any
+from nonebot import logger
+from .config import Config
+
+
+global_config = nonebot.get_driver().config
+plugin_config = Config(**global_config.dict())
+TMP_PATH = global_config.tmp_path_
+HTTP_CACHE_MEMORY_SIZE = plugin_config.http_cache_memory_size
+HTTP_CACHE_MAX_BYTES = plugin_config.http_cache_max_bytes
+HTTP_CACHE_PATH = os.path.abspath(os.path.join(TMP_PATH, 'http_cache'))
+
+
+def _scan_disk_cache() -> List[Tuple[float, str, int]]:
+    """
+    扫描缓存目录, 不访问 HttpResponseCache 的状态, 可在线程池中执行
+    :return: 按修改时间排序的 (修改时间, 缓存 key, 文件大小)
+    """
+    if not os.path.exists(HTTP_CACHE_PATH):
+        return []
+
+    files = []
+    for entry in os.scandir(HTTP_CACHE_PATH):
+        if entry.is_file() and entry.name.endswith('.json'):
+            stat = entry.stat()
+            files.append((stat.st_mtime, entry.name[:-len('.json')], stat.st_size))
+    return sorted(files)
+
+
+@dataclass
+class HttpCacheEntry:
+    status: int
+    headers: Dict[str, str]
+    body: Any
+    etag: Optional[str]
+    last_modified: Optional[str]
+    # 使用时间戳以便写入磁盘后仍然有效
+    expires_at: float
+
+    def is_fresh(self) -> bool:
+        return time.time() < self.expires_at
+
+    def has_validator(self) -> bool:
+        return bool(self.etag or self.last_modified)
+
+
+class HttpResponseCache(object):
+    __memory_cache: Dict[str, HttpCacheEntry] = OrderedDict()
+    # 磁盘缓存索引, key: 缓存 key, value: 文件大小, 按最近使用顺序排列
+    __disk_index: Dict[str, int] = OrderedDict()
+    __disk_bytes: int = 0
+    __disk_loaded: bool = False
+    __hits: int = 0
+    __misses: int = 0
+    __revalidated: int = 0
+
+    @classmethod
+    def make_key(
+            cls, kind: str, url: str, params: Optional[Dict[str, Any]], cookies: Optional[Dict[str, str]]) -> str:
+        """
+        :param kind: 响应类型, 如 json / text, 同一链接不同类型的响应分别缓存
+        """
+        raw_key = json.dumps(
+            [kind, url, sorted((params or {}).items()), sorted((cookies or {}).items())],
+            ensure_ascii=False, default=str)
+        return hashlib.sha1(raw_key.encode('utf-8')).hexdigest()
+
+    @classmethod
+    def __disk_path(cls, key: str) -> str:
+        return os.path.join(HTTP_CACHE_PATH, f'{key}.json')
+
+    @classmethod
+    def __memory_set(cls, key: str, entry: HttpCacheEntry) -> None:
+        cls.__memory_cache[key] = entry
+        cls.__memory_cache.move_to_end(key)
+        while len(cls.__memory_cache) > HTTP_CACHE_MEMORY_SIZE:
+            cls.__memory_cache.popitem(last=False)
+
+    @classmethod
+    def __load_disk_index(cls, files: List[Tuple[float, str, int]]) -> None:
+        """
+        以扫描结果重建索引, 按修改时间排序, 命中时会更新修改时间, 只在事件循环中调用
+        """
+        cls.__disk_loaded = True
+        cls.__disk_index.clear()
+        cls.__disk_bytes = 0
+        for _, key, size in files:
+            cls.__disk_index[key] = size
+            cls.__disk_bytes += size
+        cls.__evict()
+
+    @classmethod
+    def __evict(cls) -> None:
+        while cls.__disk_bytes > HTTP_CACHE_MAX_BYTES and cls.__disk_index:
+            cls.__remove_disk(next(iter(cls.__disk_index)))
+
+    @classmethod
+    def __remove_disk(cls, key: str) -> None:
+        size = cls.__disk_index.pop(key, None)
+        if size is not None:
+            cls.__disk_bytes -= size
+        try:
+            os.remove(cls.__disk_path(key))
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logger.opt(colors=True).debug(f'<Y><lw>HttpResponseCache</lw></Y> remove {key} failed, {repr(e)}')
+
+    @classmethod
+    async def get(cls, key: str) -> Optional[HttpCacheEntry]:
+        entry = cls.__memory_cache.get(key)
+        if entry is not None:
+            cls.__memory_cache.move_to_end(key)
+            return entry
+
+        disk_path = cls.__disk_path(key)
+        if not os.path.exists(disk_path):
+            return None
+        try:
+            async with aiofiles.open(disk_path, 'r', encoding='utf-8') as f:
+                entry = HttpCacheEntry(**json.loads(await f.read()))
+        except Exception as e:
+            logger.opt(colors=True).debug(f'<Y><lw>HttpResponseCache</lw></Y> load disk cache failed, {repr(e)}')
+            return None
+
+        # 已过期且无法条件请求的缓存没有保留的意义
+        if not entry.is_fresh() and not entry.has_validator():
+            cls.__remove_disk(key)
+            return None
+
+        if key in cls.__disk_index:
+            cls.__disk_index.move_to_end(key)
+            try:
+                os.utime(disk_path)
+            except Exception:
+                pass
+        cls.__memory_set(key, entry)
+        return entry
+
+    @classmethod
+    async def set(cls, key: str, entry: HttpCacheEntry) -> None:
+        cls.__memory_set(key, entry)
+        if not cls.__disk_loaded:
+            cls.__load_disk_index(files=_scan_disk_cache())
+        try:
+            if not os.path.exists(HTTP_CACHE_PATH):
+                os.makedirs(HTTP_CACHE_PATH)
+            data = json.dumps(asdict(entry), ensure_ascii=False).encode('utf-8')
+            if len(data) > HTTP_CACHE_MAX_BYTES:
+                # 单个响应超出磁盘缓存上限时只保留在内存中
+                cls.__remove_disk(key)
+                return
+            async with aiofiles.open(cls.__disk_path(key), 'wb') as f:
+                await f.write(data)
+        except Exception as e:
+            logger.opt(colors=True).debug(f'<Y><lw>HttpResponseCache</lw></Y> write disk cache failed, {repr(e)}')
+            return
+
+        if key in cls.__disk_index:
+            cls.__disk_bytes -= cls.__disk_index[key]
+        cls.__disk_index[key] = len(data)
+        cls.__disk_index.move_to_end(key)
+        cls.__disk_bytes += len(data)
+        cls.__evict()
+
+    @classmethod
+    async def store(
+            cls, key: str, ttl: float, status: int, headers: Dict[str, str], body: Any) -> None:
+        """
+        写入 200 响应, 仅在有有效期或可条件请求时缓存
+        """
+        lower_headers = {k.lower(): v for k, v in headers.items()}
+        entry = HttpCacheEntry(
+            status=status, headers=headers, body=body,
+            etag=lower_headers.get('etag'), last_modified=lower_headers.get('last-modified'),
+            expires_at=time.time() + ttl)
+        if ttl > 0 or entry.has_validator():
+            await cls.set(key=key, entry=entry)
+
+    @classmethod
+    async def refresh(cls, key: str, entry: HttpCacheEntry, ttl: float) -> None:
+        """
+        收到 304 响应后刷新缓存有效期
+        """
+        cls.__revalidated += 1
+        entry.expires_at = time.time() + ttl
+        await cls.set(key=key, entry=entry)
+
+    @classmethod
+    def conditional_headers(cls, entry: Optional[HttpCacheEntry]) -> Dict[str, str]:
+        headers = {}
+        if entry is None:
+            return headers
+        if entry.etag:
+            headers.update({'If-None-Match': entry.etag})
+        if entry.last_modified:
+            headers.update({'If-Modified-Since': entry.last_modified})
+        return headers
+
+    @classmethod
+    def hit(cls) -> None:
+        cls.__hits += 1
+
+    @classmethod
+    def miss(cls) -> None:
+        cls.__misses += 1
+
+    @classmethod
+    async def prune(cls) -> None:
+        """
+        启动时重建磁盘缓存索引并淘汰超出上限的部分, 文件较多时扫描耗时, 扫描在线程池中执行, 索引在事件循环中更新
+        """
+        try:
+            files = await asyncio.get_running_loop().run_in_executor(None, _scan_disk_cache)
+            # 扫描期间 set 已加载过索引时, 其索引包含扫描之后写入的文件, 不再用扫描结果覆盖
+            if not cls.__disk_loaded:
+                cls.__load_disk_index(files=files)
+            logger.opt(colors=True).debug(
+                f'<Y><lw>HttpResponseCache</lw></Y> loaded {len(cls.__disk_index)} disk cache files, '
+                f'total {cls.__disk_bytes} bytes')
+        except Exception as e:
+            logger.opt(colors=True).error(f'<Y><lw>HttpResponseCache</lw></Y> prune cache failed, {repr(e)}')
+
+    @classmethod
+    def stats(cls) -> Dict[str, int]:
+        return {
+            'hits': cls.__hits,
+            'misses': cls.__misses,
+            'revalidated': cls.__revalidated,
+            'memory_entries': len(cls.__memory_cache),
+            'disk_entries': len(cls.__disk_index),
+            'disk_bytes': cls.__disk_bytes
+        }
+
+
+nonebot.get_driver().on_startup(HttpResponseCache.prune)
+
+
+__all__ = [
+    'HttpCacheEntry',
+    'HttpResponseCache'
+]
@@ -1,4 +1,7 @@
 import os
+import copy
+import time
+import asyncio
 import aiohttp
 import aiofiles
 import nonebot
@@ -7,16 +10,32 @@ from dataclasses import dataclass
 from typing import Dict, Union, Optional, Any
 from nonebot import logger
 from omega_miya.utils.Omega_Base import DBStatus
+from .config import Config
+from .http_cache import HttpResponseCache
+from .http_rate_limiter import HttpRateLimiter
+from .http_retry import HttpRetryableStatusError, HttpAbortStatusError, RetryPolicy, retry_budget
 
 
 global_config = nonebot.get_driver().config
+plugin_config = Config(**global_config.dict())
 ENABLE_PROXY = global_config.enable_proxy
 ENABLE_FORCED_PROXY = global_config.enable_forced_proxy
 PROXY_ADDRESS = global_config.proxy_address
 PROXY_PORT = global_config.proxy_port
+HTTP_POOL_LIMIT = plugin_config.http_pool_limit
+HTTP_POOL_LIMIT_PER_HOST = plugin_config.http_pool_limit_per_host
+HTTP_POOL_KEEPALIVE_TIMEOUT = plugin_config.http_pool_keepalive_timeout
+HTTP_POOL_DNS_CACHE_TTL = plugin_config.http_pool_dns_cache_ttl
+HTTP_PROXY_STATUS_CACHE_TTL = plugin_config.http_proxy_status_cache_ttl
 
 
 class HttpFetcher(object):
+    # 所有实例共用的 session, 由 driver 生命周期管理
+    __session: Optional[aiohttp.ClientSession] = None
+    # 代理可用性状态缓存及其更新时间
+    __proxy_available: Optional[bool] = None
+    __proxy_status_updated_at: float = 0
+
     @dataclass
     class __FetcherResult:
         error: bool
@@ -54,6 +73,38 @@ class HttpFetcher(object):
             return f'<FetcherBytesResult(' \
                    f'error={self.error}, status={self.status}, info={self.info}, result={self.result})>'
 
+    @classmethod
+    def __get_session(cls) -> aiohttp.ClientSession:
+        """
+        获取全局共享的 session, 不存在或已关闭时重新创建
+        使用 DummyCookieJar, 避免不同实例之间通过 session 共享 cookies
+        """
+        if cls.__session is None or cls.__session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=HTTP_POOL_LIMIT,
+                limit_per_host=HTTP_POOL_LIMIT_PER_HOST,
+                keepalive_timeout=HTTP_POOL_KEEPALIVE_TIMEOUT,
+                ttl_dns_cache=HTTP_POOL_DNS_CACHE_TTL
+            )
+            cls.__session = aiohttp.ClientSession(connector=connector, cookie_jar=aiohttp.DummyCookieJar())
+            logger.opt(colors=True).debug('<Y><lw>HttpFetcher</lw></Y> shared session created')
+        return cls.__session
+
+    @classmethod
+    async def close_session(cls) -> None:
+        if cls.__session is not None and not cls.__session.closed:
+            await cls.__session.close()
+            logger.opt(colors=True).debug('<Y><lw>HttpFetcher</lw></Y> shared session closed')
+        cls.__session = None
+
+    @classmethod
+    def set_proxy_status(cls, available: bool) -> None:
+        """
+        更新代理可用性状态缓存, 由 check_proxy 后台任务调用
+        """
+        cls.__proxy_available = available
+        cls.__proxy_status_updated_at = time.monotonic()
+
     @classmethod
     async def __get_proxy(cls, always_return_proxy: bool = False) -> Optional[str]:
         if always_return_proxy:
@@ -68,12 +119,17 @@ class HttpFetcher(object):
         # 检查proxy
         if ENABLE_FORCED_PROXY:
             return f'http://{PROXY_ADDRESS}:{PROXY_PORT}'
-        else:
+
+        # 缓存过期时才从数据库读取代理状态
+        if cls.__proxy_available is None \
+                or time.monotonic() - cls.__proxy_status_updated_at > HTTP_PROXY_STATUS_CACHE_TTL:
             proxy_status_res = await DBStatus(name='PROXY_AVAILABLE').get_status()
-            if proxy_status_res.result == 1:
-                return f'http://{PROXY_ADDRESS}:{PROXY_PORT}'
-            else:
-                return None
+            cls.set_proxy_status(available=proxy_status_res.result == 1)
+
+        if cls.__proxy_available:
+            return f'http://{PROXY_ADDRESS}:{PROXY_PORT}'
+        else:
+            return None
 
     def __init__(
             self,
@@ -81,13 +137,55 @@ class HttpFetcher(object):
             attempt_limit: int = 3,
             flag: str = 'aiohttp',
             headers: Optional[Dict[str, str]] = None,
-            cookies: Optional[Dict[str, str]] = None
+            cookies: Optional[Dict[str, str]] = None,
+            cache_ttl: Optional[float] = None,
+            retry_policy: Optional[RetryPolicy] = None
     ):
+        """
+        :param retry_policy: 重试策略, 默认使用全局配置的指数退避策略
+        :param cache_ttl: get_json / get_text 响应缓存有效期(秒), 可在调用时单独覆盖
+            None: 不使用缓存(默认)
+            0: 不直接使用缓存, 但每次请求都会携带 ETag / Last-Modified 条件请求, 收到 304 时返回缓存内容
+            >0: 有效期内直接返回缓存, 过期后再条件请求
+        """
         self.__timeout = aiohttp.ClientTimeout(total=timeout)
         self.__attempt_limit = attempt_limit
         self.__headers = headers
         self.__cookies = cookies
         self.__flag = flag
+        self.__cache_ttl = cache_ttl
+        self.__retry_policy = retry_policy if retry_policy is not None else RetryPolicy()
+
+    @classmethod
+    def cache_stats(cls) -> Dict[str, int]:
+        """
+        响应缓存命中统计
+        """
+        return HttpResponseCache.stats()
+
+    async def __wait_for_attempt(self, method: str, num_of_attempts: int, retry_after: Optional[float]) -> bool:
+        """
+        每次请求前调用, 首次请求为全局重试预算充值, 重试前按重试策略退避
+        :return: 是否继续请求
+        """
+        if num_of_attempts == 0:
+            retry_budget.deposit()
+            return True
+
+        delay = self.__retry_policy.get_delay(attempt=num_of_attempts, retry_after=retry_after)
+        if delay is None:
+            logger.opt(colors=True).warning(
+                fr'<Y><lw>HttpFetcher \<{self.__flag}></lw></Y> Retry-After <y>{retry_after}</y> is too long, '
+                f'stop retrying in <lc>{method}</lc>.')
+            return False
+        if not retry_budget.withdraw():
+            logger.opt(colors=True).warning(
+                fr'<Y><lw>HttpFetcher \<{self.__flag}></lw></Y> <lr>RetryBudgetExhausted</lr>, '
+                f'stop retrying in <lc>{method}</lc>.')
+            return False
+
+        await asyncio.sleep(delay)
+        return True
 
     async def download_file(
             self,
@@ -96,6 +194,9 @@ class HttpFetcher(object):
             file_name: str,
             params: Dict[str, str] = None,
             force_proxy: bool = False,
+            stream: bool = False,
+            chunk_size: int = 65536,
+            max_size: Optional[int] = None,
             **kwargs: Any) -> FetcherTextResult:
         """
         下载文件
@@ -104,6 +205,9 @@ class HttpFetcher(object):
         :param file_name: 文件名
         :param params: 请求参数
         :param force_proxy: 强制代理
+        :param stream: 流式下载, 分块写入临时文件, 完成后再重命名, 重试时使用 Range 请求断点续传
+        :param chunk_size: 流式下载时每次读取的块大小(bytes)
+        :param max_size: 流式下载时允许的最大文件大小(bytes), 超出则放弃下载, None 为不限制
         :param kwargs: ...
         :return:
         """
@@ -114,23 +218,48 @@ class HttpFetcher(object):
         file_path = os.path.abspath(os.path.join(folder_path, file_name))
 
         proxy = await self.__get_proxy(always_return_proxy=force_proxy)
+
+        if stream:
+            return await self.__download_file_stream(
+                url=url, file_path=file_path, params=params, proxy=proxy,
+                chunk_size=chunk_size, max_size=max_size, **kwargs)
+
+        retry_after = None
         num_of_attempts = 0
         while num_of_attempts < self.__attempt_limit:
+            # 重试前按策略退避, 超出重试预算时放弃
+            if not await self.__wait_for_attempt(
+                    method='download_file', num_of_attempts=num_of_attempts, retry_after=retry_after):
+                break
             try:
-                async with aiohttp.ClientSession(timeout=self.__timeout) as session:
-                    async with session.get(
-                            url=url, params=params,
-                            headers=self.__headers, cookies=self.__cookies, proxy=proxy, timeout=self.__timeout,
-                            **kwargs
-                    ) as rp:
-                        file_bytes = await rp.read()
-                        status = rp.status
-                        headers = dict(rp.headers)
-                    async with aiofiles.open(file_path, 'wb') as f:
-                        await f.write(file_bytes)
-                    result = self.FetcherTextResult(
-                        error=False, info='Success', status=status, headers=headers, result=file_path)
+                retry_after = None
+                session = self.__get_session()
+                async with HttpRateLimiter.limit(url=url), session.get(
+                        url=url, params=params,
+                        headers=self.__headers, cookies=self.__cookies, proxy=proxy, timeout=self.__timeout,
+                        **kwargs
+                ) as rp:
+                    self.__retry_policy.check_status(status=rp.status, headers=rp.headers)
+                    file_bytes = await rp.read()
+                    status = rp.status
+                    headers = dict(rp.headers)
+                async with aiofiles.open(file_path, 'wb') as f:
+                    await f.write(file_bytes)
+                result = self.FetcherTextResult(
+                    error=False, info='Success', status=status, headers=headers, result=file_path)
                 return result
+            except HttpAbortStatusError as e:
+                logger.opt(colors=True).warning(
+                    fr'<Y><lw>HttpFetcher \<{self.__flag}></lw></Y> <lr>HttpAbortStatusError</lr> occurred '
+                    f'in <lc>download_file</lc>, status: <y>{e.status}</y>, stop retrying.')
+                return self.FetcherTextResult(
+                    error=True, info=f'Aborted with status {e.status}', status=e.status, headers=e.headers,
+                    result='')
+            except HttpRetryableStatusError as e:
+                retry_after = e.retry_after
+                logger.opt(colors=True).warning(
+                    fr'<Y><lw>HttpFetcher \<{self.__flag}></lw></Y> <lr>HttpRetryableStatusError</lr> occurred '
+                    f'in <lc>download_file</lc> attempt <y>{num_of_attempts + 1}</y>, status: <y>{e.status}</y>.')
             except TimeoutError_:
                 logger.opt(colors=True).warning(
                     fr'<Y><lw>HttpFetcher \<{self.__flag}></lw></Y> <lr>TimeoutError</lr> occurred '
@@ -141,36 +270,196 @@ class HttpFetcher(object):
                     f'in <lc>download_file</lc> attempt <y>{num_of_attempts + 1}</y>.\n<y>Error info</y>: {str(e)}')
             finally:
                 num_of_attempts += 1
-        else:
-            logger.opt(colors=True).error(
-                fr'<Y><lw>HttpFetcher \<{self.__flag}></lw></Y> <lr>ExceededAttemptNumberError</lr> '
-                f'Failed too many times in <lc>download_file</lc>.\n'
-                f'<y>url</y>: {url}\n<y>params</y>: {params}')
-            return self.FetcherTextResult(
-                error=True, info='Failed too many times in download_file', status=-1, headers={}, result='')
+        logger.opt(colors=True).error(
+            fr'<Y><lw>HttpFetcher \<{self.__flag}></lw></Y> <lr>ExceededAttemptNumberError</lr> '
+            f'Failed too many times in <lc>download_file</lc>.\n'
+            f'<y>url</y>: {url}\n<y>params</y>: {params}')
+        return self.FetcherTextResult(
+            error=True, info='Failed too many times in download_file', status=-1, headers={}, result='')
+
+    async def __download_file_stream(
+            self,
+            url: str,
+            file_path: str,
+            params: Optional[Dict[str, str]],
+            proxy: Optional[str],
+            chunk_size: int,
+            max_size: Optional[int],
+            **kwargs: Any) -> FetcherTextResult:
+        tmp_file_path = f'{file_path}.download'
+        # 清理上次异常退出残留的临时文件, 仅在本次调用的重试中续传
+        if os.path.exists(tmp_file_path):
+            os.remove(tmp_file_path)
+
+        retry_after = None
+        num_of_attempts = 0
+        while num_of_attempts < self.__attempt_limit:
+            # 重试前按策略退避, 超出重试预算时放弃
+            if not await self.__wait_for_attempt(
+                    method='download_file', num_of_attempts=num_of_attempts, retry_after=retry_after):
+                break
+            try:
+                retry_after = None
+                downloaded_size = os.path.getsize(tmp_file_path) if os.path.exists(tmp_file_path) else 0
+                request_headers = dict(self.__headers) if self.__headers else {}
+                if downloaded_size > 0:
+                    request_headers.update({'Range': f'bytes={downloaded_size}-'})
+
+                session = self.__get_session()
+                async with HttpRateLimiter.limit(url=url), session.get(
+                        url=url, params=params,
+                        headers=request_headers, cookies=self.__cookies, proxy=proxy, timeout=self.__timeout,
+                        **kwargs
+                ) as rp:
+                    self.__retry_policy.check_status(status=rp.status, headers=rp.headers)
+                    if rp.status == 416:
+                        # 续传位置无效, 下一次重试从头开始
+                        os.remove(tmp_file_path)
+                    rp.raise_for_status()
+
+                    # 服务器不支持 Range 时会返回完整内容
+                    if rp.status != 206:
+                        downloaded_size = 0
+
+                    if max_size is not None and rp.content_length is not None \
+                            and downloaded_size + rp.content_length > max_size:
+                        if os.path.exists(tmp_file_path):
+                            os.remove(tmp_file_path)
+                        logger.opt(colors=True).warning(
+                            fr'<Y><lw>HttpFetcher \<{self.__flag}></lw></Y> <lr>FileSizeExceeded</lr> '
+                            f'in <lc>download_file</lc>, content length: {rp.content_length}, limit: {max_size}.')
+                        return self.FetcherTextResult(
+                            error=True, info='File size exceeded', status=rp.status, headers=dict(rp.headers),
+                            result='')
+
+                    async with aiofiles.open(tmp_file_path, 'ab' if downloaded_size > 0 else 'wb') as f:
+                        async for chunk in rp.content.iter_chunked(chunk_size):
+                            downloaded_size += len(chunk)
+                            if max_size is not None and downloaded_size > max_size:
+                                break
+                            await f.write(chunk)
+
+                    if max_size is not None and downloaded_size > max_size:
+                        os.remove(tmp_file_path)
+                        logger.opt(colors=True).warning(
+                            fr'<Y><lw>HttpFetcher \<{self.__flag}></lw></Y> <lr>FileSizeExceeded</lr> '
+                            f'in <lc>download_file</lc>, limit: {max_size}.')
+                        return self.FetcherTextResult(
+                            error=True, info='File size exceeded', status=rp.status, headers=dict(rp.headers),
+                            result='')
+
+                    status = rp.status
+                    headers = dict(rp.headers)
+                os.replace(tmp_file_path, file_path)
+                result = self.FetcherTextResult(
+                    error=False, info='Success', status=status, headers=headers, result=file_path)
+                return result
+            except HttpAbortStatusError as e:
+                logger.opt(colors=True).warning(
+                    fr'<Y><lw>HttpFetcher \<{self.__flag}></lw></Y> <lr>HttpAbortStatusError</lr> occurred '
+                    f'in <lc>download_file</lc>, status: <y>{e.status}</y>, stop retrying.')
+                if os.path.exists(tmp_file_path):
+                    os.remove(tmp_file_path)
+                return self.FetcherTextResult(
+                    error=True, info=f'Aborted with status {e.status}', status=e.status, headers=e.headers,
+                    result='')
+            except HttpRetryableStatusError as e:
+                retry_after = e.retry_after
+                logger.opt(colors=True).warning(
+                    fr'<Y><lw>HttpFetcher \<{self.__flag}></lw></Y> <lr>HttpRetryableStatusError</lr> occurred '
+                    f'in <lc>download_file</lc> attempt <y>{num_of_attempts + 1}</y>, status: <y>{e.status}</y>.')
+            except TimeoutError_:
+                logger.opt(colors=True).warning(
+                    fr'<Y><lw>HttpFetcher \<{self.__flag}></lw></Y> <lr>TimeoutError</lr> occurred '
+                    f'in <lc>download_file</lc> attempt <y>{num_of_attempts + 1}</y>.')
+            except Exception as e:
+                logger.opt(colors=True).warning(
+                    fr'<Y><lw>HttpFetcher \<{self.__flag}></lw></Y> <lr>{str(e.__class__.__name__)}</lr> occurred '
+                    f'in <lc>download_file</lc> attempt <y>{num_of_attempts + 1}</y>.\n<y>Error info</y>: {str(e)}')
+            finally:
+                num_of_attempts += 1
+        if os.path.exists(tmp_file_path):
+            os.remove(tmp_file_path)
+        logger.opt(colors=True).error(
+            fr'<Y><lw>HttpFetcher \<{self.__flag}></lw></Y> <lr>ExceededAttemptNumberError</lr> '
+            f'Failed too many times in <lc>download_file</lc>.\n'
+            f'<y>url</y>: {url}\n<y>params</y>: {params}')
+        return self.FetcherTextResult(
+            error=True, info='Failed too many times in download_file', status=-1, headers={}, result='')
 
     async def get_json(
             self,
             url: str,
             params: Dict[str, str] = None,
             force_proxy: bool = False,
+            cache_ttl: Optional[float] = None,
             **kwargs: Any) -> FetcherJsonResult:
+        # 检查响应缓存
+        cache_ttl = self.__cache_ttl if cache_ttl is None else cache_ttl
+        cache_key = None
+        cached = None
+        if cache_ttl is not None:
+            cache_key = HttpResponseCache.make_key(kind='json', url=url, params=params, cookies=self.__cookies)
+            cached = await HttpResponseCache.get(key=cache_key)
+            if cached is not None and cached.is_fresh():
+                HttpResponseCache.hit()
+                # 返回副本, 避免调用方修改结果后污染缓存
+                return self.FetcherJsonResult(
+                    error=False, info='Cache hit', status=cached.status, headers=dict(cached.headers),
+                    result=copy.deepcopy(cached.body))
+            HttpResponseCache.miss()
+
+        request_headers = dict(self.__headers) if self.__headers else {}
+        request_headers.update(HttpResponseCache.conditional_headers(entry=cached))
+
         proxy = await self.__get_proxy(always_return_proxy=force_proxy)
+        retry_after = None
         num_of_attempts = 0
         while num_of_attempts < self.__attempt_limit:
+            # 重试前按策略退避, 超出重试预算时放弃
+            if not await self.__wait_for_attempt(
+                    method='get_json', num_of_attempts=num_of_attempts, retry_after=retry_after):
+                break
             try:
-                async with aiohttp.ClientSession(timeout=self.__timeout) as session:
-                    async with session.get(
-                            url=url, params=params,
-                            headers=self.__headers, cookies=self.__cookies, proxy=proxy, timeout=self.__timeout,
-                            **kwargs
-                    ) as rp:
+                retry_after = None
+                session = self.__get_session()
+                async with HttpRateLimiter.limit(url=url), session.get(
+                        url=url, params=params,
+                        headers=request_headers, cookies=self.__cookies, proxy=proxy, timeout=self.__timeout,
+                        **kwargs
+                ) as rp:
+                    self.__retry_policy.check_status(status=rp.status, headers=rp.headers)
+                    status = rp.status
+                    headers = dict(rp.headers)
+                    if status == 304 and cached is not None:
+                        result_json = copy.deepcopy(cached.body)
+                    else:
                         result_json = await rp.json()
-                        status = rp.status
-                        headers = dict(rp.headers)
-                    result = self.FetcherJsonResult(
-                        error=False, info='Success', status=status, headers=headers, result=result_json)
+
+                if cache_key is not None and status == 304 and cached is not None:
+                    await HttpResponseCache.refresh(key=cache_key, entry=cached, ttl=cache_ttl)
+                    status = cached.status
+                    headers = dict(cached.headers)
+                elif cache_key is not None and status == 200:
+                    await HttpResponseCache.store(
+                        key=cache_key, ttl=cache_ttl, status=status, headers=dict(headers),
+                        body=copy.deepcopy(result_json))
+
+                result = self.FetcherJsonResult(
+                    error=False, info='Success', status=status, headers=headers, result=result_json)
                 return result
+            except HttpAbortStatusError as e:
+                logger.opt(colors=True).warning(
+                    fr'<Y><lw>HttpFetcher \<{self.__flag}></lw></Y> <lr>HttpAbortStatusError</lr> occurred '
+                    f'in <lc>get_json</lc>, status: <y>{e.status}</y>, stop retrying.')
+                return self.FetcherJsonResult(
+                    error=True, info=f'Aborted with status {e.status}', status=e.status, headers=e.headers,
+                    result={})
+            except HttpRetryableStatusError as e:
+                retry_after = e.retry_after
+                logger.opt(colors=True).warning(
+                    fr'<Y><lw>HttpFetcher \<{self.__flag}></lw></Y> <lr>HttpRetryableStatusError</lr> occurred '
+                    f'in <lc>get_json</lc> attempt <y>{num_of_attempts + 1}</y>, status: <y>{e.status}</y>.')
             except TimeoutError_:
                 logger.opt(colors=True).warning(
                     fr'<Y><lw>HttpFetcher \<{self.__flag}></lw></Y> <lr>TimeoutError</lr> occurred '
@@ -181,36 +470,84 @@ class HttpFetcher(object):
                     f'in <lc>get_json</lc> attempt <y>{num_of_attempts + 1}</y>.\n<y>Error info</y>: {str(e)}')
             finally:
                 num_of_attempts += 1
-        else:
-            logger.opt(colors=True).error(
-                fr'<Y><lw>HttpFetcher \<{self.__flag}></lw></Y> <lr>ExceededAttemptNumberError</lr> '
-                f'Failed too many times in <lc>get_json</lc>.\n'
-                f'<y>url</y>: {url}\n<y>params</y>: {params}')
-            return self.FetcherJsonResult(
-                error=True, info='Failed too many times in get_json', status=-1, headers={}, result={})
+        logger.opt(colors=True).error(
+            fr'<Y><lw>HttpFetcher \<{self.__flag}></lw></Y> <lr>ExceededAttemptNumberError</lr> '
+            f'Failed too many times in <lc>get_json</lc>.\n'
+            f'<y>url</y>: {url}\n<y>params</y>: {params}')
+        return self.FetcherJsonResult(
+            error=True, info='Failed too many times in get_json', status=-1, headers={}, result={})
 
     async def get_text(
             self,
             url: str,
             params: Dict[str, str] = None,
             force_proxy: bool = False,
+            cache_ttl: Optional[float] = None,
             **kwargs: Any) -> FetcherTextResult:
+        # 检查响应缓存
+        cache_ttl = self.__cache_ttl if cache_ttl is None else cache_ttl
+        cache_key = None
+        cached = None
+        if cache_ttl is not None:
+            cache_key = HttpResponseCache.make_key(kind='text', url=url, params=params, cookies=self.__cookies)
+            cached = await HttpResponseCache.get(key=cache_key)
+            if cached is not None and cached.is_fresh():
+                HttpResponseCache.hit()
+                return self.FetcherTextResult(
+                    error=False, info='Cache hit', status=cached.status, headers=dict(cached.headers),
+                    result=copy.deepcopy(cached.body))
+            HttpResponseCache.miss()
+
+        request_headers = dict(self.__headers) if self.__headers else {}
+        request_headers.update(HttpResponseCache.conditional_headers(entry=cached))
+
         proxy = await self.__get_proxy(always_return_proxy=force_proxy)
+        retry_after = None
         num_of_attempts = 0
         while num_of_attempts < self.__attempt_limit:
+            # 重试前按策略退避, 超出重试预算时放弃
+            if not await self.__wait_for_attempt(
+                    method='get_text', num_of_attempts=num_of_attempts, retry_after=retry_after):
+                break
             try:
-                async with aiohttp.ClientSession(timeout=self.__timeout) as session:
-                    async with session.get(
-                            url=url, params=params,
-                            headers=self.__headers, cookies=self.__cookies, proxy=proxy, timeout=self.__timeout,
-                            **kwargs
-                    ) as rp:
+                retry_after = None
+                session = self.__get_session()
+                async with HttpRateLimiter.limit(url=url), session.get(
+                        url=url, params=params,
+                        headers=request_headers, cookies=self.__cookies, proxy=proxy, timeout=self.__timeout,
+                        **kwargs
+                ) as rp:
+                    self.__retry_policy.check_status(status=rp.status, headers=rp.headers)
+                    status = rp.status
+                    headers = dict(rp.headers)
+                    if status == 304 and cached is not None:
+                        result_text = cached.body
+                    else:
                         result_text = await rp.text()
-                        status = rp.status
-                        headers = dict(rp.headers)
-                    result = self.FetcherTextResult(
-                        error=False, info='Success', status=status, headers=headers, result=result_text)
+
+                if cache_key is not None and status == 304 and cached is not None:
+                    await HttpResponseCache.refresh(key=cache_key, entry=cached, ttl=cache_ttl)
+                    status = cached.status
+                    headers = dict(cached.headers)
+                elif cache_key is not None and status == 200:
+                    await HttpResponseCache.store(
+                        key=cache_key, ttl=cache_ttl, status=status, headers=headers, body=result_text)
+
+                result = self.FetcherTextResult(
+                    error=False, info='Success', status=status, headers=headers, result=result_text)
                 return result
+            except HttpAbortStatusError as e:
+                logger.opt(colors=True).warning(
+                    fr'<Y><lw>HttpFetcher \<{self.__flag}></lw></Y> <lr>HttpAbortStatusError</lr> occurred '
+                    f'in <lc>get_text</lc>, status: <y>{e.status}</y>, stop retrying.')
+                return self.FetcherTextResult(
+                    error=True, info=f'Aborted with status {e.status}', status=e.status, headers=e.headers,
+                    result='')
+            except HttpRetryableStatusError as e:
+                retry_after = e.retry_after
+                logger.opt(colors=True).warning(
+                    fr'<Y><lw>HttpFetcher \<{self.__flag}></lw></Y> <lr>HttpRetryableStatusError</lr> occurred '
+                    f'in <lc>get_text</lc> attempt <y>{num_of_attempts + 1}</y>, status: <y>{e.status}</y>.')
             except TimeoutError_:
                 logger.opt(colors=True).warning(
                     fr'<Y><lw>HttpFetcher \<{self.__flag}></lw></Y> <lr>TimeoutError</lr> occurred '
@@ -221,13 +558,12 @@ class HttpFetcher(object):
                     f'in <lc>get_text</lc> attempt <y>{num_of_attempts + 1}</y>.\n<y>Error info</y>: {str(e)}')
             finally:
                 num_of_attempts += 1
-        else:
-            logger.opt(colors=True).error(
-                fr'<Y><lw>HttpFetcher \<{self.__flag}></lw></Y> <lr>ExceededAttemptNumberError</lr> '
-                f'Failed too many times in <lc>get_text</lc>.\n'
-                f'<y>url</y>: {url}\n<y>params</y>: {params}')
-            return self.FetcherTextResult(
-                error=True, info='Failed too many times in get_text', status=-1, headers={}, result='')
+        logger.opt(colors=True).error(
+            fr'<Y><lw>HttpFetcher \<{self.__flag}></lw></Y> <lr>ExceededAttemptNumberError</lr> '
+            f'Failed too many times in <lc>get_text</lc>.\n'
+            f'<y>url</y>: {url}\n<y>params</y>: {params}')
+        return self.FetcherTextResult(
+            error=True, info='Failed too many times in get_text', status=-1, headers={}, result='')
 
     async def get_bytes(
             self,
@@ -236,21 +572,40 @@ class HttpFetcher(object):
             force_proxy: bool = False,
             **kwargs: Any) -> FetcherBytesResult:
         proxy = await self.__get_proxy(always_return_proxy=force_proxy)
+        retry_after = None
         num_of_attempts = 0
         while num_of_attempts < self.__attempt_limit:
+            # 重试前按策略退避, 超出重试预算时放弃
+            if not await self.__wait_for_attempt(
+                    method='get_bytes', num_of_attempts=num_of_attempts, retry_after=retry_after):
+                break
             try:
-                async with aiohttp.ClientSession(timeout=self.__timeout) as session:
-                    async with session.get(
-                            url=url, params=params,
-                            headers=self.__headers, cookies=self.__cookies, proxy=proxy, timeout=self.__timeout,
-                            **kwargs
-                    ) as rp:
-                        result_bytes = await rp.read()
-                        status = rp.status
-                        headers = dict(rp.headers)
-                    result = self.FetcherBytesResult(
-                        error=False, info='Success', status=status, headers=headers, result=result_bytes)
+                retry_after = None
+                session = self.__get_session()
+                async with HttpRateLimiter.limit(url=url), session.get(
+                        url=url, params=params,
+                        headers=self.__headers, cookies=self.__cookies, proxy=proxy, timeout=self.__timeout,
+                        **kwargs
+                ) as rp:
+                    self.__retry_policy.check_status(status=rp.status, headers=rp.headers)
+                    result_bytes = await rp.read()
+                    status = rp.status
+                    headers = dict(rp.headers)
+                result = self.FetcherBytesResult(
+                    error=False, info='Success', status=status, headers=headers, result=result_bytes)
                 return result
+            except HttpAbortStatusError as e:
+                logger.opt(colors=True).warning(
+                    fr'<Y><lw>HttpFetcher \<{self.__flag}></lw></Y> <lr>HttpAbortStatusError</lr> occurred '
+                    f'in <lc>get_bytes</lc>, status: <y>{e.status}</y>, stop retrying.')
+                return self.FetcherBytesResult(
+                    error=True, info=f'Aborted with status {e.status}', status=e.status, headers=e.headers,
+                    result=b'')
+            except HttpRetryableStatusError as e:
+                retry_after = e.retry_after
+                logger.opt(colors=True).warning(
+                    fr'<Y><lw>HttpFetcher \<{self.__flag}></lw></Y> <lr>HttpRetryableStatusError</lr> occurred '
+                    f'in <lc>get_bytes</lc> attempt <y>{num_of_attempts + 1}</y>, status: <y>{e.status}</y>.')
             except TimeoutError_:
                 logger.opt(colors=True).warning(
                     fr'<Y><lw>HttpFetcher \<{self.__flag}></lw></Y> <lr>TimeoutError</lr> occurred '
@@ -261,13 +616,12 @@ class HttpFetcher(object):
                     f'in <lc>get_bytes</lc> attempt <y>{num_of_attempts + 1}</y>.\n<y>Error info</y>: {str(e)}')
             finally:
                 num_of_attempts += 1
-        else:
-            logger.opt(colors=True).error(
-                fr'<Y><lw>HttpFetcher \<{self.__flag}></lw></Y> <lr>ExceededAttemptNumberError</lr> '
-                f'Failed too many times in <lc>get_bytes</lc>.\n'
-                f'<y>url</y>: {url}\n<y>params</y>: {params}')
-            return self.FetcherBytesResult(
-                error=True, info='Failed too many times in get_bytes', status=-1, headers={}, result=b'')
+        logger.opt(colors=True).error(
+            fr'<Y><lw>HttpFetcher \<{self.__flag}></lw></Y> <lr>ExceededAttemptNumberError</lr> '
+            f'Failed too many times in <lc>get_bytes</lc>.\n'
+            f'<y>url</y>: {url}\n<y>params</y>: {params}')
+        return self.FetcherBytesResult(
+            error=True, info='Failed too many times in get_bytes', status=-1, headers={}, result=b'')
 
     async def post_json(
             self,
@@ -278,21 +632,40 @@ class HttpFetcher(object):
             force_proxy: bool = False,
             **kwargs: Any) -> FetcherJsonResult:
         proxy = await self.__get_proxy(always_return_proxy=force_proxy)
+        retry_after = None
         num_of_attempts = 0
         while num_of_attempts < self.__attempt_limit:
+            # 重试前按策略退避, 超出重试预算时放弃
+            if not await self.__wait_for_attempt(
+                    method='post_json', num_of_attempts=num_of_attempts, retry_after=retry_after):
+                break
             try:
-                async with aiohttp.ClientSession(timeout=self.__timeout) as session:
-                    async with session.post(
-                            url=url, params=params, json=json, data=data,
-                            headers=self.__headers, cookies=self.__cookies, proxy=proxy, timeout=self.__timeout,
-                            **kwargs
-                    ) as rp:
-                        result_json = await rp.json()
-                        status = rp.status
-                        headers = dict(rp.headers)
-                    result = self.FetcherJsonResult(
-                        error=False, info='Success', status=status, headers=headers, result=result_json)
+                retry_after = None
+                session = self.__get_session()
+                async with HttpRateLimiter.limit(url=url), session.post(
+                        url=url, params=params, json=json, data=data,
+                        headers=self.__headers, cookies=self.__cookies, proxy=proxy, timeout=self.__timeout,
+                        **kwargs
+                ) as rp:
+                    self.__retry_policy.check_status(status=rp.status, headers=rp.headers)
+                    result_json = await rp.json()
+                    status = rp.status
+                    headers = dict(rp.headers)
+                result = self.FetcherJsonResult(
+                    error=False, info='Success', status=status, headers=headers, result=result_json)
                 return result
+            except HttpAbortStatusError as e:
+                logger.opt(colors=True).warning(
+                    fr'<Y><lw>HttpFetcher \<{self.__flag}></lw></Y> <lr>HttpAbortStatusError</lr> occurred '
+                    f'in <lc>post_json</lc>, status: <y>{e.status}</y>, stop retrying.')
+                return self.FetcherJsonResult(
+                    error=True, info=f'Aborted with status {e.status}', status=e.status, headers=e.headers,
+                    result={})
+            except HttpRetryableStatusError as e:
+                retry_after = e.retry_after
+                logger.opt(colors=True).warning(
+                    fr'<Y><lw>HttpFetcher \<{self.__flag}></lw></Y> <lr>HttpRetryableStatusError</lr> occurred '
+                    f'in <lc>post_json</lc> attempt <y>{num_of_attempts + 1}</y>, status: <y>{e.status}</y>.')
             except TimeoutError_:
                 logger.opt(colors=True).warning(
                     fr'<Y><lw>HttpFetcher \<{self.__flag}></lw></Y> <lr>TimeoutError</lr> occurred '
@@ -303,13 +676,12 @@ class HttpFetcher(object):
                     f'in <lc>post_json</lc> attempt <y>{num_of_attempts + 1}</y>.\n<y>Error info</y>: {str(e)}')
             finally:
                 num_of_attempts += 1
-        else:
-            logger.opt(colors=True).error(
-                fr'<Y><lw>HttpFetcher \<{self.__flag}></lw></Y> <lr>ExceededAttemptNumberError</lr> '
-                f'Failed too many times in <lc>post_json</lc>.\n'
-                f'<y>url</y>: {url}\n<y>params</y>: {params}\n<y>json</y>: {json}\n<y>data</y>: {data}')
-            return self.FetcherJsonResult(
-                error=True, info='Failed too many times in post_json', status=-1, headers={}, result={})
+        logger.opt(colors=True).error(
+            fr'<Y><lw>HttpFetcher \<{self.__flag}></lw></Y> <lr>ExceededAttemptNumberError</lr> '
+            f'Failed too many times in <lc>post_json</lc>.\n'
+            f'<y>url</y>: {url}\n<y>params</y>: {params}\n<y>json</y>: {json}\n<y>data</y>: {data}')
+        return self.FetcherJsonResult(
+            error=True, info='Failed too many times in post_json', status=-1, headers={}, result={})
 
     async def post_text(
             self,
@@ -320,21 +692,40 @@ class HttpFetcher(object):
             force_proxy: bool = False,
             **kwargs: Any) -> FetcherTextResult:
         proxy = await self.__get_proxy(always_return_proxy=force_proxy)
+        retry_after = None
         num_of_attempts = 0
         while num_of_attempts < self.__attempt_limit:
+            # 重试前按策略退避, 超出重试预算时放弃
+            if not await self.__wait_for_attempt(
+                    method='post_text', num_of_attempts=num_of_attempts, retry_after=retry_after):
+                break
             try:
-                async with aiohttp.ClientSession(timeout=self.__timeout) as session:
-                    async with session.post(
-                            url=url, params=params, json=json, data=data,
-                            headers=self.__headers, cookies=self.__cookies, proxy=proxy, timeout=self.__timeout,
-                            **kwargs
-                    ) as rp:
-                        result_text = await rp.text()
-                        status = rp.status
-                        headers = dict(rp.headers)
-                    result = self.FetcherTextResult(
-                        error=False, info='Success', status=status, headers=headers, result=result_text)
+                retry_after = None
+                session = self.__get_session()
+                async with HttpRateLimiter.limit(url=url), session.post(
+                        url=url, params=params, json=json, data=data,
+                        headers=self.__headers, cookies=self.__cookies, proxy=proxy, timeout=self.__timeout,
+                        **kwargs
+                ) as rp:
+                    self.__retry_policy.check_status(status=rp.status, headers=rp.headers)
+                    result_text = await rp.text()
+                    status = rp.status
+                    headers = dict(rp.headers)
+                result = self.FetcherTextResult(
+                    error=False, info='Success', status=status, headers=headers, result=result_text)
                 return result
+            except HttpAbortStatusError as e:
+                logger.opt(colors=True).warning(
+                    fr'<Y><lw>HttpFetcher \<{self.__flag}></lw></Y> <lr>HttpAbortStatusError</lr> occurred '
+                    f'in <lc>post_text</lc>, status: <y>{e.status}</y>, stop retrying.')
+                return self.FetcherTextResult(
+                    error=True, info=f'Aborted with status {e.status}', status=e.status, headers=e.headers,
+                    result='')
+            except HttpRetryableStatusError as e:
+                retry_after = e.retry_after
+                logger.opt(colors=True).warning(
+                    fr'<Y><lw>HttpFetcher \<{self.__flag}></lw></Y> <lr>HttpRetryableStatusError</lr> occurred '
+                    f'in <lc>post_text</lc> attempt <y>{num_of_attempts + 1}</y>, status: <y>{e.status}</y>.')
             except TimeoutError_:
                 logger.opt(colors=True).warning(
                     fr'<Y><lw>HttpFetcher \<{self.__flag}></lw></Y> <lr>TimeoutError</lr> occurred '
@@ -345,13 +736,12 @@ class HttpFetcher(object):
                     f'in <lc>post_text</lc> attempt <y>{num_of_attempts + 1}</y>.\n<y>Error info</y>: {str(e)}')
             finally:
                 num_of_attempts += 1
-        else:
-            logger.opt(colors=True).error(
-                fr'<Y><lw>HttpFetcher \<{self.__flag}></lw></Y> <lr>ExceededAttemptNumberError</lr> '
-                f'Failed too many times in <lc>post_text</lc>.\n'
-                f'<y>url</y>: {url}\n<y>params</y>: {params}\n<y>json</y>: {json}\n<y>data</y>: {data}')
-            return self.FetcherTextResult(
-                error=True, info='Failed too many times in post_text', status=-1, headers={}, result='')
+        logger.opt(colors=True).error(
+            fr'<Y><lw>HttpFetcher \<{self.__flag}></lw></Y> <lr>ExceededAttemptNumberError</lr> '
+            f'Failed too many times in <lc>post_text</lc>.\n'
+            f'<y>url</y>: {url}\n<y>params</y>: {params}\n<y>json</y>: {json}\n<y>data</y>: {data}')
+        return self.FetcherTextResult(
+            error=True, info='Failed too many times in post_text', status=-1, headers={}, result='')
 
     async def post_bytes(
             self,
@@ -362,21 +752,40 @@ class HttpFetcher(object):
             force_proxy: bool = False,
             **kwargs: Any) -> FetcherBytesResult:
         proxy = await self.__get_proxy(always_return_proxy=force_proxy)
+        retry_after = None
         num_of_attempts = 0
         while num_of_attempts < self.__attempt_limit:
+            # 重试前按策略退避, 超出重试预算时放弃
+            if not await self.__wait_for_attempt(
+                    method='post_bytes', num_of_attempts=num_of_attempts, retry_after=retry_after):
+                break
             try:
-                async with aiohttp.ClientSession(timeout=self.__timeout) as session:
-                    async with session.post(
-                            url=url, params=params, json=json, data=data,
-                            headers=self.__headers, cookies=self.__cookies, proxy=proxy, timeout=self.__timeout,
-                            **kwargs
-                    ) as rp:
-                        result_bytes = await rp.read()
-                        status = rp.status
-                        headers = dict(rp.headers)
-                    result = self.FetcherBytesResult(
-                        error=False, info='Success', status=status, headers=headers, result=result_bytes)
+                retry_after = None
+                session = self.__get_session()
+                async with HttpRateLimiter.limit(url=url), session.post(
+                        url=url, params=params, json=json, data=data,
+                        headers=self.__headers, cookies=self.__cookies, proxy=proxy, timeout=self.__timeout,
+                        **kwargs
+                ) as rp:
+                    self.__retry_policy.check_status(status=rp.status, headers=rp.headers)
+                    result_bytes = await rp.read()
+                    status = rp.status
+                    headers = dict(rp.headers)
+                result = self.FetcherBytesResult(
+                    error=False, info='Success', status=status, headers=headers, result=result_bytes)
                 return result
+            except HttpAbortStatusError as e:
+                logger.opt(colors=True).warning(
+                    fr'<Y><lw>HttpFetcher \<{self.__flag}></lw></Y> <lr>HttpAbortStatusError</lr> occurred '
+                    f'in <lc>post_bytes</lc>, status: <y>{e.status}</y>, stop retrying.')
+                return self.FetcherBytesResult(
+                    error=True, info=f'Aborted with status {e.status}', status=e.status, headers=e.headers,
+                    result=b'')
+            except HttpRetryableStatusError as e:
+                retry_after = e.retry_after
+                logger.opt(colors=True).warning(
+                    fr'<Y><lw>HttpFetcher \<{self.__flag}></lw></Y> <lr>HttpRetryableStatusError</lr> occurred '
+                    f'in <lc>post_bytes</lc> attempt <y>{num_of_attempts + 1}</y>, status: <y>{e.status}</y>.')
             except TimeoutError_:
                 logger.opt(colors=True).warning(
                     fr'<Y><lw>HttpFetcher \<{self.__flag}></lw></Y> <lr>TimeoutError</lr> occurred '
@@ -387,10 +796,13 @@ class HttpFetcher(object):
                     f'in <lc>post_bytes</lc> attempt <y>{num_of_attempts + 1}</y>.\n<y>Error info</y>: {str(e)}')
             finally:
                 num_of_attempts += 1
-        else:
-            logger.opt(colors=True).error(
-                fr'<Y><lw>HttpFetcher \<{self.__flag}></lw></Y> <lr>ExceededAttemptNumberError</lr> '
-                f'Failed too many times in <lc>post_bytes</lc>.\n'
-                f'<y>url</y>: {url}\n<y>params</y>: {params}\n<y>json</y>: {json}\n<y>data</y>: {data}')
-            return self.FetcherBytesResult(
-                error=True, info='Failed too many times in post_bytes', status=-1, headers={}, result=b'')
+        logger.opt(colors=True).error(
+            fr'<Y><lw>HttpFetcher \<{self.__flag}></lw></Y> <lr>ExceededAttemptNumberError</lr> '
+            f'Failed too many times in <lc>post_bytes</lc>.\n'
+            f'<y>url</y>: {url}\n<y>params</y>: {params}\n<y>json</y>: {json}\n<y>data</y>: {data}')
+        return self.FetcherBytesResult(
+            error=True, info='Failed too many times in post_bytes', status=-1, headers={}, result=b'')
+
+
+# bot 关闭时释放共享连接池
+nonebot.get_driver().on_shutdown(HttpFetcher.close_session)
@@ -0,0 +1,104 @@
+"""
+HttpFetcher 按 host 限流
+令牌桶限制请求速率, 信号量限制同时进行中的请求数
+"""
+import time
+import asyncio
+import nonebot
+from contextlib import asynccontextmanager
+from typing import Dict, Optional
+from urllib.parse import urlsplit
+from nonebot import logger
+from .config import Config
+
+
+global_config = nonebot.get_driver().config
+plugin_config = Config(**global_config.dict())
+HTTP_HOST_LIMITS = plugin_config.http_host_limits
+HTTP_DEFAULT_HOST_LIMIT = plugin_config.http_default_host_limit
+
+
+class _TokenBucket(object):
+    def __init__(self, rate: float, burst: float):
+        """
+        :param rate: 每秒补充的令牌数
+        :param burst: 令牌桶容量, 即允许的突发请求数
+        """
+        self.rate = rate
+        self.capacity = max(burst, 1)
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self) -> float:
+        """
+        获取一个令牌, 令牌不足时等待
+        :return: 等待的时间(秒)
+        """
+        waited = 0.0
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+                self.updated_at = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return waited
+                delay = (1 - self.tokens) / self.rate
+                waited += delay
+                await asyncio.sleep(delay)
+
+
+class HttpRateLimiter(object):
+    __buckets: Dict[str, Optional[_TokenBucket]] = {}
+    __semaphores: Dict[str, Optional[asyncio.Semaphore]] = {}
+
+    @classmethod
+    def __host_limit(cls, host: str) -> Dict[str, float]:
+        # 优先匹配完整 host, 其次匹配上级域名, 如 i.pximg.net 可使用 pximg.net 的配置
+        parts = host.split('.')
+        for i in range(len(parts) - 1):
+            limit = HTTP_HOST_LIMITS.get('.'.join(parts[i:]))
+            if limit is not None:
+                return limit
+        return HTTP_DEFAULT_HOST_LIMIT
+
+    @classmethod
+    def __init_host(cls, host: str) -> None:
+        limit = cls.__host_limit(host)
+        rate = limit.get('rate', 0)
+        burst = limit.get('burst', rate)
+        concurrency = int(limit.get('concurrency', 0))
+        cls.__buckets[host] = _TokenBucket(rate=rate, burst=burst) if rate > 0 else None
+        cls.__semaphores[host] = asyncio.Semaphore(concurrency) if concurrency > 0 else None
+
+    @classmethod
+    @asynccontextmanager
+    async def limit(cls, url: str):
+        """
+        在发起请求前使用, 按请求 url 的 host 进行限流
+        """
+        host = urlsplit(url).hostname or ''
+        if host not in cls.__buckets:
+            cls.__init_host(host)
+
+        bucket = cls.__buckets[host]
+        semaphore = cls.__semaphores[host]
+
+        if semaphore is not None:
+            await semaphore.acquire()
+        try:
+            if bucket is not None:
+                waited = await bucket.acquire()
+                if waited > 0:
+                    logger.opt(colors=True).debug(
+                        f'<Y><lw>HttpRateLimiter</lw></Y> request to <lc>{host}</lc> delayed {waited:.2f}s')
+            yield
+        finally:
+            if semaphore is not None:
+                semaphore.release()
+
+
+__all__ = [
+    'HttpRateLimiter'
+]
@@ -0,0 +1,154 @@
+"""
+HttpFetcher 重试策略
+指数退避 + 随机抖动, 解析 Retry-After, 按状态码区分重试/放弃, 全局重试预算
+"""
+import time
+import random
+import nonebot
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from dataclasses import dataclass, field
+from typing import Optional, Mapping, FrozenSet
+from .config import Config
+
+
+global_config = nonebot.get_driver().config
+plugin_config = Config(**global_config.dict())
+HTTP_RETRY_BASE_DELAY = plugin_config.http_retry_base_delay
+HTTP_RETRY_MAX_DELAY = plugin_config.http_retry_max_delay
+HTTP_RETRY_MAX_RETRY_AFTER = plugin_config.http_retry_max_retry_after
+HTTP_RETRY_BUDGET_RATIO = plugin_config.http_retry_budget_ratio
+HTTP_RETRY_BUDGET_MIN_PER_SECOND = plugin_config.http_retry_budget_min_per_second
+HTTP_RETRY_BUDGET_MAX = plugin_config.http_retry_budget_max
+
+
+class HttpRetryableStatusError(Exception):
+    def __init__(self, status: int, retry_after: Optional[float] = None):
+        self.status = status
+        self.retry_after = retry_after
+        super(HttpRetryableStatusError, self).__init__(f'Retryable status {status}, retry after: {retry_after}')
+
+
+class HttpAbortStatusError(Exception):
+    def __init__(self, status: int, headers: dict):
+        self.status = status
+        self.headers = headers
+        super(HttpAbortStatusError, self).__init__(f'Abort with status {status}')
+
+
+@dataclass
+class RetryPolicy:
+    """
+    :param base_delay: 首次重试的退避时间基数(秒)
+    :param max_delay: 单次退避时间上限(秒)
+    :param multiplier: 退避时间增长倍数
+    :param jitter: 是否在 [0, 退避时间] 内随机取值(full jitter)
+    :param max_retry_after: 服务器要求的 Retry-After 超过该值(秒)时直接放弃重试
+    :param retry_statuses: 需要退避后重试的状态码
+    :param abort_statuses: 立即放弃且不再重试的状态码, 如 B站风控 412
+    """
+    base_delay: float = HTTP_RETRY_BASE_DELAY
+    max_delay: float = HTTP_RETRY_MAX_DELAY
+    multiplier: float = 2
+    jitter: bool = True
+    max_retry_after: float = HTTP_RETRY_MAX_RETRY_AFTER
+    retry_statuses: FrozenSet[int] = field(default_factory=lambda: frozenset({429, 500, 502, 503, 504}))
+    abort_statuses: FrozenSet[int] = field(default_factory=lambda: frozenset({412}))
+
+    @classmethod
+    def parse_retry_after(cls, value: Optional[str]) -> Optional[float]:
+        """
+        解析 Retry-After, 支持秒数及 HTTP-date 两种格式
+        """
+        if not value:
+            return None
+        try:
+            return max(float(value), 0)
+        except ValueError:
+            pass
+        try:
+            retry_at = parsedate_to_datetime(value)
+            if retry_at.tzinfo is None:
+                retry_at = retry_at.replace(tzinfo=timezone.utc)
+            return max((retry_at - datetime.now(timezone.utc)).total_seconds(), 0)
+        except (TypeError, ValueError):
+            return None
+
+    def check_status(self, status: int, headers: Mapping[str, str]) -> None:
+        """
+        在读取响应内容前调用, 需要重试或放弃时抛出对应异常
+        """
+        if status in self.abort_statuses:
+            raise HttpAbortStatusError(status=status, headers=dict(headers))
+        if status in self.retry_statuses:
+            raise HttpRetryableStatusError(
+                status=status, retry_after=self.parse_retry_after(headers.get('Retry-After')))
+
+    def get_delay(self, attempt: int, retry_after: Optional[float] = None) -> Optional[float]:
+        """
+        :param attempt: 已进行的请求次数, 从 1 开始
+        :param retry_after: 服务器要求的等待时间
+        :return: 本次重试前需等待的时间, None 表示放弃重试
+        """
+        delay = min(self.max_delay, self.base_delay * self.multiplier ** (attempt - 1))
+        if self.jitter:
+            delay = random.uniform(0, delay)
+        if retry_after is not None:
+            if retry_after > self.max_retry_after:
+                return None
+            delay = max(delay, retry_after)
+        return delay
+
+
+class RetryBudget(object):
+    def __init__(self, ratio: float, min_per_second: float, max_balance: float):
+        """
+        全局重试预算, 限制重试请求占总请求的比例, 避免上游故障时重试放大请求量
+        :param ratio: 每个新请求可为预算增加的重试次数
+        :param min_per_second: 每秒固定补充的重试次数, 保证低请求量时也能重试
+        :param max_balance: 预算上限
+        """
+        self.__ratio = ratio
+        self.__min_per_second = min_per_second
+        self.__max_balance = max_balance
+        self.__balance = max_balance
+        self.__updated_at = time.monotonic()
+
+    def __refill(self) -> None:
+        now = time.monotonic()
+        self.__balance = min(
+            self.__max_balance, self.__balance + (now - self.__updated_at) * self.__min_per_second)
+        self.__updated_at = now
+
+    def deposit(self) -> None:
+        self.__refill()
+        self.__balance = min(self.__max_balance, self.__balance + self.__ratio)
+
+    def withdraw(self) -> bool:
+        self.__refill()
+        if self.__balance >= 1:
+            self.__balance -= 1
+            return True
+        else:
+            return False
+
+    @property
+    def balance(self) -> float:
+        self.__refill()
+        return self.__balance
+
+
+# 所有 HttpFetcher 共用的全局重试预算
+retry_budget = RetryBudget(
+    ratio=HTTP_RETRY_BUDGET_RATIO,
+    min_per_second=HTTP_RETRY_BUDGET_MIN_PER_SECOND,
+    max_balance=HTTP_RETRY_BUDGET_MAX)
+
+
+__all__ = [
+    'HttpRetryableStatusError',
+    'HttpAbortStatusError',
+    'RetryPolicy',
+    'RetryBudget',
+    'retry_budget'
+]
@@ -0,0 +1,226 @@
+"""
+媒体文件磁盘缓存
+以链接的 hash 为键, 同一文件只下载一次, 缓存总大小超出上限时按 LRU 淘汰
+以 file:/// 路径发送的文件在发送队列中时被锁定, 不会被淘汰
+"""
+import os
+import re
+import time
+import asyncio
+import hashlib
+import nonebot
+from collections import OrderedDict
+from urllib.parse import urlparse
+from typing import Dict, List, Optional, Any
+from nonebot import logger
+from omega_miya.utils.Omega_Base import Result
+from .config import Config
+from .http_fetcher import HttpFetcher
+from .picture_encoder import PicEncoder
+
+
+global_config = nonebot.get_driver().config
+plugin_config = Config(**global_config.dict())
+TMP_PATH = global_config.tmp_path_
+MEDIA_CACHE_MAX_BYTES = plugin_config.media_cache_max_bytes
+MEDIA_CACHE_MAX_FILE_SIZE = plugin_config.media_cache_max_file_size
+MEDIA_CACHE_PATH = os.path.abspath(os.path.join(TMP_PATH, 'media_cache'))
+
+# 最近使用过的文件在该时间(秒)内不会被淘汰, 覆盖获取文件后到加入发送队列之间的间隔
+MEDIA_CACHE_MIN_AGE = 60
+
+_FILE_URL_PATTERN = re.compile(r'file:///([^,\]]+)')
+
+
+class MediaCache(object):
+    # key: 文件名, value: 文件大小, 按最近使用顺序排列
+    __index: Dict[str, int] = OrderedDict()
+    __total_bytes: int = 0
+    # key: 文件名, value: 最近使用时间
+    __touched_at: Dict[str, float] = {}
+    # key: 文件名, value: 引用该文件且尚未发送完成的消息数
+    __pinned: Dict[str, int] = {}
+    __inflight: Dict[str, asyncio.Task] = {}
+    __loaded: bool = False
+    __stats: Dict[str, int] = {
+        'hits': 0,
+        'misses': 0,
+        'evicted': 0,
+        'failures': 0
+    }
+
+    @classmethod
+    def make_file_name(cls, url: str) -> str:
+        key = hashlib.sha1(url.encode('utf-8')).hexdigest()
+        ext = os.path.splitext(urlparse(url).path)[1].lower()
+        if ext not in ['.jpg', '.jpeg', '.png', '.gif', '.webp', '.bmp']:
+            ext = ''
+        return f'{key}{ext}'
+
+    @classmethod
+    def __load_index(cls) -> None:
+        """
+        扫描缓存目录重建索引, 按修改时间排序, 命中时会更新修改时间
+        """
+        cls.__loaded = True
+        if not os.path.exists(MEDIA_CACHE_PATH):
+            os.makedirs(MEDIA_CACHE_PATH)
+            return
+
+        files = []
+        for entry in os.scandir(MEDIA_CACHE_PATH):
+            if entry.is_file() and not entry.name.endswith('.download'):
+                stat = entry.stat()
+                files.append((stat.st_mtime, entry.name, stat.st_size))
+        for _, file_name, size in sorted(files):
+            cls.__index[file_name] = size
+            cls.__total_bytes += size
+        cls.__evict()
+        logger.opt(colors=True).debug(
+            f'<Y><lw>MediaCache</lw></Y> loaded {len(cls.__index)} files, total {cls.__total_bytes} bytes')
+
+    @classmethod
+    def __evict(cls) -> None:
+        # 跳过发送队列中的文件, 最近使用的文件也不淘汰, 避免文件在发送前被删除
+        now = time.monotonic()
+        for file_name in list(cls.__index.keys()):
+            if cls.__total_bytes <= MEDIA_CACHE_MAX_BYTES:
+                break
+            touched_at = cls.__touched_at.get(file_name)
+            if touched_at is not None and now - touched_at < MEDIA_CACHE_MIN_AGE:
+                break
+            if cls.__pinned.get(file_name, 0) > 0:
+                continue
+            size = cls.__index.pop(file_name)
+            cls.__touched_at.pop(file_name, None)
+            cls.__total_bytes -= size
+            cls.__stats['evicted'] += 1
+            try:
+                os.remove(os.path.join(MEDIA_CACHE_PATH, file_name))
+            except FileNotFoundError:
+                pass
+            except Exception as e:
+                logger.opt(colors=True).debug(f'<Y><lw>MediaCache</lw></Y> remove {file_name} failed, {repr(e)}')
+
+    @classmethod
+    def __touch(cls, file_name: str) -> Optional[str]:
+        file_path = os.path.join(MEDIA_CACHE_PATH, file_name)
+        if file_name not in cls.__index:
+            return None
+        if not os.path.exists(file_path):
+            # 文件被外部删除
+            cls.__total_bytes -= cls.__index.pop(file_name)
+            cls.__touched_at.pop(file_name, None)
+            return None
+        cls.__index.move_to_end(file_name)
+        cls.__touched_at[file_name] = time.monotonic()
+        try:
+            os.utime(file_path)
+        except Exception:
+            pass
+        return file_path
+
+    @classmethod
+    async def __download(
+            cls, url: str, file_name: str, headers: Optional[Dict[str, str]], flag: str, **kwargs: Any
+    ) -> Result.TextResult:
+        fetcher = HttpFetcher(timeout=30, attempt_limit=2, flag=flag, headers=headers)
+        download_result = await fetcher.download_file(
+            url=url, path=MEDIA_CACHE_PATH, file_name=file_name, stream=True,
+            max_size=MEDIA_CACHE_MAX_FILE_SIZE, **kwargs)
+        if download_result.error:
+            cls.__stats['failures'] += 1
+            return Result.TextResult(error=True, info=download_result.info, result='')
+
+        size = os.path.getsize(download_result.result)
+        if file_name in cls.__index:
+            cls.__total_bytes -= cls.__index[file_name]
+        cls.__index[file_name] = size
+        cls.__index.move_to_end(file_name)
+        cls.__touched_at[file_name] = time.monotonic()
+        cls.__total_bytes += size
+        cls.__evict()
+        return Result.TextResult(error=False, info='Success', result=download_result.result)
+
+    @classmethod
+    async def get_file(
+            cls, url: str, headers: Optional[Dict[str, str]] = None, flag: str = 'media_cache', **kwargs: Any
+    ) -> Result.TextResult:
+        """
+        获取链接对应的本地缓存文件, 不存在时下载, 同一链接同时只会下载一次
+        :param url: 链接
+        :param headers: 下载时使用的 headers
+        :param flag: HttpFetcher flag
+        :return: 文件绝对路径
+        """
+        if not cls.__loaded:
+            cls.__load_index()
+
+        file_name = cls.make_file_name(url=url)
+        file_path = cls.__touch(file_name=file_name)
+        if file_path is not None:
+            cls.__stats['hits'] += 1
+            return Result.TextResult(error=False, info='Cache hit', result=file_path)
+
+        cls.__stats['misses'] += 1
+        task = cls.__inflight.get(file_name)
+        if task is None:
+            task = asyncio.create_task(
+                cls.__download(url=url, file_name=file_name, headers=headers, flag=flag, **kwargs))
+            cls.__inflight[file_name] = task
+            task.add_done_callback(lambda _: cls.__inflight.pop(file_name, None))
+        # 等待方被取消时不影响下载任务本身
+        return await asyncio.shield(task)
+
+    @classmethod
+    async def get_file_url(
+            cls, url: str, headers: Optional[Dict[str, str]] = None, flag: str = 'media_cache', **kwargs: Any
+    ) -> Result.TextResult:
+        """
+        获取链接对应的本地缓存文件, 返回可直接用于 MessageSegment.image 的文件
+        按 pic_encoder_send_file 配置返回 file:/// 路径或 base64
+        """
+        file_result = await cls.get_file(url=url, headers=headers, flag=flag, **kwargs)
+        if file_result.error:
+            return file_result
+        send_result = await PicEncoder.file_to_send(file_path=file_result.result)
+        if send_result.error:
+            return Result.TextResult(error=True, info=send_result.info, result='')
+        return Result.TextResult(error=False, info=file_result.info, result=send_result.result)
+
+    @classmethod
+    def pin(cls, message: str) -> List[str]:
+        """
+        锁定消息中以 file:/// 路径引用的缓存文件, 发送完成或放弃发送后需调用 unpin
+        :param message: 消息字符串
+        :return: 被锁定的文件名
+        """
+        file_names = []
+        for file_url in _FILE_URL_PATTERN.findall(message):
+            file_path = os.path.abspath(file_url)
+            file_name = os.path.basename(file_path)
+            if os.path.dirname(file_path) != MEDIA_CACHE_PATH or file_name in file_names:
+                continue
+            cls.__pinned[file_name] = cls.__pinned.get(file_name, 0) + 1
+            file_names.append(file_name)
+        return file_names
+
+    @classmethod
+    def unpin(cls, file_names: List[str]) -> None:
+        for file_name in file_names:
+            count = cls.__pinned.get(file_name, 0) - 1
+            if count > 0:
+                cls.__pinned[file_name] = count
+            else:
+                cls.__pinned.pop(file_name, None)
+
+    @classmethod
+    def stats(cls) -> Dict[str, int]:
+        stats = dict(cls.__stats)
+        stats.update({'files': len(cls.__index), 'total_bytes': cls.__total_bytes, 'pinned': len(cls.__pinned)})
+        return stats
+
+
+__all__ = [
+    'MediaCache'
+]
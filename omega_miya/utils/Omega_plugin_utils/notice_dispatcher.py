@@ -0,0 +1,211 @@
+"""
+订阅通知发送器
+消息按 bot 及发送对象排队, 不同发送对象之间并发发送, 同一发送对象按入队顺序发送并限制发送间隔
+每个 bot 的同时发送数受限, 仅在请求未发出的连接错误时退避重试, 其余错误及重试耗尽后进入死信队列
+"""
+import time
+import httpx
+import asyncio
+import nonebot
+from collections import deque
+from datetime import datetime
+from dataclasses import dataclass, field
+from typing import Deque, Dict, List, Tuple, Union, Any
+from nonebot import logger
+from nonebot.exception import NetworkError
+from nonebot.adapters.cqhttp.bot import Bot
+from nonebot.adapters.cqhttp import Message, MessageSegment
+from .config import Config
+from .media_cache import MediaCache
+from .picture_encoder import PicEncoder
+
+
+global_config = nonebot.get_driver().config
+plugin_config = Config(**global_config.dict())
+NOTICE_DISPATCHER_CONCURRENCY_PER_BOT = plugin_config.notice_dispatcher_concurrency_per_bot
+NOTICE_DISPATCHER_TARGET_INTERVAL = plugin_config.notice_dispatcher_target_interval
+NOTICE_DISPATCHER_MAX_RETRIES = plugin_config.notice_dispatcher_max_retries
+NOTICE_DISPATCHER_RETRY_DELAY = plugin_config.notice_dispatcher_retry_delay
+NOTICE_DISPATCHER_MAX_PENDING = plugin_config.notice_dispatcher_max_pending
+NOTICE_DISPATCHER_DEAD_LETTER_SIZE = plugin_config.notice_dispatcher_dead_letter_size
+
+
+def _is_unsent_error(e: Exception) -> bool:
+    """
+    判断发送失败时请求是否确定未发出, 只有这类错误可以安全重试
+    ActionFailed 及超时等错误发生时消息可能已经发出, 重试会导致重复发送
+    """
+    if isinstance(e, NetworkError):
+        # http 连接方式下 httpx 的异常被转换为 NetworkError, 仅建立连接阶段的异常说明请求未发出
+        return isinstance(e.__context__, (httpx.ConnectError, httpx.ConnectTimeout))
+    return isinstance(e, ConnectionError)
+
+
+@dataclass
+class NoticeJob:
+    bot: Bot
+    # group / private
+    target_type: str
+    target_id: int
+    message: Union[str, Message, MessageSegment]
+    description: str
+    attempts: int = 0
+    error: str = ''
+    created_at: datetime = field(default_factory=datetime.now)
+    # 消息中引用的媒体缓存文件及转码结果, 发送完成前不会被淘汰
+    pinned_files: List[str] = field(default_factory=list)
+    pinned_pic_files: List[str] = field(default_factory=list)
+
+    @property
+    def target_name(self) -> str:
+        return f"{'群组' if self.target_type == 'group' else '好友'}: {self.target_id}"
+
+
+class NoticeDispatcher(object):
+    # key: (bot self_id, target_type, target_id)
+    __pending: Dict[Tuple[str, str, int], Deque[NoticeJob]] = {}
+    __workers: Dict[Tuple[str, str, int], asyncio.Task] = {}
+    __bot_semaphores: Dict[str, asyncio.Semaphore] = {}
+    __dead_letters: Deque[NoticeJob] = deque(maxlen=NOTICE_DISPATCHER_DEAD_LETTER_SIZE)
+    __pending_count: int = 0
+    __stats: Dict[str, int] = {
+        'enqueued': 0,
+        'sent': 0,
+        'retried': 0,
+        'dead_lettered': 0
+    }
+
+    @classmethod
+    def __dead_letter(cls, job: NoticeJob) -> None:
+        cls.__stats['dead_lettered'] += 1
+        cls.__dead_letters.append(job)
+        logger.warning(f'向{job.target_name} 发送{job.description}失败, '
+                       f'attempts: {job.attempts}, error: {job.error}')
+
+    @classmethod
+    async def __send(cls, job: NoticeJob) -> None:
+        semaphore = cls.__bot_semaphores.get(job.bot.self_id)
+        if semaphore is None:
+            semaphore = asyncio.Semaphore(NOTICE_DISPATCHER_CONCURRENCY_PER_BOT)
+            cls.__bot_semaphores[job.bot.self_id] = semaphore
+
+        while True:
+            job.attempts += 1
+            if job.attempts > 1:
+                # bot 重连后为新的实例, 重试时使用当前连接的 bot
+                job.bot = nonebot.get_bots().get(job.bot.self_id, job.bot)
+            try:
+                async with semaphore:
+                    if job.target_type == 'group':
+                        await job.bot.call_api(api='send_group_msg', group_id=job.target_id, message=job.message)
+                    else:
+                        await job.bot.call_api(api='send_private_msg', user_id=job.target_id, message=job.message)
+                cls.__stats['sent'] += 1
+                logger.info(f'向{job.target_name} 发送{job.description}')
+                return
+            except Exception as e:
+                job.error = repr(e)
+                if not _is_unsent_error(e) or job.attempts > NOTICE_DISPATCHER_MAX_RETRIES:
+                    cls.__dead_letter(job)
+                    return
+                cls.__stats['retried'] += 1
+                logger.debug(f'向{job.target_name} 发送{job.description}失败, 即将重试, error: {job.error}')
+                await asyncio.sleep(NOTICE_DISPATCHER_RETRY_DELAY * 2 ** (job.attempts - 1))
+
+    @classmethod
+    async def __worker(cls, key: Tuple[str, str, int]) -> None:
+        queue = cls.__pending[key]
+        last_sent_at = 0.0
+        try:
+            while queue:
+                job = queue.popleft()
+                cls.__pending_count -= 1
+                # 同一发送对象的发送间隔
+                wait_time = last_sent_at + NOTICE_DISPATCHER_TARGET_INTERVAL - time.monotonic()
+                if wait_time > 0:
+                    await asyncio.sleep(wait_time)
+                try:
+                    await cls.__send(job=job)
+                except Exception as e:
+                    job.error = repr(e)
+                    cls.__dead_letter(job)
+                finally:
+                    MediaCache.unpin(job.pinned_files)
+                    PicEncoder.unpin(job.pinned_pic_files)
+                last_sent_at = time.monotonic()
+        finally:
+            del cls.__pending[key]
+            del cls.__workers[key]
+
+    @classmethod
+    def __enqueue(cls, job: NoticeJob) -> None:
+        if cls.__pending_count >= NOTICE_DISPATCHER_MAX_PENDING:
+            job.error = 'Too many pending notices'
+            cls.__dead_letter(job)
+            return
+
+        job.pinned_files = MediaCache.pin(str(job.message))
+        job.pinned_pic_files = PicEncoder.pin(str(job.message))
+        key = (job.bot.self_id, job.target_type, job.target_id)
+        if key not in cls.__pending:
+            cls.__pending[key] = deque()
+        cls.__pending[key].append(job)
+        cls.__pending_count += 1
+        cls.__stats['enqueued'] += 1
+
+        if key not in cls.__workers:
+            cls.__workers[key] = asyncio.create_task(cls.__worker(key=key))
+
+    @classmethod
+    def send_group_msg(
+            cls, bot: Bot, group_id: int, message: Union[str, Message, MessageSegment], description: str = '消息'
+    ) -> None:
+        """
+        将群组消息加入发送队列, 不等待发送完成
+        :param description: 用于日志的消息描述
+        """
+        cls.__enqueue(NoticeJob(
+            bot=bot, target_type='group', target_id=int(group_id), message=message, description=description))
+
+    @classmethod
+    def send_private_msg(
+            cls, bot: Bot, user_id: int, message: Union[str, Message, MessageSegment], description: str = '消息'
+    ) -> None:
+        """
+        将好友消息加入发送队列, 不等待发送完成
+        :param description: 用于日志的消息描述
+        """
+        cls.__enqueue(NoticeJob(
+            bot=bot, target_type='private', target_id=int(user_id), message=message, description=description))
+
+    @classmethod
+    def dead_letters(cls) -> List[NoticeJob]:
+        return list(cls.__dead_letters)
+
+    @classmethod
+    def stats(cls) -> Dict[str, Any]:
+        stats = dict(cls.__stats)
+        stats.update({'pending': cls.__pending_count, 'active_targets': len(cls.__workers)})
+        return stats
+
+    @classmethod
+    async def wait_all(cls, timeout: float = 10) -> None:
+        """
+        等待队列中的消息发送完成
+        """
+        workers = list(cls.__workers.values())
+        if not workers:
+            return
+        done, pending = await asyncio.wait(workers, timeout=timeout)
+        if pending:
+            logger.opt(colors=True).warning(
+                f'<Y><lw>NoticeDispatcher</lw></Y> {cls.__pending_count} notices not sent before timeout')
+
+
+nonebot.get_driver().on_shutdown(NoticeDispatcher.wait_all)
+
+
+__all__ = [
+    'NoticeJob',
+    'NoticeDispatcher'
+]
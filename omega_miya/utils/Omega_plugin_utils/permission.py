@@ -1,35 +1,111 @@
+import time
+import nonebot
+from typing import Dict, Tuple, Optional, Any
 from omega_miya.utils.Omega_Base import DBFriend, DBGroup, DBAuth
+from .config import Config
+
+
+global_config = nonebot.get_driver().config
+plugin_config = Config(**global_config.dict())
+PERMISSION_CACHE_TTL = plugin_config.permission_cache_ttl
+
+
+class PermissionCache(object):
+    # key: (权限类型, group_id, user_id, auth_node), value: (过期时间, 权限值)
+    __cache: Dict[Tuple[str, Optional[int], Optional[int], Optional[str]], Tuple[float, Any]] = {}
+    # 缓存条目超过该数量时清理过期条目
+    __prune_size: int = 10000
+
+    @classmethod
+    def get(cls, kind: str, group_id: int = None, user_id: int = None, auth_node: str = None) -> Optional[Any]:
+        key = (kind, group_id, user_id, auth_node)
+        entry = cls.__cache.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if time.monotonic() >= expires_at:
+            del cls.__cache[key]
+            return None
+        return value
+
+    @classmethod
+    def set(cls, value: Any, kind: str, group_id: int = None, user_id: int = None, auth_node: str = None) -> None:
+        if len(cls.__cache) >= cls.__prune_size:
+            now = time.monotonic()
+            for key in [k for k, (expires_at, _) in cls.__cache.items() if now >= expires_at]:
+                del cls.__cache[key]
+        cls.__cache[(kind, group_id, user_id, auth_node)] = (time.monotonic() + PERMISSION_CACHE_TTL, value)
+
+    @classmethod
+    def invalidate(cls, group_id: int = None, user_id: int = None) -> None:
+        """
+        清除群组或用户的权限缓存, 均为空时清除全部缓存
+        """
+        if group_id is None and user_id is None:
+            cls.__cache.clear()
+            return
+        for key in [k for k in cls.__cache.keys()
+                    if (group_id is not None and k[1] == group_id) or (user_id is not None and k[2] == user_id)]:
+            del cls.__cache[key]
+
+
+async def _group_permission(kind: str, group_id: int) -> int:
+    permission = PermissionCache.get(kind=kind, group_id=group_id)
+    if permission is not None:
+        return permission
+
+    group = DBGroup(group_id=group_id)
+    if kind == 'notice':
+        res = await group.permission_notice()
+    elif kind == 'command':
+        res = await group.permission_command()
+    else:
+        res = await group.permission_level()
+    if res.success():
+        PermissionCache.set(res.result, kind=kind, group_id=group_id)
+    return res.result
 
 
 async def check_notice_permission(group_id: int) -> bool:
-    res = await DBGroup(group_id=group_id).permission_notice()
-    if res.result == 1:
+    res = await _group_permission(kind='notice', group_id=group_id)
+    if res == 1:
         return True
     else:
         return False
 
 
 async def check_command_permission(group_id: int) -> bool:
-    res = await DBGroup(group_id=group_id).permission_command()
-    if res.result == 1:
+    res = await _group_permission(kind='command', group_id=group_id)
+    if res == 1:
         return True
     else:
         return False
 
 
 async def check_permission_level(group_id: int, level: int) -> bool:
-    res = await DBGroup(group_id=group_id).permission_level()
-    if res.result >= level:
+    res = await _group_permission(kind='level', group_id=group_id)
+    if res >= level:
         return True
     else:
         return False
 
 
 async def check_auth_node(auth_id: int, auth_type: str, auth_node: str) -> int:
-    auth = DBAuth(auth_id=auth_id, auth_type=auth_type, auth_node=auth_node)
-    tag_res = await auth.tags_info()
-    allow_tag = tag_res.result[0]
-    deny_tag = tag_res.result[1]
+    if auth_type == 'group':
+        cache_kwargs = {'group_id': auth_id, 'auth_node': auth_node}
+    else:
+        cache_kwargs = {'user_id': auth_id, 'auth_node': auth_node}
+
+    tags = PermissionCache.get(kind=f'auth_{auth_type}', **cache_kwargs)
+    if tags is None:
+        auth = DBAuth(auth_id=auth_id, auth_type=auth_type, auth_node=auth_node)
+        tag_res = await auth.tags_info()
+        tags = tag_res.result
+        # 未配置的权限节点同样缓存
+        if tag_res.success() or tag_res.info == 'NoResultFound':
+            PermissionCache.set(tags, kind=f'auth_{auth_type}', **cache_kwargs)
+    allow_tag = tags[0]
+    deny_tag = tags[1]
 
     if allow_tag == 1 and deny_tag == 0:
         return 1
@@ -40,16 +116,22 @@ async def check_auth_node(auth_id: int, auth_type: str, auth_node: str) -> int:
 
 
 async def check_friend_private_permission(user_id: int) -> bool:
-    res = await DBFriend(user_id=user_id).get_private_permission()
-    if res.error:
-        return False
-    elif res.result == 1:
+    permission = PermissionCache.get(kind='private', user_id=user_id)
+    if permission is None:
+        res = await DBFriend(user_id=user_id).get_private_permission()
+        if res.error:
+            return False
+        permission = res.result
+        PermissionCache.set(permission, kind='private', user_id=user_id)
+
+    if permission == 1:
         return True
     else:
         return False
 
 
 __all__ = [
+    'PermissionCache',
     'check_notice_permission',
     'check_command_permission',
     'check_permission_level',
@@ -1,10 +1,91 @@
+"""
+图片编码
+发送前可在进程池中转码图片: 限制最大尺寸, 重新压缩并去除元数据, 转码结果以原图内容 hash 为键缓存在磁盘
+较大图片的 base64 编码同样在进程池中进行, 与 go-cqhttp 共享文件系统时可直接发送 file:/// 路径
+以 file:/// 路径发送的转码结果在发送队列中时被锁定, 不会被淘汰
+"""
 import os
+import re
+import time
 import base64
+import asyncio
+import hashlib
+import nonebot
+from io import BytesIO
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, List, Optional
+from PIL import Image, ImageOps
 from nonebot import logger
 from dataclasses import dataclass
+from .config import Config
+
+
+global_config = nonebot.get_driver().config
+plugin_config = Config(**global_config.dict())
+TMP_PATH = global_config.tmp_path_
+PIC_ENCODER_MAX_SIZE = plugin_config.pic_encoder_max_size
+PIC_ENCODER_FORMAT = plugin_config.pic_encoder_format.upper()
+PIC_ENCODER_QUALITY = plugin_config.pic_encoder_quality
+PIC_ENCODER_WORKERS = plugin_config.pic_encoder_workers
+PIC_ENCODER_CACHE_MAX_BYTES = plugin_config.pic_encoder_cache_max_bytes
+PIC_ENCODER_SEND_FILE = plugin_config.pic_encoder_send_file
+PIC_ENCODER_CACHE_PATH = os.path.abspath(os.path.join(TMP_PATH, 'pic_encoder_cache'))
+
+# 最近使用过的转码结果在该时间(秒)内不会被淘汰, 覆盖转码完成后到加入发送队列之间的间隔
+PIC_ENCODER_CACHE_MIN_AGE = 60
+
+_FILE_URL_PATTERN = re.compile(r'file:///([^,\]]+)')
+
+
+def _transcode(image: bytes, max_size: int, image_format: str, quality: int) -> bytes:
+    """
+    在转码进程中执行, 缩放并重新压缩图片, 保存时不写入 exif 等元数据
+    动图及转码后反而更大的图片(如大面积纯色的 png)返回原图
+    """
+    with Image.open(BytesIO(image)) as img:
+        if getattr(img, 'is_animated', False):
+            return image
+        img = ImageOps.exif_transpose(img)
+        if max(img.size) > max_size:
+            img.thumbnail((max_size, max_size), Image.LANCZOS)
+
+        if image_format == 'JPEG' and img.mode != 'RGB':
+            if img.mode in ['RGBA', 'LA'] or (img.mode == 'P' and 'transparency' in img.info):
+                # 透明背景填充为白色
+                img = img.convert('RGBA')
+                background = Image.new('RGB', img.size, (255, 255, 255))
+                background.paste(img, mask=img.split()[-1])
+                img = background
+            else:
+                img = img.convert('RGB')
+        elif image_format == 'WEBP' and img.mode not in ['RGB', 'RGBA']:
+            img = img.convert('RGBA')
+
+        output = BytesIO()
+        img.save(output, format=image_format, quality=quality, optimize=True)
+        transcoded = output.getvalue()
+
+    if len(transcoded) >= len(image):
+        return image
+    return transcoded
+
+
+def _bytes_to_b64(image: bytes) -> str:
+    return 'base64://' + str(base64.b64encode(image), encoding='utf-8')
+
+
+def _file_to_b64(file_path: str) -> str:
+    # 在编码进程中读取文件, 主进程只需传入路径
+    with open(file_path, 'rb') as f:
+        return _bytes_to_b64(f.read())
 
 
 class PicEncoder(object):
+    # 小于该大小(bytes)的图片直接在当前线程编码, 进程间传输的开销大于编码本身
+    INLINE_ENCODE_SIZE = 256 * 1024
+
     @dataclass
     class __Result:
         error: bool
@@ -28,7 +109,7 @@ class PicEncoder(object):
                 b64 = base64.b64encode(f.read())
             b64 = str(b64, encoding='utf-8')
             b64 = 'base64://' + b64
-            return cls.__Result(error=True, info='Success', result=b64)
+            return cls.__Result(error=False, info='Success', result=b64)
         except Exception as e:
             logger.opt(colors=True).warning(f'<Y><lw>PicEncoder</lw></Y> file_to_b64 failed, <y>Error</y>: {repr(e)}')
             return cls.__Result(error=True, info=repr(e), result='')
@@ -43,6 +124,250 @@ class PicEncoder(object):
             logger.opt(colors=True).warning(f'<Y><lw>PicEncoder</lw></Y> bytes_to_b64 failed, <y>Error</y>: {repr(e)}')
             return cls.__Result(error=True, info=repr(e), result='')
 
+    # 转码及编码共用的进程池, 首次使用时创建
+    __pool: Optional[ProcessPoolExecutor] = None
+    # 限制提交到进程池的任务数, 避免大量待编码的图片同时驻留内存
+    __pool_semaphore: Optional[asyncio.Semaphore] = None
+    # 转码结果缓存, key: 文件名, value: 文件大小, 按最近使用顺序排列
+    __cache_index: Dict[str, int] = OrderedDict()
+    __cache_bytes: int = 0
+    __cache_loaded: bool = False
+    # key: 文件名, value: 最近使用时间
+    __cache_touched_at: Dict[str, float] = {}
+    # key: 文件名, value: 引用该文件且尚未发送完成的消息数
+    __cache_pinned: Dict[str, int] = {}
+    __inflight: Dict[str, asyncio.Task] = {}
+
+    @classmethod
+    def __get_pool(cls) -> ProcessPoolExecutor:
+        if cls.__pool is None:
+            cls.__pool = ProcessPoolExecutor(max_workers=PIC_ENCODER_WORKERS)
+        return cls.__pool
+
+    @classmethod
+    async def __run_in_pool(cls, func, *args):
+        if cls.__pool_semaphore is None:
+            cls.__pool_semaphore = asyncio.Semaphore(PIC_ENCODER_WORKERS * 2)
+        async with cls.__pool_semaphore:
+            try:
+                return await asyncio.get_running_loop().run_in_executor(cls.__get_pool(), func, *args)
+            except BrokenProcessPool:
+                # 进程异常退出后进程池不可再用, 下次使用时重新创建
+                cls.__pool = None
+                raise
+
+    @classmethod
+    async def async_bytes_to_b64(cls, image: bytes) -> __Result:
+        """
+        bytes_to_b64 的异步版本, 较大的图片在进程池中编码, 不阻塞事件循环
+        """
+        if len(image) < cls.INLINE_ENCODE_SIZE:
+            return cls.bytes_to_b64(image=image)
+        try:
+            b64 = await cls.__run_in_pool(_bytes_to_b64, image)
+            return cls.__Result(error=False, info='Success', result=b64)
+        except Exception as e:
+            logger.opt(colors=True).warning(
+                f'<Y><lw>PicEncoder</lw></Y> async_bytes_to_b64 failed, <y>Error</y>: {repr(e)}')
+            return cls.__Result(error=True, info=repr(e), result='')
+
+    @classmethod
+    async def async_file_to_b64(cls, file_path: str) -> __Result:
+        """
+        file_to_b64 的异步版本, 较大的文件在进程池中读取并编码, 不阻塞事件循环
+        """
+        abs_path = os.path.abspath(file_path)
+        if not os.path.exists(abs_path):
+            return cls.__Result(error=True, info='File not exists', result='')
+        if os.path.getsize(abs_path) < cls.INLINE_ENCODE_SIZE:
+            return cls.file_to_b64(file_path=abs_path)
+        try:
+            b64 = await cls.__run_in_pool(_file_to_b64, abs_path)
+            return cls.__Result(error=False, info='Success', result=b64)
+        except Exception as e:
+            logger.opt(colors=True).warning(
+                f'<Y><lw>PicEncoder</lw></Y> async_file_to_b64 failed, <y>Error</y>: {repr(e)}')
+            return cls.__Result(error=True, info=repr(e), result='')
+
+    @classmethod
+    async def file_to_send(cls, file_path: str) -> __Result:
+        """
+        获取可直接用于 MessageSegment.image 的文件
+        bot 与 go-cqhttp 共享文件系统时(pic_encoder_send_file)直接使用 file:/// 路径, 否则编码为 base64
+        """
+        abs_path = os.path.abspath(file_path)
+        if PIC_ENCODER_SEND_FILE:
+            if not os.path.exists(abs_path):
+                return cls.__Result(error=True, info='File not exists', result='')
+            return cls.__Result(error=False, info='Success', result=f'file:///{abs_path}')
+        return await cls.async_file_to_b64(file_path=abs_path)
+
+    @classmethod
+    async def shutdown(cls) -> None:
+        if cls.__pool is not None:
+            cls.__pool.shutdown(wait=False)
+            cls.__pool = None
+
+    @classmethod
+    def __load_cache_index(cls) -> None:
+        cls.__cache_loaded = True
+        if not os.path.exists(PIC_ENCODER_CACHE_PATH):
+            os.makedirs(PIC_ENCODER_CACHE_PATH)
+            return
+
+        files = []
+        for entry in os.scandir(PIC_ENCODER_CACHE_PATH):
+            if entry.is_file() and not entry.name.endswith('.tmp'):
+                stat = entry.stat()
+                files.append((stat.st_mtime, entry.name, stat.st_size))
+        for _, file_name, size in sorted(files):
+            cls.__cache_index[file_name] = size
+            cls.__cache_bytes += size
+        cls.__evict()
+
+    @classmethod
+    def __evict(cls) -> None:
+        # 跳过发送队列中的文件, 最近使用的文件也不淘汰, 避免文件在发送前被删除
+        now = time.monotonic()
+        for file_name in list(cls.__cache_index.keys()):
+            if cls.__cache_bytes <= PIC_ENCODER_CACHE_MAX_BYTES:
+                break
+            touched_at = cls.__cache_touched_at.get(file_name)
+            if touched_at is not None and now - touched_at < PIC_ENCODER_CACHE_MIN_AGE:
+                break
+            if cls.__cache_pinned.get(file_name, 0) > 0:
+                continue
+            size = cls.__cache_index.pop(file_name)
+            cls.__cache_touched_at.pop(file_name, None)
+            cls.__cache_bytes -= size
+            try:
+                os.remove(os.path.join(PIC_ENCODER_CACHE_PATH, file_name))
+            except FileNotFoundError:
+                pass
+            except Exception as e:
+                logger.opt(colors=True).debug(f'<Y><lw>PicEncoder</lw></Y> remove {file_name} failed, {repr(e)}')
+
+    @classmethod
+    def __cached_path(cls, file_name: str) -> Optional[str]:
+        file_path = os.path.join(PIC_ENCODER_CACHE_PATH, file_name)
+        if file_name not in cls.__cache_index:
+            return None
+        if not os.path.exists(file_path):
+            cls.__cache_bytes -= cls.__cache_index.pop(file_name)
+            cls.__cache_touched_at.pop(file_name, None)
+            return None
+        cls.__cache_index.move_to_end(file_name)
+        cls.__cache_touched_at[file_name] = time.monotonic()
+        try:
+            os.utime(file_path)
+        except Exception:
+            pass
+        return file_path
+
+    @classmethod
+    async def __transcode(cls, image: bytes, file_name: str) -> __Result:
+        try:
+            transcoded = await cls.__run_in_pool(
+                _transcode, image, PIC_ENCODER_MAX_SIZE, PIC_ENCODER_FORMAT, PIC_ENCODER_QUALITY)
+        except Exception as e:
+            logger.opt(colors=True).warning(f'<Y><lw>PicEncoder</lw></Y> transcode failed, <y>Error</y>: {repr(e)}')
+            return cls.__Result(error=True, info=repr(e), result='')
+
+        file_path = os.path.join(PIC_ENCODER_CACHE_PATH, file_name)
+        tmp_file_path = f'{file_path}.tmp'
+        try:
+            with open(tmp_file_path, 'wb') as f:
+                f.write(transcoded)
+            os.replace(tmp_file_path, file_path)
+        except Exception as e:
+            logger.opt(colors=True).warning(f'<Y><lw>PicEncoder</lw></Y> write cache failed, <y>Error</y>: {repr(e)}')
+            return cls.__Result(error=True, info=repr(e), result='')
+
+        if file_name in cls.__cache_index:
+            cls.__cache_bytes -= cls.__cache_index[file_name]
+        cls.__cache_index[file_name] = len(transcoded)
+        cls.__cache_index.move_to_end(file_name)
+        cls.__cache_touched_at[file_name] = time.monotonic()
+        cls.__cache_bytes += len(transcoded)
+        cls.__evict()
+        return cls.__Result(error=False, info='Success', result=file_path)
+
+    @classmethod
+    async def transcode(cls, image: bytes) -> __Result:
+        """
+        转码图片, 相同内容的图片只转码一次
+        :param image: 原图
+        :return: 转码后的文件绝对路径
+        """
+        if not cls.__cache_loaded:
+            cls.__load_cache_index()
+
+        key = hashlib.sha1(image).hexdigest()
+        file_name = f'{key}_{PIC_ENCODER_MAX_SIZE}_{PIC_ENCODER_QUALITY}.{PIC_ENCODER_FORMAT.lower()}'
+        file_path = cls.__cached_path(file_name=file_name)
+        if file_path is not None:
+            return cls.__Result(error=False, info='Cache hit', result=file_path)
+
+        task = cls.__inflight.get(file_name)
+        if task is None:
+            task = asyncio.create_task(cls.__transcode(image=image, file_name=file_name))
+            cls.__inflight[file_name] = task
+            task.add_done_callback(lambda _: cls.__inflight.pop(file_name, None))
+        return await asyncio.shield(task)
+
+    @classmethod
+    async def transcode_to_b64(cls, image: bytes) -> __Result:
+        """
+        转码图片后转换为 base64, 转码失败时使用原图
+        """
+        transcode_result = await cls.transcode(image=image)
+        if transcode_result.success():
+            encode_result = await cls.async_file_to_b64(file_path=transcode_result.result)
+            if encode_result.success():
+                return encode_result
+        return await cls.async_bytes_to_b64(image=image)
+
+    @classmethod
+    async def transcode_to_send(cls, image: bytes) -> __Result:
+        """
+        转码图片后获取可直接用于 MessageSegment.image 的文件, 见 file_to_send, 转码失败时使用原图
+        """
+        transcode_result = await cls.transcode(image=image)
+        if transcode_result.success():
+            send_result = await cls.file_to_send(file_path=transcode_result.result)
+            if send_result.success():
+                return send_result
+        return await cls.async_bytes_to_b64(image=image)
+
+    @classmethod
+    def pin(cls, message: str) -> List[str]:
+        """
+        锁定消息中以 file:/// 路径引用的转码结果, 发送完成或放弃发送后需调用 unpin
+        :param message: 消息字符串
+        :return: 被锁定的文件名
+        """
+        file_names = []
+        for file_url in _FILE_URL_PATTERN.findall(message):
+            file_path = os.path.abspath(file_url)
+            file_name = os.path.basename(file_path)
+            if os.path.dirname(file_path) != PIC_ENCODER_CACHE_PATH or file_name in file_names:
+                continue
+            cls.__cache_pinned[file_name] = cls.__cache_pinned.get(file_name, 0) + 1
+            file_names.append(file_name)
+        return file_names
+
+    @classmethod
+    def unpin(cls, file_names: List[str]) -> None:
+        for file_name in file_names:
+            count = cls.__cache_pinned.get(file_name, 0) - 1
+            if count > 0:
+                cls.__cache_pinned[file_name] = count
+            else:
+                cls.__cache_pinned.pop(file_name, None)
+
+
+nonebot.get_driver().on_shutdown(PicEncoder.shutdown)
+
 
 __all__ = [
     'PicEncoder'
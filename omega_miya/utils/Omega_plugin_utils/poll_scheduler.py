@@ -0,0 +1,230 @@
+"""
+订阅轮询调度器
+每个订阅单独计算下次检查时间, 按到期先后放入优先队列
+检查间隔由订阅的观测更新频率、是否处于活跃状态(如直播中)及当前时段决定
+所有调度器共用每分钟请求数预算, 预算不足时推迟检查并统计订阅的过期时间
+"""
+import time
+import heapq
+import itertools
+import nonebot
+from datetime import datetime
+from dataclasses import dataclass
+from typing import Dict, List, Tuple, Iterable, Optional, Hashable
+from nonebot import logger
+from .config import Config
+
+
+global_config = nonebot.get_driver().config
+plugin_config = Config(**global_config.dict())
+POLL_SCHEDULER_REQUESTS_PER_MINUTE = plugin_config.poll_scheduler_requests_per_minute
+POLL_SCHEDULER_QUIET_HOURS = plugin_config.poll_scheduler_quiet_hours
+POLL_SCHEDULER_QUIET_FACTOR = plugin_config.poll_scheduler_quiet_factor
+POLL_SCHEDULER_STALE_WARNING = plugin_config.poll_scheduler_stale_warning
+POLL_SCHEDULER_LAG_WARNING = plugin_config.poll_scheduler_lag_warning
+
+
+@dataclass
+class PollState:
+    interval: float
+    next_at: float
+    # 最近一次完成检查 / 检测到更新的时间(monotonic), 0 为从未
+    checked_at: float = 0
+    changed_at: float = 0
+    # 观测到的平均更新间隔(秒), 指数加权平均
+    update_gap: Optional[float] = None
+    active: bool = False
+    checks: int = 0
+    changes: int = 0
+
+
+class _RequestBudget(object):
+    def __init__(self, per_minute: float):
+        self.rate = per_minute / 60
+        self.capacity = max(per_minute / 6, 1)
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+
+    def withdraw(self, cost: float = 1) -> bool:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+        if self.tokens >= cost:
+            self.tokens -= cost
+            return True
+        else:
+            return False
+
+
+class PollScheduler(object):
+    # 所有调度器共用的请求预算
+    __budget = _RequestBudget(per_minute=POLL_SCHEDULER_REQUESTS_PER_MINUTE)
+
+    def __init__(
+            self,
+            name: str,
+            min_interval: float,
+            max_interval: float,
+            active_interval: Optional[float] = None,
+            backoff_factor: float = 1.5,
+            gap_ratio: float = 10):
+        """
+        :param name: 调度器名称, 用于日志
+        :param min_interval: 最短检查间隔(秒), 检测到更新后使用
+        :param max_interval: 最长检查间隔(秒)
+        :param active_interval: 订阅处于活跃状态时的检查间隔(秒), 默认为 min_interval
+        :param backoff_factor: 未检测到更新时检查间隔的增长倍数
+        :param gap_ratio: 检查间隔上限为平均更新间隔的 1/gap_ratio, 更新频繁的订阅不会退避到 max_interval
+        """
+        self.__name = name
+        self.__min_interval = min_interval
+        self.__max_interval = max_interval
+        self.__active_interval = min_interval if active_interval is None else active_interval
+        self.__backoff_factor = backoff_factor
+        self.__gap_ratio = gap_ratio
+        self.__states: Dict[Hashable, PollState] = {}
+        # 堆中元素: (next_at, 序号, key), 重新调度后旧元素在弹出时跳过
+        self.__heap: List[Tuple[float, int, Hashable]] = []
+        self.__counter = itertools.count()
+        self.__stale_warned: Dict[Hashable, bool] = {}
+        self.__lag_warned = False
+
+    def __push(self, key: Hashable, state: PollState) -> None:
+        heapq.heappush(self.__heap, (state.next_at, next(self.__counter), key))
+
+    @classmethod
+    def __time_factor(cls) -> float:
+        return POLL_SCHEDULER_QUIET_FACTOR if datetime.now().hour in POLL_SCHEDULER_QUIET_HOURS else 1
+
+    def sync(self, keys: Iterable[Hashable]) -> None:
+        """
+        同步订阅列表, 新订阅立即到期, 已取消的订阅移出调度
+        """
+        keys = set(keys)
+        now = time.monotonic()
+        for key in keys:
+            if key not in self.__states:
+                state = PollState(interval=self.__min_interval, next_at=now)
+                self.__states[key] = state
+                self.__push(key, state)
+        for key in [x for x in self.__states if x not in keys]:
+            del self.__states[key]
+            self.__stale_warned.pop(key, None)
+
+    def pop_due(self, limit: Optional[int] = None, batch: bool = False) -> List[Hashable]:
+        """
+        取出已到期的订阅, 按到期先后排序, 每取出一个消耗一次请求预算
+        :param limit: 最多取出的数量
+        :param batch: 调用方使用一次请求检查全部订阅, 仅消耗一次请求预算
+        :return: 需要检查的订阅, 调用方检查后需调用 report 重新调度
+        """
+        now = time.monotonic()
+        due_keys = []
+        if not self.__heap or self.__heap[0][0] > now:
+            self.__lag_warned = False
+        while self.__heap and self.__heap[0][0] <= now:
+            if limit is not None and len(due_keys) >= limit:
+                break
+            next_at, _, key = self.__heap[0]
+            state = self.__states.get(key)
+            if state is None or state.next_at != next_at:
+                heapq.heappop(self.__heap)
+                continue
+            if (not batch or not due_keys) and not self.__budget.withdraw():
+                self.__check_lag(lag=now - next_at)
+                break
+            heapq.heappop(self.__heap)
+            # 调用方未能上报结果时, 最迟在 max_interval 后再次检查
+            state.next_at = now + self.__max_interval
+            self.__push(key, state)
+            due_keys.append(key)
+        return due_keys
+
+    def __check_lag(self, lag: float) -> None:
+        # 请求预算耗尽时仍有到期订阅, 延迟过大时警告一次直到队列追上
+        if lag <= POLL_SCHEDULER_LAG_WARNING or self.__lag_warned:
+            return
+        self.__lag_warned = True
+        due_count = len([x for x in self.__states.values() if x.next_at <= time.monotonic()])
+        logger.opt(colors=True).warning(
+            fr'<Y><lw>PollScheduler \<{self.__name}></lw></Y> falling behind, {due_count} subscriptions due, '
+            f'oldest delayed {int(lag)} seconds, consider raising poll_scheduler_requests_per_minute')
+
+    def report(self, key: Hashable, changed: bool, active: Optional[bool] = None, success: bool = True) -> None:
+        """
+        上报检查结果并安排下次检查
+        :param changed: 是否检测到更新
+        :param active: 订阅是否处于活跃状态, None 为不变
+        :param success: 检查是否成功, 失败时不计入检查时间
+        """
+        state = self.__states.get(key)
+        if state is None:
+            return
+
+        now = time.monotonic()
+        if active is not None:
+            state.active = active
+        if success:
+            state.checks += 1
+            state.checked_at = now
+            self.__stale_warned.pop(key, None)
+        if changed:
+            if state.changed_at:
+                gap = now - state.changed_at
+                state.update_gap = gap if state.update_gap is None else 0.7 * state.update_gap + 0.3 * gap
+            state.changed_at = now
+            state.changes += 1
+
+        if state.active:
+            interval = self.__active_interval
+        elif changed:
+            interval = self.__min_interval
+        else:
+            ceiling = self.__max_interval
+            if state.update_gap is not None:
+                ceiling = min(ceiling, max(self.__min_interval, state.update_gap / self.__gap_ratio))
+            interval = min(ceiling, state.interval * self.__backoff_factor)
+        state.interval = interval
+        state.next_at = now + (interval if state.active else interval * self.__time_factor())
+        self.__push(key, state)
+
+    def staleness(self) -> Dict[Hashable, float]:
+        """
+        :return: 各订阅距上次成功检查的时间(秒), 从未检查的订阅为 -1
+        """
+        now = time.monotonic()
+        return {key: now - state.checked_at if state.checked_at else -1 for key, state in self.__states.items()}
+
+    def check_staleness(self) -> List[Hashable]:
+        """
+        检查长时间未能完成检查的订阅并输出警告, 每个订阅只警告一次直到恢复
+        :return: 过期的订阅
+        """
+        now = time.monotonic()
+        stale_keys = []
+        for key, state in self.__states.items():
+            if state.checked_at and now - state.checked_at > POLL_SCHEDULER_STALE_WARNING:
+                stale_keys.append(key)
+                if not self.__stale_warned.get(key):
+                    self.__stale_warned[key] = True
+                    logger.opt(colors=True).warning(
+                        fr'<Y><lw>PollScheduler \<{self.__name}></lw></Y> {key} not checked for '
+                        f'{int(now - state.checked_at)} seconds, request budget may be insufficient')
+        return stale_keys
+
+    def stats(self) -> Dict[Hashable, Dict[str, float]]:
+        now = time.monotonic()
+        return {key: {'interval': state.interval,
+                      'next_check_in': max(state.next_at - now, 0),
+                      'staleness': now - state.checked_at if state.checked_at else -1,
+                      'update_gap': state.update_gap if state.update_gap is not None else -1,
+                      'active': state.active,
+                      'checks': state.checks,
+                      'changes': state.changes}
+                for key, state in self.__states.items()}
+
+
+__all__ = [
+    'PollState',
+    'PollScheduler'
+]
@@ -2,7 +2,9 @@ from nonebot.rule import Rule
 from nonebot.typing import T_State
 from nonebot.adapters.cqhttp.bot import Bot
 from nonebot.adapters.cqhttp.event import Event
-from omega_miya.utils.Omega_Base import DBFriend, DBGroup, DBAuth
+from .permission import \
+    check_notice_permission, check_command_permission, check_permission_level, \
+    check_auth_node, check_friend_private_permission
 
 
 # Plugin permission rule
@@ -15,11 +17,7 @@ def has_notice_permission() -> Rule:
         if detail_type != 'group':
             return False
         else:
-            res = await DBGroup(group_id=group_id).permission_notice()
-            if res.result == 1:
-                return True
-            else:
-                return False
+            return await check_notice_permission(group_id=group_id)
     return Rule(_has_notice_permission)
 
 
@@ -31,11 +29,7 @@ def has_command_permission() -> Rule:
         if detail_type != 'group':
             return False
         else:
-            res = await DBGroup(group_id=group_id).permission_command()
-            if res.result == 1:
-                return True
-            else:
-                return False
+            return await check_command_permission(group_id=group_id)
     return Rule(_has_command_permission)
 
 
@@ -48,11 +42,7 @@ def permission_level(level: int) -> Rule:
         if detail_type != 'group':
             return False
         else:
-            res = await DBGroup(group_id=group_id).permission_level()
-            if res.result >= level:
-                return True
-            else:
-                return False
+            return await check_permission_level(group_id=group_id, level=level)
     return Rule(_has_permission_level)
 
 
@@ -65,20 +55,13 @@ def has_auth_node(*auth_nodes: str) -> Rule:
         user_id = event.dict().get('user_id')
         # 检查当前消息类型
         if detail_type == 'private':
-            user_auth = DBAuth(auth_id=user_id, auth_type='user', auth_node=auth_node)
-            user_tag_res = await user_auth.tags_info()
-            allow_tag = user_tag_res.result[0]
-            deny_tag = user_tag_res.result[1]
+            auth_checker = await check_auth_node(auth_id=user_id, auth_type='user', auth_node=auth_node)
         elif detail_type == 'group' or detail_type == 'group_upload':
-            group_auth = DBAuth(auth_id=group_id, auth_type='group', auth_node=auth_node)
-            group_tag_res = await group_auth.tags_info()
-            allow_tag = group_tag_res.result[0]
-            deny_tag = group_tag_res.result[1]
+            auth_checker = await check_auth_node(auth_id=group_id, auth_type='group', auth_node=auth_node)
         else:
-            allow_tag = 0
-            deny_tag = 0
+            auth_checker = -1
 
-        if allow_tag == 1 and deny_tag == 0:
+        if auth_checker == 1:
             return True
         else:
             return False
@@ -102,30 +85,19 @@ def has_level_or_node(level: int, *auth_nodes: str) -> Rule:
         if detail_type != 'group':
             level_checker = False
         else:
-            level_res = await DBGroup(group_id=group_id).permission_level()
-            if level_res.result >= level:
-                level_checker = True
-            else:
-                level_checker = False
+            level_checker = await check_permission_level(group_id=group_id, level=level)
 
         # node检查部分
         if detail_type == 'private':
-            user_auth = DBAuth(auth_id=user_id, auth_type='user', auth_node=auth_node)
-            user_tag_res = await user_auth.tags_info()
-            allow_tag = user_tag_res.result[0]
-            deny_tag = user_tag_res.result[1]
+            auth_checker = await check_auth_node(auth_id=user_id, auth_type='user', auth_node=auth_node)
         elif detail_type == 'group':
-            group_auth = DBAuth(auth_id=group_id, auth_type='group', auth_node=auth_node)
-            group_tag_res = await group_auth.tags_info()
-            allow_tag = group_tag_res.result[0]
-            deny_tag = group_tag_res.result[1]
+            auth_checker = await check_auth_node(auth_id=group_id, auth_type='group', auth_node=auth_node)
         else:
-            allow_tag = 0
-            deny_tag = 0
+            auth_checker = -1
 
-        if allow_tag == 1 and deny_tag == 0:
+        if auth_checker == 1:
             return True
-        elif allow_tag == -2 and deny_tag == -2:
+        elif auth_checker == 0:
             return level_checker
         else:
             return False
@@ -141,11 +113,7 @@ def has_friend_private_permission() -> Rule:
         if detail_type != 'private':
             return False
         else:
-            res = await DBFriend(user_id=user_id).get_private_permission()
-            if res.result == 1:
-                return True
-            else:
-                return False
+            return await check_friend_private_permission(user_id=user_id)
     return Rule(_has_friend_private_permission)
 
 
@@ -1,77 +1,314 @@
+"""
+压缩包打包
+在独立的进程池中打包, 打包进程从队列中逐个读取文件, 文件下载完成后即可加入压缩包, 无需等待全部下载完成
+加入第一个文件时才开始占用打包进程, 已有全部文件时 create_zip_file / create_7z_file 使用单独的进程池一次写入
+jpg / png 等已压缩的文件使用存储模式
+"""
 import os
 import zipfile
 import py7zr
 import asyncio
-from typing import List
+import nonebot
+import multiprocessing
+from queue import Empty
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing.managers import SyncManager
+from typing import List, Set, Optional
 from nonebot.log import logger
 from omega_miya.utils.Omega_Base import Result
+from .config import Config
 
 
-def __create_zip_file(files: List[str], file_path: str, file_name: str) -> Result.TextResult:
-    # 检查文件路径
-    folder_path = os.path.abspath(file_path)
-    if not os.path.exists(folder_path):
-        os.makedirs(folder_path)
-    zip_file_path = os.path.abspath(os.path.join(folder_path, f'{file_name}.zip'))
-    with zipfile.ZipFile(zip_file_path, mode='w', compression=zipfile.ZIP_STORED) as zipf:
-        for file in files:
-            file_path = os.path.abspath(file)
-            arcname = os.path.basename(file_path)
-            if os.path.exists(file_path):
-                zipf.write(file_path, arcname=arcname)
-            else:
-                logger.warning(f'create_zip_file: file not exists: {file}, ignore')
+global_config = nonebot.get_driver().config
+plugin_config = Config(**global_config.dict())
+ARCHIVE_WORKERS = plugin_config.archive_workers
 
-    return Result.TextResult(error=False, info=f'{file_name}.zip', result=zip_file_path)
+# 已压缩的文件格式, 再次压缩几乎没有收益
+STORED_EXTENSIONS = ['.jpg', '.jpeg', '.png', '.gif', '.webp', '.zip', '.7z', '.mp4']
 
+# 打包进程等待新文件的最长时间(秒), 超时视为调用方已放弃并中止打包, 避免一直占用进程
+ARCHIVE_IDLE_TIMEOUT = 600
+
+# 队列指令
+_ARCHIVE_ADD = 'add'
+_ARCHIVE_CLOSE = 'close'
+_ARCHIVE_ABORT = 'abort'
+
+
+def _open_archive(archive_path: str, archive_type: str, password: Optional[str]):
+    if archive_type == '7z':
+        # 7z 不支持逐个文件设置压缩方式, 压缩包内容以图片为主, 统一使用存储模式
+        archive = py7zr.SevenZipFile(
+            archive_path, mode='w', password=password,
+            filters=[{'id': py7zr.FILTER_COPY}, {'id': py7zr.FILTER_CRYPTO_AES256_SHA256}])
+        archive.set_encrypted_header(True)
+    else:
+        archive = zipfile.ZipFile(archive_path, mode='w', compression=zipfile.ZIP_STORED)
+    return archive
 
-async def create_zip_file(files: List[str], file_path: str, file_name: str) -> Result.TextResult:
-    def __handle():
-        return __create_zip_file(files, file_path, file_name)
 
-    loop = asyncio.get_running_loop()
+def _archive_file(archive, archive_type: str, file: str) -> bool:
+    """
+    :return: 文件不存在时返回 False
+    """
+    file_path = os.path.abspath(file)
+    arcname = os.path.basename(file_path)
+    if not os.path.exists(file_path):
+        return False
+    elif archive_type == '7z':
+        archive.write(file_path, arcname=arcname)
+    elif os.path.splitext(arcname)[1].lower() in STORED_EXTENSIONS:
+        archive.write(file_path, arcname=arcname, compress_type=zipfile.ZIP_STORED)
+    else:
+        archive.write(file_path, arcname=arcname, compress_type=zipfile.ZIP_DEFLATED)
+    return True
+
+
+def _write_archive(archive_path: str, archive_type: str, password: Optional[str], queue) -> Optional[List[str]]:
+    """
+    在打包进程中执行, 从队列读取文件逐个写入压缩包, 完成后再重命名为正式文件名
+    :return: 不存在而被跳过的文件, 中止或等待超时时返回 None
+    """
+    tmp_archive_path = f'{archive_path}.tmp'
+    skipped = []
+    aborted = False
+    archive = _open_archive(tmp_archive_path, archive_type, password)
+
     try:
-        result = await loop.run_in_executor(None, __handle)
-    except Exception as e:
-        result = Result.TextResult(error=True, info=f'create_zip_file failed: {repr(e)}', result='')
+        while True:
+            try:
+                command, file = queue.get(timeout=ARCHIVE_IDLE_TIMEOUT)
+            except Empty:
+                aborted = True
+                break
+            if command == _ARCHIVE_ABORT:
+                aborted = True
+                break
+            elif command == _ARCHIVE_CLOSE:
+                break
 
-    return result
+            if not _archive_file(archive, archive_type, file):
+                skipped.append(file)
+    except Exception:
+        aborted = True
+        raise
+    finally:
+        archive.close()
+        if aborted:
+            os.remove(tmp_archive_path)
+
+    if aborted:
+        return None
+    os.replace(tmp_archive_path, archive_path)
+    return skipped
 
 
-def __create_7z_file(files: List[str], file_path: str, file_name: str, password: str) -> Result.TextResult:
-    # 检查文件路径
-    folder_path = os.path.abspath(file_path)
-    if not os.path.exists(folder_path):
-        os.makedirs(folder_path)
-    z7z_file_path = os.path.abspath(os.path.join(folder_path, f'{file_name}.7z'))
-    with py7zr.SevenZipFile(z7z_file_path, mode='w', password=password) as zf:
-        zf.set_encrypted_header(True)
+def _write_archive_files(archive_path: str, archive_type: str, password: Optional[str], files: List[str]) -> List[str]:
+    """
+    在打包进程中执行, 一次写入全部文件
+    :return: 不存在而被跳过的文件
+    """
+    tmp_archive_path = f'{archive_path}.tmp'
+    skipped = []
+    archive = _open_archive(tmp_archive_path, archive_type, password)
+    try:
+        arcnames = set()
         for file in files:
-            file_path = os.path.abspath(file)
-            arcname = os.path.basename(file_path)
-            if os.path.exists(file_path):
-                zf.write(file_path, arcname=arcname)
-            else:
-                logger.warning(f'create_zip_file: file not exists: {file}, ignore')
+            arcname = os.path.basename(os.path.abspath(file))
+            if arcname in arcnames:
+                continue
+            arcnames.add(arcname)
+            if not _archive_file(archive, archive_type, file):
+                skipped.append(file)
+    except Exception:
+        archive.close()
+        os.remove(tmp_archive_path)
+        raise
+    archive.close()
+    os.replace(tmp_archive_path, archive_path)
+    return skipped
 
-    return Result.TextResult(error=False, info=f'{file_name}.7z', result=z7z_file_path)
 
+class StreamingArchive(object):
+    # 打包进程池及向打包进程传递文件的队列管理进程, 首次使用时创建
+    # 已有全部文件的一次性打包使用单独的进程池, 不与流式打包争抢进程
+    __pool: Optional[ProcessPoolExecutor] = None
+    __oneshot_pool: Optional[ProcessPoolExecutor] = None
+    __manager: Optional[SyncManager] = None
 
-async def create_7z_file(files: List[str], file_path: str, file_name: str, password: str) -> Result.TextResult:
-    def __handle():
-        return __create_7z_file(files, file_path, file_name, password)
+    @classmethod
+    def __get_pool(cls) -> ProcessPoolExecutor:
+        if cls.__pool is None:
+            cls.__pool = ProcessPoolExecutor(max_workers=ARCHIVE_WORKERS)
+        return cls.__pool
+
+    @classmethod
+    def __get_oneshot_pool(cls) -> ProcessPoolExecutor:
+        if cls.__oneshot_pool is None:
+            cls.__oneshot_pool = ProcessPoolExecutor(max_workers=ARCHIVE_WORKERS)
+        return cls.__oneshot_pool
+
+    @classmethod
+    def __get_manager(cls) -> SyncManager:
+        if cls.__manager is None:
+            cls.__manager = multiprocessing.Manager()
+        return cls.__manager
+
+    @classmethod
+    async def write_files(
+            cls, files: List[str], file_path: str, file_name: str,
+            archive_type: str = 'zip', password: Optional[str] = None) -> Result.TextResult:
+        """
+        已有全部文件时一次写入压缩包, 使用单独的进程池
+        :return: info: 压缩包文件名, result: 压缩包绝对路径
+        """
+        if archive_type not in ['zip', '7z']:
+            raise ValueError(f'Unsupported archive type: {archive_type}')
+
+        folder_path = os.path.abspath(file_path)
+        if not os.path.exists(folder_path):
+            os.makedirs(folder_path)
+        archive_name = f'{file_name}.{archive_type}'
+        archive_path = os.path.abspath(os.path.join(folder_path, archive_name))
+        try:
+            skipped = await asyncio.get_running_loop().run_in_executor(
+                cls.__get_oneshot_pool(), _write_archive_files, archive_path, archive_type, password, files)
+        except BrokenProcessPool as e:
+            cls.__oneshot_pool = None
+            return Result.TextResult(error=True, info=f'create archive failed: {repr(e)}', result='')
+        except Exception as e:
+            return Result.TextResult(error=True, info=f'create archive failed: {repr(e)}', result='')
+
+        for file in skipped:
+            logger.warning(f'StreamingArchive: file not exists: {file}, ignore')
+        return Result.TextResult(error=False, info=archive_name, result=archive_path)
 
-    loop = asyncio.get_running_loop()
+    @classmethod
+    async def shutdown(cls) -> None:
+        if cls.__pool is not None:
+            cls.__pool.shutdown(wait=False)
+            cls.__pool = None
+        if cls.__oneshot_pool is not None:
+            cls.__oneshot_pool.shutdown(wait=False)
+            cls.__oneshot_pool = None
+        if cls.__manager is not None:
+            cls.__manager.shutdown()
+            cls.__manager = None
 
+    def __init__(self, file_path: str, file_name: str, archive_type: str = 'zip', password: Optional[str] = None):
+        """
+        创建压缩包, 加入第一个文件时才开始打包, 需在事件循环中创建
+        :param file_path: 压缩包所在文件夹路径
+        :param file_name: 压缩包文件名, 不含扩展名
+        :param archive_type: zip 或 7z
+        :param password: 7z 压缩包密码
+        """
+        if archive_type not in ['zip', '7z']:
+            raise ValueError(f'Unsupported archive type: {archive_type}')
+
+        folder_path = os.path.abspath(file_path)
+        if not os.path.exists(folder_path):
+            os.makedirs(folder_path)
+        self.__archive_name = f'{file_name}.{archive_type}'
+        self.__archive_path = os.path.abspath(os.path.join(folder_path, self.__archive_name))
+        self.__archive_type = archive_type
+        self.__password = password
+        self.__arcnames: Set[str] = set()
+        self.__loop = asyncio.get_running_loop()
+        self.__queue = None
+        self.__future: Optional[asyncio.Future] = None
+        self.__closed = False
+
+    def __start(self) -> None:
+        # 下载期间不占用打包进程, 有文件需要写入时再提交打包任务
+        if self.__future is None:
+            self.__queue = self.__get_manager().Queue()
+            self.__future = self.__loop.run_in_executor(
+                self.__get_pool(), _write_archive,
+                self.__archive_path, self.__archive_type, self.__password, self.__queue)
+
+    def add(self, file: str) -> None:
+        """
+        将文件加入压缩包, 不等待写入完成, 同名文件只加入一次
+        """
+        if self.__closed:
+            raise RuntimeError('Archive already closed')
+        arcname = os.path.basename(os.path.abspath(file))
+        if arcname in self.__arcnames:
+            return
+        self.__arcnames.add(arcname)
+        self.__start()
+        self.__queue.put((_ARCHIVE_ADD, file))
+
+    async def close(self) -> Result.TextResult:
+        """
+        等待全部文件写入完成
+        :return: info: 压缩包文件名, result: 压缩包绝对路径
+        """
+        if not self.__closed:
+            self.__closed = True
+            # 没有加入任何文件时也生成空压缩包
+            self.__start()
+            self.__queue.put((_ARCHIVE_CLOSE, None))
+        elif self.__future is None:
+            return Result.TextResult(error=True, info='Archive aborted', result='')
+        try:
+            skipped = await self.__future
+        except BrokenProcessPool as e:
+            # 打包进程异常退出后进程池不可再用, 下次使用时重新创建
+            StreamingArchive.__pool = None
+            return Result.TextResult(error=True, info=f'create archive failed: {repr(e)}', result='')
+        except Exception as e:
+            return Result.TextResult(error=True, info=f'create archive failed: {repr(e)}', result='')
+
+        if skipped is None:
+            return Result.TextResult(error=True, info='Archive aborted', result='')
+        for file in skipped:
+            logger.warning(f'StreamingArchive: file not exists: {file}, ignore')
+        return Result.TextResult(error=False, info=self.__archive_name, result=self.__archive_path)
+
+    async def abort(self) -> None:
+        """
+        中止打包并删除未完成的压缩包
+        """
+        if self.__future is None:
+            self.__closed = True
+            return
+        if not self.__closed:
+            self.__closed = True
+            self.__queue.put((_ARCHIVE_ABORT, None))
+        try:
+            await self.__future
+        except Exception as e:
+            logger.debug(f'StreamingArchive: abort {self.__archive_name} with error: {repr(e)}')
+
+
+async def create_zip_file(files: List[str], file_path: str, file_name: str) -> Result.TextResult:
     try:
-        result = await loop.run_in_executor(None, __handle)
+        result = await StreamingArchive.write_files(
+            files=files, file_path=file_path, file_name=file_name, archive_type='zip')
+    except Exception as e:
+        result = Result.TextResult(error=True, info=f'create_zip_file failed: {repr(e)}', result='')
+
+    return result
+
+
+async def create_7z_file(files: List[str], file_path: str, file_name: str, password: str) -> Result.TextResult:
+    try:
+        result = await StreamingArchive.write_files(
+            files=files, file_path=file_path, file_name=file_name, archive_type='7z', password=password)
     except Exception as e:
         result = Result.TextResult(error=True, info=f'create_7z_file failed: {repr(e)}', result='')
 
     return result
 
 
+nonebot.get_driver().on_shutdown(StreamingArchive.shutdown)
+
+
 __all__ = [
+    'StreamingArchive',
     'create_zip_file',
     'create_7z_file'
 ]
@@ -1,4 +1,8 @@
 import json
+import time
+import asyncio
+from collections import OrderedDict
+from typing import Dict, Tuple
 from nonebot import logger
 from omega_miya.utils.Omega_plugin_utils import HttpFetcher
 from omega_miya.utils.Omega_Base import Result
@@ -14,6 +18,13 @@ class BiliDynamic(object):
     __HEADERS.update({'origin': 'https://t.bilibili.com',
                       'referer': 'https://t.bilibili.com/'})
 
+    # 已解析的动态信息缓存, 转发动态获取原动态时使用
+    # key: dynamic_id, value: (过期时间, DynamicInfo)
+    __INFO_CACHE_TTL = 3600
+    __INFO_CACHE_SIZE = 512
+    __info_cache: Dict[int, Tuple[float, BiliInfo.DynamicInfo]] = OrderedDict()
+    __info_inflight: Dict[int, asyncio.Task] = {}
+
     def __init__(self, dynamic_id: int):
         self.dynamic_id = dynamic_id
 
@@ -45,6 +56,38 @@ class BiliDynamic(object):
         except Exception as e:
             return Result.DictResult(error=True, info=repr(e), result={})
 
+    async def __fetch_parsed_info(self) -> BiliResult.DynamicInfoResult:
+        info_result = await self.get_info()
+        if info_result.error:
+            return BiliResult.DynamicInfoResult(error=True, info=info_result.info, result=None)
+        parse_result = self.data_parser(dynamic_data=info_result.result)
+        if parse_result.success():
+            self.__info_cache[int(self.dynamic_id)] = (time.monotonic() + self.__INFO_CACHE_TTL, parse_result.result)
+            self.__info_cache.move_to_end(int(self.dynamic_id))
+            while len(self.__info_cache) > self.__INFO_CACHE_SIZE:
+                self.__info_cache.popitem(last=False)
+        return parse_result
+
+    async def get_parsed_info(self) -> BiliResult.DynamicInfoResult:
+        """
+        获取并解析动态信息, 结果缓存一段时间, 同一动态同时只会请求一次
+        """
+        dynamic_id = int(self.dynamic_id)
+        cached = self.__info_cache.get(dynamic_id)
+        if cached is not None:
+            expires_at, dynamic_info = cached
+            if time.monotonic() < expires_at:
+                self.__info_cache.move_to_end(dynamic_id)
+                return BiliResult.DynamicInfoResult(error=False, info='Cache hit', result=dynamic_info)
+            del self.__info_cache[dynamic_id]
+
+        task = self.__info_inflight.get(dynamic_id)
+        if task is None:
+            task = asyncio.create_task(self.__fetch_parsed_info())
+            self.__info_inflight[dynamic_id] = task
+            task.add_done_callback(lambda _: self.__info_inflight.pop(dynamic_id, None))
+        return await asyncio.shield(task)
+
     @classmethod
     def data_parser(cls, dynamic_data: dict) -> BiliResult.DynamicInfoResult:
         """
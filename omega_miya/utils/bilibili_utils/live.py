@@ -1,4 +1,5 @@
 from typing import List, Union
+import asyncio
 import datetime
 from nonebot import logger
 from omega_miya.utils.Omega_plugin_utils import HttpFetcher
@@ -11,6 +12,8 @@ class BiliLiveRoom(object):
     __LIVE_BY_UIDS_API_URL = 'https://api.live.bilibili.com/room/v1/Room/get_status_info_by_uids'
     __USER_INFO_API_URL = 'https://api.bilibili.com/x/space/acc/info'
     __LIVE_URL = 'https://live.bilibili.com/'
+    # get_status_info_by_uids 单次请求的 uid 数量
+    __LIVE_BY_UIDS_CHUNK_SIZE = 100
 
     def __init__(self, room_id: int):
         self.room_id = room_id
@@ -56,9 +59,27 @@ class BiliLiveRoom(object):
     @classmethod
     async def get_info_by_uids(cls, uid_list: List[Union[int, str]]) -> BiliResult.LiveRoomDictInfoResult:
         """
-        :param uid_list: uid 列表
+        :param uid_list: uid 列表, 超出单次请求数量时分批请求
         :return: result: {直播间房间号: 直播间信息}
         """
+        if len(uid_list) > cls.__LIVE_BY_UIDS_CHUNK_SIZE:
+            chunks = [uid_list[i:i + cls.__LIVE_BY_UIDS_CHUNK_SIZE]
+                      for i in range(0, len(uid_list), cls.__LIVE_BY_UIDS_CHUNK_SIZE)]
+            chunk_results = await asyncio.gather(*[cls.get_info_by_uids(uid_list=chunk) for chunk in chunks])
+            result = {}
+            errors = []
+            for chunk_result in chunk_results:
+                if chunk_result.error:
+                    errors.append(chunk_result.info)
+                else:
+                    result.update(chunk_result.result)
+            # 全部失败时才返回错误, 部分失败时返回已获取的结果
+            if len(errors) == len(chunks):
+                return BiliResult.LiveRoomDictInfoResult(error=True, info='; '.join(errors), result=None)
+            for info in errors:
+                logger.warning(f'BiliLiveRoom: get live info by uids partly failed, error info: {info}')
+            return BiliResult.LiveRoomDictInfoResult(error=False, info='Success', result=result)
+
         payload = {'uids': uid_list}
         fetcher = HttpFetcher(
             timeout=10, flag='bilibili_live_list_users_live', headers=BiliRequestUtils.HEADERS)
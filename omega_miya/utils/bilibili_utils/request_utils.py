@@ -1,5 +1,5 @@
 from nonebot import get_driver
-from omega_miya.utils.Omega_plugin_utils import HttpFetcher, PicEncoder
+from omega_miya.utils.Omega_plugin_utils import HttpFetcher, MediaCache, PicEncoder
 from omega_miya.utils.Omega_Base import Result
 
 
@@ -87,13 +87,27 @@ class BiliRequestUtils(object):
         if bytes_result.error:
             return Result.TextResult(error=True, info='Image download failed', result='')
 
-        encode_result = PicEncoder.bytes_to_b64(image=bytes_result.result)
+        encode_result = await PicEncoder.transcode_to_send(image=bytes_result.result)
 
         if encode_result.success():
             return Result.TextResult(error=False, info='Success', result=encode_result.result)
         else:
             return Result.TextResult(error=True, info=encode_result.info, result='')
 
+    @classmethod
+    # 下载图片到本地缓存, 按 pic_encoder_send_file 配置返回 file:/// 路径或 base64
+    async def pic_to_file(cls, url: str) -> Result.TextResult:
+        headers = {'user-agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) '
+                                 'Chrome/89.0.4389.114 Safari/537.36',
+                   'origin': 'https://www.bilibili.com',
+                   'referer': 'https://www.bilibili.com/'}
+
+        file_result = await MediaCache.get_file_url(url=url, headers=headers, flag='bilibili_get_image')
+        if file_result.success():
+            return Result.TextResult(error=False, info='Success', result=file_result.result)
+        else:
+            return Result.TextResult(error=True, info='Image download failed', result='')
+
 
 __all__ = [
     'BiliRequestUtils'
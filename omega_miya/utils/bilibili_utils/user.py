@@ -70,7 +70,8 @@ class BiliUser(object):
         else:
             paras = {'host_uid': self.user_id, 'offset_dynamic_id': 0, 'need_top': 0, 'platform': 'web'}
 
-        fetcher = HttpFetcher(timeout=10, flag='bilibili_live', headers=__HEADERS, cookies=cookies)
+        # 动态需要实时检查, 仅使用条件请求
+        fetcher = HttpFetcher(timeout=10, flag='bilibili_live', headers=__HEADERS, cookies=cookies, cache_ttl=0)
         result = await fetcher.get_json(url=self.__DYNAMIC_API_URL, params=paras)
 
         if result.error:
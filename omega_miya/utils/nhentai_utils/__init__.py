@@ -8,7 +8,7 @@ import aiofiles
 from dataclasses import dataclass
 from bs4 import BeautifulSoup
 from nonebot import logger, get_driver
-from omega_miya.utils.Omega_plugin_utils import HttpFetcher, create_7z_file
+from omega_miya.utils.Omega_plugin_utils import HttpFetcher, StreamingArchive
 from omega_miya.utils.Omega_Base import Result
 
 global_config = get_driver().config
@@ -209,68 +209,87 @@ class NhentaiGallery(Nhentai):
         })
         fetcher = HttpFetcher(timeout=30, flag='nhentai_download_image', headers=headers)
 
-        # 每个切片任务数量为10, 每个切片打包一个任务
-        pool = 10
-        downloaded_list = []
-        failed_num = 0
-        for i in range(0, total_page_count, pool):
-            # 产生请求序列
-            tasks = []
-            for page in gallery_pages[i:i + pool]:
-                logger.debug(f'Nhentai | Downloading: {self.gallery_id}/{page} ...')
-                url = f'https://i.nhentai.net/galleries/{media_id}/{page.index}.{page.type_}'
-                file_name = os.path.basename(url)
-                if not file_name:
-                    file_name = f'{page.index}.tmp'
-
-                # 检测文件是否已经存在避免重复下载
-                if os.path.exists(os.path.abspath(os.path.join(file_path, file_name))):
-                    downloaded_list.append(os.path.abspath(os.path.join(file_path, file_name)))
-                    logger.debug(f'Nhentai | File: {self.gallery_id}/{file_name} exists, pass.')
-                    continue
-
-                tasks.append(fetcher.download_file(url=url, path=file_path, file_name=file_name))
-
-            # 开始下载
-            download_result = await asyncio.gather(*tasks)
-            downloaded_list.extend([x.result for x in download_result if x.success()])
-            failed_num += len([x for x in download_result if x.error])
-
-        logger.debug(f'Nhentai | Gallery download completed, succeed: {downloaded_list}, failed number: {failed_num}')
-        if failed_num > 0:
-            return Result.DictResult(error=True, info=f'{failed_num} page(s) download failed', result={})
-
-        # 生成包含本子原始信息的文件
-        manifest_path = os.path.abspath(os.path.join(file_path, f'manifest.json'))
-        async with aiofiles.open(manifest_path, 'w') as f:
-            await f.write(json.dumps(gallery))
-        downloaded_list.append(manifest_path)
-
-        # 生成一段随机字符串改变打包后压缩文件的hash
-        rand_str = ''.join(random.choices(string.ascii_letters + string.digits, k=1024))
-        rand_file = os.path.abspath(os.path.join(file_path, f'mask'))
-        async with aiofiles.open(rand_file, 'w') as f:
-            await f.write(rand_str)
-        downloaded_list.append(rand_file)
-
         # 生成压缩包随机密码
         password_str = ''.join(random.sample(string.ascii_letters + string.digits, k=8))
         password_file = os.path.abspath(os.path.join(file_path, f'password'))
-        async with aiofiles.open(password_file, 'w') as f:
-            await f.write(password_str)
-
-        # 打包
-        c7z_result = await create_7z_file(
-            files=downloaded_list, file_path=file_path, file_name=str(self.gallery_id), password=password_str)
-        if c7z_result.error:
-            return Result.DictResult(error=True, info=f'创建压缩文件失败, error: {c7z_result.info}', result={})
-        else:
-            result = {
-                'password': password_str,
-                'file_name': c7z_result.info,
-                'file_path': c7z_result.result
-            }
-            return Result.DictResult(error=False, info='Success', result=result)
+
+        # 每页下载完成后立即加入压缩包
+        archive = StreamingArchive(
+            file_path=file_path, file_name=str(self.gallery_id), archive_type='7z', password=password_str)
+
+        async def download_and_archive(url_: str, file_name_: str) -> Result.TextResult:
+            result_ = await fetcher.download_file(url=url_, path=file_path, file_name=file_name_, stream=True)
+            if result_.success():
+                archive.add(result_.result)
+            return result_
+
+        try:
+            # 每个切片任务数量为10, 每个切片打包一个任务
+            pool = 10
+            downloaded_list = []
+            failed_num = 0
+            for i in range(0, total_page_count, pool):
+                # 产生请求序列
+                tasks = []
+                for page in gallery_pages[i:i + pool]:
+                    logger.debug(f'Nhentai | Downloading: {self.gallery_id}/{page} ...')
+                    url = f'https://i.nhentai.net/galleries/{media_id}/{page.index}.{page.type_}'
+                    file_name = os.path.basename(url)
+                    if not file_name:
+                        file_name = f'{page.index}.tmp'
+
+                    # 检测文件是否已经存在避免重复下载
+                    if os.path.exists(os.path.abspath(os.path.join(file_path, file_name))):
+                        downloaded_list.append(os.path.abspath(os.path.join(file_path, file_name)))
+                        archive.add(os.path.abspath(os.path.join(file_path, file_name)))
+                        logger.debug(f'Nhentai | File: {self.gallery_id}/{file_name} exists, pass.')
+                        continue
+
+                    tasks.append(download_and_archive(url_=url, file_name_=file_name))
+
+                # 开始下载
+                download_result = await asyncio.gather(*tasks)
+                downloaded_list.extend([x.result for x in download_result if x.success()])
+                failed_num += len([x for x in download_result if x.error])
+
+            logger.debug(
+                f'Nhentai | Gallery download completed, succeed: {downloaded_list}, failed number: {failed_num}')
+            if failed_num > 0:
+                await archive.abort()
+                return Result.DictResult(error=True, info=f'{failed_num} page(s) download failed', result={})
+
+            # 生成包含本子原始信息的文件
+            manifest_path = os.path.abspath(os.path.join(file_path, f'manifest.json'))
+            async with aiofiles.open(manifest_path, 'w') as f:
+                await f.write(json.dumps(gallery))
+            archive.add(manifest_path)
+
+            # 生成一段随机字符串改变打包后压缩文件的hash
+            rand_str = ''.join(random.choices(string.ascii_letters + string.digits, k=1024))
+            rand_file = os.path.abspath(os.path.join(file_path, f'mask'))
+            async with aiofiles.open(rand_file, 'w') as f:
+                await f.write(rand_str)
+            archive.add(rand_file)
+
+            async with aiofiles.open(password_file, 'w') as f:
+                await f.write(password_str)
+
+            # 等待打包完成
+            c7z_result = await archive.close()
+            if c7z_result.error:
+                return Result.DictResult(
+                    error=True, info=f'创建压缩文件失败, error: {c7z_result.info}', result={})
+            else:
+                result = {
+                    'password': password_str,
+                    'file_name': c7z_result.info,
+                    'file_path': c7z_result.result
+                }
+                return Result.DictResult(error=False, info='Success', result=result)
+        except BaseException:
+            # 下载出错或被取消时中止打包, 释放打包进程并删除未完成的压缩包
+            await archive.abort()
+            raise
 
 
 __all__ = [
@@ -1,10 +1,12 @@
 from .pixiv import Pixiv, PixivIllust
+from .illust_cache import PixivIllustCache
 from .pixivision import Pixivision, PixivisionArticle
 
 
 __all__ = [
     'Pixiv',
     'PixivIllust',
+    'PixivIllustCache',
     'Pixivision',
     'PixivisionArticle'
 ]
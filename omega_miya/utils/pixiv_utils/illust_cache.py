@@ -0,0 +1,169 @@
+"""
+Pixiv 作品信息缓存
+以 pid 为键缓存解析后的作品信息, 内存 LRU + 磁盘两级
+未超过 FRESH_TTL 的缓存直接使用, 超过 FRESH_TTL 但未超过 STALE_TTL 的缓存先返回再在后台刷新
+"""
+import os
+import json
+import copy
+import time
+import asyncio
+import aiofiles
+from collections import OrderedDict
+from typing import Dict, Tuple, Callable, Awaitable, Optional
+from nonebot import logger, get_driver
+from omega_miya.utils.Omega_Base import Result
+
+
+global_config = get_driver().config
+TMP_PATH = global_config.tmp_path_
+ILLUST_CACHE_PATH = os.path.abspath(os.path.join(TMP_PATH, 'pixiv_illust_cache'))
+
+
+class PixivIllustCache(object):
+    FRESH_TTL = 86400
+    STALE_TTL = 86400 * 30
+    MEMORY_SIZE = 1024
+
+    # key: pid, value: (获取时间戳, 作品信息)
+    __memory_cache: Dict[int, Tuple[float, dict]] = OrderedDict()
+    __inflight: Dict[int, asyncio.Task] = {}
+    __stats: Dict[str, int] = {
+        'hits': 0,
+        'stale_hits': 0,
+        'misses': 0
+    }
+
+    @classmethod
+    def __disk_path(cls, pid: int) -> str:
+        return os.path.join(ILLUST_CACHE_PATH, f'{pid}.json')
+
+    @classmethod
+    def __memory_set(cls, pid: int, fetched_at: float, illust_data: dict) -> None:
+        cls.__memory_cache[pid] = (fetched_at, illust_data)
+        cls.__memory_cache.move_to_end(pid)
+        while len(cls.__memory_cache) > cls.MEMORY_SIZE:
+            cls.__memory_cache.popitem(last=False)
+
+    @classmethod
+    async def __load(cls, pid: int) -> Optional[Tuple[float, dict]]:
+        cached = cls.__memory_cache.get(pid)
+        if cached is not None:
+            cls.__memory_cache.move_to_end(pid)
+            return cached
+
+        disk_path = cls.__disk_path(pid)
+        if not os.path.exists(disk_path):
+            return None
+        try:
+            async with aiofiles.open(disk_path, 'r', encoding='utf-8') as f:
+                data = json.loads(await f.read())
+            cached = (float(data['fetched_at']), dict(data['illust_data']))
+        except Exception as e:
+            logger.opt(colors=True).debug(f'<Y><lw>PixivIllustCache</lw></Y> load disk cache failed, {repr(e)}')
+            return None
+
+        if time.time() - cached[0] > cls.STALE_TTL:
+            cls.invalidate(pid=pid)
+            return None
+
+        cls.__memory_set(pid, *cached)
+        return cached
+
+    @classmethod
+    async def __save(cls, pid: int, illust_data: dict) -> None:
+        fetched_at = time.time()
+        cls.__memory_set(pid, fetched_at, illust_data)
+        try:
+            if not os.path.exists(ILLUST_CACHE_PATH):
+                os.makedirs(ILLUST_CACHE_PATH)
+            async with aiofiles.open(cls.__disk_path(pid), 'w', encoding='utf-8') as f:
+                await f.write(json.dumps({'fetched_at': fetched_at, 'illust_data': illust_data}, ensure_ascii=False))
+        except Exception as e:
+            logger.opt(colors=True).debug(f'<Y><lw>PixivIllustCache</lw></Y> write disk cache failed, {repr(e)}')
+
+    @classmethod
+    async def __fetch(cls, pid: int, fetcher: Callable[[], Awaitable[Result.DictResult]]) -> Result.DictResult:
+        result = await fetcher()
+        if result.success():
+            await cls.__save(pid=pid, illust_data=result.result)
+        return result
+
+    @classmethod
+    def __fetch_task(cls, pid: int, fetcher: Callable[[], Awaitable[Result.DictResult]]) -> asyncio.Task:
+        task = cls.__inflight.get(pid)
+        if task is None:
+            task = asyncio.create_task(cls.__fetch(pid=pid, fetcher=fetcher))
+            cls.__inflight[pid] = task
+            task.add_done_callback(lambda _: cls.__inflight.pop(pid, None))
+        return task
+
+    @classmethod
+    async def get(cls, pid: int, fetcher: Callable[[], Awaitable[Result.DictResult]]) -> Result.DictResult:
+        """
+        获取作品信息, 同一作品同时只会请求一次
+        :param pid: 作品 pid
+        :param fetcher: 缓存不可用时获取作品信息的协程函数
+        :return: 作品信息的副本, 调用方可以随意修改
+        """
+        cached = await cls.__load(pid=pid)
+        if cached is not None:
+            fetched_at, illust_data = cached
+            if time.time() - fetched_at > cls.FRESH_TTL:
+                cls.__stats['stale_hits'] += 1
+                # 后台刷新, 失败时继续使用旧缓存
+                cls.__fetch_task(pid=pid, fetcher=fetcher)
+            else:
+                cls.__stats['hits'] += 1
+            return Result.DictResult(error=False, info='Cache hit', result=copy.deepcopy(illust_data))
+
+        cls.__stats['misses'] += 1
+        result = await asyncio.shield(cls.__fetch_task(pid=pid, fetcher=fetcher))
+        if result.error:
+            return result
+        return Result.DictResult(error=False, info=result.info, result=copy.deepcopy(result.result))
+
+    @classmethod
+    def invalidate(cls, pid: int) -> None:
+        cls.__memory_cache.pop(pid, None)
+        try:
+            os.remove(cls.__disk_path(pid))
+        except FileNotFoundError:
+            pass
+
+    @classmethod
+    def __prune(cls) -> int:
+        if not os.path.exists(ILLUST_CACHE_PATH):
+            return 0
+        count = 0
+        expired_at = time.time() - cls.STALE_TTL
+        for entry in os.scandir(ILLUST_CACHE_PATH):
+            if entry.is_file() and entry.stat().st_mtime < expired_at:
+                os.remove(entry.path)
+                count += 1
+        return count
+
+    @classmethod
+    async def prune(cls) -> None:
+        """
+        清理过期的磁盘缓存, 文件较多时扫描耗时, 在线程池中执行
+        """
+        try:
+            count = await asyncio.get_running_loop().run_in_executor(None, cls.__prune)
+            logger.opt(colors=True).debug(f'<Y><lw>PixivIllustCache</lw></Y> pruned {count} expired cache files')
+        except Exception as e:
+            logger.opt(colors=True).error(f'<Y><lw>PixivIllustCache</lw></Y> prune cache failed, {repr(e)}')
+
+    @classmethod
+    def stats(cls) -> Dict[str, int]:
+        stats = dict(cls.__stats)
+        stats.update({'memory_entries': len(cls.__memory_cache), 'inflight': len(cls.__inflight)})
+        return stats
+
+
+get_driver().on_startup(PixivIllustCache.prune)
+
+
+__all__ = [
+    'PixivIllustCache'
+]
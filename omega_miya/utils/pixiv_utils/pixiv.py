@@ -3,9 +3,11 @@ import os
 import json
 import asyncio
 import aiofiles
+from typing import Optional
 from nonebot import logger, get_driver
-from omega_miya.utils.Omega_plugin_utils import HttpFetcher, PicEncoder, create_zip_file
+from omega_miya.utils.Omega_plugin_utils import HttpFetcher, PicEncoder, StreamingArchive
 from omega_miya.utils.Omega_Base import Result
+from .illust_cache import PixivIllustCache
 
 global_config = get_driver().config
 TMP_PATH = global_config.tmp_path_
@@ -40,7 +42,7 @@ class Pixiv(object):
     async def daily_ranking(cls) -> Result.DictResult:
         payload_daily = {'format': 'json', 'mode': 'daily',
                          'content': 'illust', 'p': 1}
-        fetcher = HttpFetcher(timeout=10, flag='pixiv_utils_daily_ranking', headers=cls.HEADERS)
+        fetcher = HttpFetcher(timeout=10, flag='pixiv_utils_daily_ranking', headers=cls.HEADERS, cache_ttl=3600)
         daily_ranking_result = await fetcher.get_json(url=cls.RANKING_URL, params=payload_daily)
         if daily_ranking_result.error:
             return Result.DictResult(
@@ -71,7 +73,7 @@ class Pixiv(object):
     async def weekly_ranking(cls) -> Result.DictResult:
         payload_weekly = {'format': 'json', 'mode': 'weekly',
                           'content': 'illust', 'p': 1}
-        fetcher = HttpFetcher(timeout=10, flag='pixiv_utils_weekly_ranking', headers=cls.HEADERS)
+        fetcher = HttpFetcher(timeout=10, flag='pixiv_utils_weekly_ranking', headers=cls.HEADERS, cache_ttl=3600)
         weekly_ranking_result = await fetcher.get_json(url=cls.RANKING_URL, params=payload_weekly)
         if weekly_ranking_result.error:
             return Result.DictResult(
@@ -102,7 +104,7 @@ class Pixiv(object):
     async def monthly_ranking(cls) -> Result.DictResult:
         payload_monthly = {'format': 'json', 'mode': 'monthly',
                            'content': 'illust', 'p': 1}
-        fetcher = HttpFetcher(timeout=10, flag='pixiv_utils_monthly_ranking', headers=cls.HEADERS)
+        fetcher = HttpFetcher(timeout=10, flag='pixiv_utils_monthly_ranking', headers=cls.HEADERS, cache_ttl=3600)
         monthly_ranking_result = await fetcher.get_json(url=cls.RANKING_URL, params=payload_monthly)
         if monthly_ranking_result.error:
             return Result.DictResult(
@@ -137,8 +139,16 @@ class PixivIllust(Pixiv):
         self.__illust_data: dict = {}
 
     # 获取作品完整信息（pixiv api 获取 json）
-    # 返回格式化后的作品信息
+    # 返回格式化后的作品信息, 优先使用缓存
     async def get_illust_data(self) -> Result.DictResult:
+        illust_data_result = await PixivIllustCache.get(pid=self.__pid, fetcher=self.__fetch_illust_data)
+        if illust_data_result.success():
+            # 保存对象状态便于其他方法调用
+            self.__is_loaded = True
+            self.__illust_data.update(illust_data_result.result)
+        return illust_data_result
+
+    async def __fetch_illust_data(self) -> Result.DictResult:
         illust_url = f'{self.ILLUST_DATA_URL}{self.__pid}'
         illust_artworks_url = f'{self.ILLUST_ARTWORK_URL}{self.__pid}'
 
@@ -147,8 +157,10 @@ class PixivIllust(Pixiv):
 
         fetcher = HttpFetcher(timeout=10, flag='pixiv_utils_illust', headers=headers, cookies=COOKIES)
 
-        # 获取作品信息
-        illust_data_result = await fetcher.get_json(url=illust_url)
+        # 同时获取作品信息和多张图作品图片列表
+        illust_page_url = illust_url + '/pages'
+        illust_data_result, illust_pages_result = await asyncio.gather(
+            fetcher.get_json(url=illust_url), fetcher.get_json(url=illust_page_url))
         if illust_data_result.error:
             return Result.DictResult(error=True, info=f'Fetch illust data failed, {illust_data_result.info}', result={})
 
@@ -156,9 +168,6 @@ class PixivIllust(Pixiv):
         if illust_data_result.result.get('error') or not illust_data_result.result:
             return Result.DictResult(error=True, info=f'PixivApiError: {illust_data_result.result}', result={})
 
-        # 获取多张图作品图片列表
-        illust_page_url = illust_url + '/pages'
-        illust_pages_result = await fetcher.get_json(url=illust_page_url)
         if illust_pages_result.error:
             return Result.DictResult(
                 error=True, info=f'Fetch illust pages failed, {illust_pages_result.info}', result={})
@@ -251,10 +260,6 @@ class PixivIllust(Pixiv):
                 'is_r18': is_r18
             }
 
-            # 保存对象状态便于其他方法调用
-            self.__is_loaded = True
-            self.__illust_data.update(result)
-
             return Result.DictResult(error=False, info='Success', result=result)
         except Exception as e:
             logger.error(f'PixivIllust | Parse illust data failed, error: {repr(e)}')
@@ -300,13 +305,54 @@ class PixivIllust(Pixiv):
         if bytes_result.error:
             return Result.TextResult(error=True, info='Image download failed', result='')
 
-        encode_result = PicEncoder.bytes_to_b64(image=bytes_result.result)
+        if original:
+            # 请求原图时不转码, 避免被缩小及重新压缩
+            encode_result = await PicEncoder.async_bytes_to_b64(image=bytes_result.result)
+        else:
+            encode_result = await PicEncoder.transcode_to_send(image=bytes_result.result)
 
         if encode_result.success():
             return Result.TextResult(error=False, info=info, result=encode_result.result)
         else:
             return Result.TextResult(error=True, info=encode_result.info, result='')
 
+    async def download_pic(
+            self, path: str, file_name: Optional[str] = None, original: bool = False) -> Result.TextResult:
+        """
+        下载作品首张图片
+        :param path: 下载文件夹路径
+        :param file_name: 文件名, 默认使用图片链接中的文件名
+        :param original: 下载原图, 默认下载 pixiv 缩放后的 regular 图片
+        :return: 文件绝对路径
+        """
+        illust_data_result = await self.get_illust_data()
+        if illust_data_result.error:
+            return Result.TextResult(error=True, info='Fetch illust data failed', result='')
+
+        if original:
+            url = illust_data_result.result.get('orig_url')
+        else:
+            url = illust_data_result.result.get('regular_url')
+
+        if not file_name:
+            file_name = os.path.basename(url)
+            if not file_name:
+                file_name = f'{self.__pid}.tmp'
+
+        headers = self.HEADERS.copy()
+        headers.update({
+            'sec-fetch-dest': 'image',
+            'sec-fetch-mode': 'no-cors',
+            'sec-fetch-site': 'cross-site'
+        })
+
+        fetcher = HttpFetcher(timeout=30, attempt_limit=2, flag='pixiv_utils_download_pic', headers=headers)
+        download_result = await fetcher.download_file(url=url, path=path, file_name=file_name, stream=True)
+        if download_result.success():
+            return Result.TextResult(error=False, info='Success', result=download_result.result)
+        else:
+            return Result.TextResult(error=True, info=download_result.info, result='')
+
     async def download_illust(self, page: int = None) -> Result.TextResult:
         """
         :param page: 仅下载特定页码
@@ -349,36 +395,51 @@ class PixivIllust(Pixiv):
             if not file_name:
                 file_name = f'{self.__pid}.tmp'
 
-            download_result = await fetcher.download_file(url=download_url_list[0], path=file_path, file_name=file_name)
+            download_result = await fetcher.download_file(
+                url=download_url_list[0], path=file_path, file_name=file_name, stream=True)
             if download_result.success():
                 return Result.TextResult(error=False, info=file_name, result=download_result.result)
             else:
                 return Result.TextResult(error=True, info=download_result.info, result='')
         elif len(download_url_list) > 1:
-            tasks = []
-            for url in download_url_list:
-                file_name = os.path.basename(url)
-                if not file_name:
-                    file_name = f'{self.__pid}.tmp'
-                tasks.append(fetcher.download_file(url=url, path=file_path, file_name=file_name))
-            download_result = await asyncio.gather(*tasks)
-            downloaded_list = [x.result for x in download_result if x.success()]
-            failed_num = len([x for x in download_result if x.error])
-            if len(downloaded_list) != len(download_url_list):
-                return Result.TextResult(error=True, info=f'{failed_num} illust download failed', result='')
-
-            # 动图额外保存原始ugoira_meta信息
-            if illust_type == 2:
-                pid = illust_data_result.result.get('pid')
-                ugoira_meta = illust_data_result.result.get('ugoira_meta')
-                ugoira_meta_file = os.path.abspath(os.path.join(file_path, f'{pid}_ugoira_meta'))
-                async with aiofiles.open(ugoira_meta_file, 'w') as f:
-                    await f.write(json.dumps(ugoira_meta))
-                downloaded_list.append(ugoira_meta_file)
-
-            # 打包
-            zip_result = await create_zip_file(files=downloaded_list, file_path=file_path, file_name=str(self.__pid))
-            return zip_result
+            # 每个文件下载完成后立即加入压缩包
+            archive = StreamingArchive(file_path=file_path, file_name=str(self.__pid), archive_type='zip')
+
+            async def download_and_archive(url_: str, file_name_: str) -> Result.TextResult:
+                result_ = await fetcher.download_file(url=url_, path=file_path, file_name=file_name_, stream=True)
+                if result_.success():
+                    archive.add(result_.result)
+                return result_
+
+            try:
+                tasks = []
+                for url in download_url_list:
+                    file_name = os.path.basename(url)
+                    if not file_name:
+                        file_name = f'{self.__pid}.tmp'
+                    tasks.append(download_and_archive(url_=url, file_name_=file_name))
+                download_result = await asyncio.gather(*tasks)
+                failed_num = len([x for x in download_result if x.error])
+                if failed_num > 0:
+                    await archive.abort()
+                    return Result.TextResult(error=True, info=f'{failed_num} illust download failed', result='')
+
+                # 动图额外保存原始ugoira_meta信息
+                if illust_type == 2:
+                    pid = illust_data_result.result.get('pid')
+                    ugoira_meta = illust_data_result.result.get('ugoira_meta')
+                    ugoira_meta_file = os.path.abspath(os.path.join(file_path, f'{pid}_ugoira_meta'))
+                    async with aiofiles.open(ugoira_meta_file, 'w') as f:
+                        await f.write(json.dumps(ugoira_meta))
+                    archive.add(ugoira_meta_file)
+
+                # 等待打包完成
+                zip_result = await archive.close()
+                return zip_result
+            except BaseException:
+                # 下载出错或被取消时中止打包, 释放打包进程并删除未完成的压缩包
+                await archive.abort()
+                raise
         else:
             return Result.TextResult(error=True, info='Get illust url failed', result='')
 
@@ -28,7 +28,9 @@ class Pixivision(object):
 
     @classmethod
     async def get_illustration_list(cls) -> Result.ListResult:
-        fetcher = HttpFetcher(timeout=10, flag='pixivision_utils_illustration_list', headers=cls.HEADERS)
+        # 列表页频繁轮询, 仅使用条件请求避免重复下载未变化的页面
+        fetcher = HttpFetcher(
+            timeout=10, flag='pixivision_utils_illustration_list', headers=cls.HEADERS, cache_ttl=0)
         html_result = await fetcher.get_text(url=cls.ILLUSTRATION_URL, params={'lang': 'zh'})
         if html_result.error:
             return Result.ListResult(error=True, info=f'Fetch illustration list failed, {html_result.info}', result=[])
@@ -62,7 +64,9 @@ class PixivisionArticle(Pixivision):
 
     async def get_article_info(self) -> Result.DictResult:
         url = f'{self.ARTICLES_URL}/{self.__aid}'
-        fetcher = HttpFetcher(timeout=10, flag='pixivision_utils_article_info', headers=self.HEADERS)
+        # 特辑发布后内容基本不再变化
+        fetcher = HttpFetcher(
+            timeout=10, flag='pixivision_utils_article_info', headers=self.HEADERS, cache_ttl=86400)
         html_result = await fetcher.get_text(url=url, params={'lang': 'zh'})
         if html_result.error:
             return Result.DictResult(error=True, info=f'Fetch article info failed, {html_result.info}', result={})
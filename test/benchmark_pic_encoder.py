@@ -0,0 +1,67 @@
+"""
+PicEncoder base64 编码事件循环阻塞测试
+对比在协程中直接编码 (bytes_to_b64) 与在进程池中编码 (async_bytes_to_b64) 时事件循环的最大延迟
+
+测试期间另一协程每 1ms 醒来一次, 记录实际醒来时间与预期时间的最大差值, 即事件循环被阻塞的最长时间
+python test/benchmark_pic_encoder.py 10 5
+"""
+import sys
+import time
+import base64
+import asyncio
+from typing import Tuple, Optional
+from concurrent.futures import ProcessPoolExecutor
+
+
+def bytes_to_b64(image: bytes) -> str:
+    return 'base64://' + str(base64.b64encode(image), encoding='utf-8')
+
+
+async def monitor_loop_lag(stop: asyncio.Event, interval: float = 0.001) -> float:
+    max_lag = 0.0
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        max_lag = max(max_lag, time.perf_counter() - start - interval)
+    return max_lag
+
+
+async def run_encode(image: bytes, times: int, pool: Optional[ProcessPoolExecutor] = None) -> Tuple[float, float]:
+    stop = asyncio.Event()
+    monitor = asyncio.create_task(monitor_loop_lag(stop))
+    # 等待监视协程开始运行
+    await asyncio.sleep(0.01)
+
+    start = time.perf_counter()
+    for _ in range(times):
+        if pool is None:
+            bytes_to_b64(image)
+            # 与实际使用时一样, 编码之间会让出事件循环
+            await asyncio.sleep(0)
+        else:
+            await asyncio.get_running_loop().run_in_executor(pool, bytes_to_b64, image)
+    cost = time.perf_counter() - start
+
+    stop.set()
+    max_lag = await monitor
+    return cost, max_lag
+
+
+async def main(size_mb: float, times: int):
+    image = bytes(bytearray(range(256)) * int(size_mb * 1024 * 1024 / 256))
+    with ProcessPoolExecutor(max_workers=2) as pool:
+        # 预热进程池
+        await asyncio.get_running_loop().run_in_executor(pool, bytes_to_b64, b'')
+
+        sync_cost, sync_lag = await run_encode(image, times=times)
+        pool_cost, pool_lag = await run_encode(image, times=times, pool=pool)
+
+    print(f'Image size: {size_mb}MB, encode times: {times}')
+    print(f'bytes_to_b64 (in loop): total {sync_cost:.4f}s, max loop lag {sync_lag * 1000:.1f}ms')
+    print(f'async_bytes_to_b64 (process pool): total {pool_cost:.4f}s, max loop lag {pool_lag * 1000:.1f}ms')
+
+
+if __name__ == '__main__':
+    size = float(sys.argv[1]) if len(sys.argv) > 1 else 10
+    count = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    asyncio.run(main(size_mb=size, times=count))